@@ -13,6 +13,7 @@ setup(name='memory-analysis-tk',
       author='Adam Pridgen',
       author_email='adam.pridgen.phd@gmail.com',
       install_requires=['wheel'],
+      extras_require={'numpy': ['numpy'], 'elf': ['pyelftools']},
       packages=find_packages('src'),
       package_dir={'': 'src'},
 )
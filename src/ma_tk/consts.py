@@ -2,3 +2,40 @@ MASK_64BIT = 0xffffffffffffffff
 MASK_32BIT = 0xffffffff
 
 
+
+# how reads spanning several memory maps treat unmapped gaps
+GAP_RAISE = 'raise'
+GAP_ZERO = 'zero'
+GAP_TRUNCATE = 'truncate'
+
+# shared block cache for file and zip backed memory maps
+BLOCK_CACHE_SIZE = 64 * 1024 * 1024
+BLOCK_CACHE_BLOCK_SIZE = 64 * 1024
+
+# BaseManager.read_many coalescing limits
+READ_MANY_MAX_GAP = 4096
+READ_MANY_MAX_READ = 1024 * 1024
+
+# bytes of a memory map processed at a time by the scanners
+SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+# longest regex match that is guaranteed to be found across chunk boundaries
+SEARCH_MAX_MATCH = 4096
+
+# block size used when exporting memory maps to disk
+DUMP_BLOCK_SIZE = 4 * 1024 * 1024
+
+# compressed in-memory memory maps
+COMPRESSED_BLOCK_SIZE = 64 * 1024
+COMPRESSED_HOT_BLOCKS = 16
+
+# seekable zip members, uncompressed bytes between decompressor
+# checkpoints and the size of compressed reads
+ZIP_CHECKPOINT_INTERVAL = 4 * 1024 * 1024
+ZIP_READ_SIZE = 64 * 1024
+
+# most descriptors the process wide handle pool keeps open
+HANDLE_POOL_MAX_OPEN = 256
+
+# threads serving BaseManager's asyncio reads
+ASYNC_READ_WORKERS = 8
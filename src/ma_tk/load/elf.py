@@ -2,15 +2,94 @@ import os
 import io
 from elftools.elf.elffile import ELFFile
 from .file import OpenFile, FileObj, FileLoader
+from .elfcache import ElfMetadata
 
 class OpenELF(OpenFile):
 
     @classmethod
     def create_segment_lookup(cls, file_info):
+        # the same Segment tuples a metadata cache hit provides, the
+        # pyelftools segments are available from get_file_interpreter()
         ef = file_info.get_file_interpreter()
-        x = {i.header.p_offset: i for i in ef.iter_segments()}
-        segments_by_offset = x
-        setattr(file_info, 'segments_by_offset', segments_by_offset)
+        segments = ElfMetadata.read_segments(ef)
+        file_info.update_file_segments({s.p_offset: s for s in segments})
+
+    @classmethod
+    def interpret(cls, file_info, metadata_cache=None):
+        '''
+        attach an ELFFile and the segment lookup to an opened file.  on
+        a metadata cache hit nothing is parsed, the ELFFile is only
+        created if it is asked for.
+        '''
+        md = cls.get_cached_metadata(file_info, metadata_cache)
+        if md is not None:
+            file_info.set_interp_klass(ELFFile)
+            file_info.file_type = 'elf'
+            file_info.elf_metadata = md
+            file_info.update_file_segments(md.get_segments_by_offset())
+            return file_info
+        file_info.set_file_interpreter(ELFFile(file_info.get_fd()), file_type='elf')
+        cls.create_segment_lookup(file_info)
+        return file_info
+
+    @classmethod
+    def get_cached_metadata(cls, file_info, metadata_cache):
+        path = cls.get_cache_path(file_info)
+        if metadata_cache is None or path is None:
+            return None
+        return metadata_cache.get(path)
+
+    @classmethod
+    def get_cache_path(cls, file_info):
+        # only plain files have a stable (path, size, mtime) key
+        source = file_info.get_source()
+        if source is None or not source.startswith('file://'):
+            return None
+        return source[len('file://'):]
+
+    @classmethod
+    def get_metadata(cls, file_info, metadata_cache=None):
+        '''
+        ElfMetadata of an opened ELF file, parsed at most once and taken
+        from or stored in metadata_cache when given
+        '''
+        md = getattr(file_info, 'elf_metadata', None)
+        if md is None:
+            md = cls.get_cached_metadata(file_info, metadata_cache)
+        if md is None:
+            md = ElfMetadata.from_elffile(file_info.get_file_interpreter())
+            path = cls.get_cache_path(file_info)
+            if metadata_cache is not None and path is not None:
+                try:
+                    metadata_cache.put(path, md)
+                except OSError:
+                    # a read only or full cache only costs a re-parse
+                    pass
+        file_info.elf_metadata = md
+        return md
+
+    @classmethod
+    def get_file_mappings(cls, file_info):
+        '''
+        (vm_start, vm_end, file offset, filename) for every entry of
+        the NT_FILE notes of a core file
+        '''
+        ef = file_info.get_file_interpreter()
+        mappings = []
+        for segment in ef.iter_segments():
+            if segment.header.p_type != 'PT_NOTE':
+                continue
+            for note in segment.iter_notes():
+                if note['n_type'] != 'NT_FILE':
+                    continue
+                desc = note['n_desc']
+                page_size = desc['page_size']
+                for entry, filename in zip(desc['Elf_Nt_File_Entry'], desc['filename']):
+                    if isinstance(filename, bytes):
+                        filename = filename.decode('utf-8', 'replace')
+                    mappings.append((entry['vm_start'], entry['vm_end'],
+                                     entry['page_offset'] * page_size, filename))
+        return mappings
 
     @classmethod
     def from_zip(cls, zipname, filename=None, inmemory=False):
@@ -19,16 +98,14 @@ class OpenELF(OpenFile):
 
         file_info = super().from_zip(zipname, filename, inmemory)
         if file_info is not None:
-            file_info.set_file_interpreter(ELFFile(file_info.get_fd()), file_type='elf')
-            cls.create_segment_lookup(file_info)
+            cls.interpret(file_info)
         return file_info
 
     @classmethod
     def from_file(cls, filename=None, inmemory=False):
         file_info = super().from_file(filename, inmemory)
         if file_info is not None:
-            file_info.set_file_interpreter(ELFFile(file_info.get_fd()), file_type='elf')
-            cls.create_segment_lookup(file_info)
+            cls.interpret(file_info)
         return file_info
 
 
@@ -36,37 +113,17 @@ class OpenELF(OpenFile):
     def from_bytes(cls, data, filename=None):
         file_info = super().from_bytes(data, filename)
         if file_info is not None:
-            file_info.set_file_interpreter(ELFFile(file_info.get_fd()), file_type='elf')
-            cls.create_segment_lookup(file_info)
+            cls.interpret(file_info)
         return file_info
 
 class ElfFileLoader(FileLoader):
     def __init__(self, **kargs):
-        super.__init__(**kargs)
+        super().__init__(**kargs)
+        # FileLoader.load_location opens every location with this
         self.set_file_opener(OpenELF)
-        print('')
 
     def load_file_from_zip(self, zipname, filename=None, inmemory=False, add_all=False):
         file_obj = OpenELF.from_zip(zipname, filename, inmemory)
         if file_obj is not None:
             self.add_file_to_namespace(file_obj, add_all=add_all)
         return file_obj
-
-    def load_location(self, location):
-        '''
-        load the file using the Elf loader class
-        returns an IO file descriptor and pyelf file
-        '''
-        if location.find(b'bytes::') > -1:
-            data = self.rfiles_bytes[location]
-            file_info = OpenELF.from_bytes(data, fname)
-            file_info.location = location
-        elif location.find(b'zip::') > -1:
-            name = location.strip('zip::')
-            file_info = OpenELF.from_zip(self.rfiles_zip, name, inmemory)
-            file_info.location = location
-        elif location is not None:
-            file_info = OpenELF.from_file(self.rfiles_zip, location, inmemory)
-            file_info.location = location
-        return file_info
-
@@ -0,0 +1,177 @@
+import os
+import zlib
+import struct
+import marshal
+import hashlib
+from collections import namedtuple
+
+
+Segment = namedtuple('Segment', ['p_type', 'p_flags', 'p_offset', 'p_vaddr', 'p_paddr',
+                                 'p_filesz', 'p_memsz', 'p_align'])
+Section = namedtuple('Section', ['name', 'sh_type', 'sh_flags', 'sh_addr', 'sh_offset',
+                                 'sh_size', 'sh_link', 'sh_entsize'])
+# link time symbol, info is the raw st_info
+ElfSymbol = namedtuple('ElfSymbol', ['name', 'value', 'size', 'info'])
+
+# symbol types worth resolving addresses to
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_GNU_IFUNC = 10
+SYMBOL_TYPES = (STT_OBJECT, STT_FUNC, STT_GNU_IFUNC)
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+
+class ElfMetadata(object):
+    '''
+    the parts of an ELF file the loaders use: header fields, program
+    headers, section headers and the defined .symtab/.dynsym symbols,
+    as plain tuples that serialize compactly
+    '''
+
+    def __init__(self, e_type, elfclass, little_endian, segments, sections, symbols):
+        self.e_type = e_type
+        self.elfclass = elfclass
+        self.little_endian = little_endian
+        self.segments = segments
+        self.sections = sections
+        self.symbols = symbols
+
+    @classmethod
+    def read_segments(cls, ef):
+        return [Segment(str(h.p_type), h.p_flags, h.p_offset, h.p_vaddr, h.p_paddr,
+                        h.p_filesz, h.p_memsz, h.p_align)
+                for h in (s.header for s in ef.iter_segments())]
+
+    @classmethod
+    def from_elffile(cls, ef):
+        segments = cls.read_segments(ef)
+        sections = [Section(s.name, str(s['sh_type']), s['sh_flags'], s['sh_addr'],
+                            s['sh_offset'], s['sh_size'], s['sh_link'], s['sh_entsize'])
+                    for s in ef.iter_sections()]
+        return cls(str(ef.header['e_type']), ef.elfclass, ef.little_endian,
+                   segments, sections, cls.read_symbols(ef))
+
+    @classmethod
+    def read_symbols(cls, ef):
+        # decoded straight from the section data, pyelftools symbol
+        # objects are far too slow for large tables
+        endian = '<' if ef.little_endian else '>'
+        if ef.elfclass == 64:
+            fmt = endian + 'IBBHQQ'
+            unpack = lambda e: (e[0], e[1], e[3], e[4], e[5])
+        else:
+            fmt = endian + 'IIIBBH'
+            unpack = lambda e: (e[0], e[3], e[5], e[1], e[2])
+
+        symbols = []
+        seen = set()
+        for section_name in ('.symtab', '.dynsym'):
+            section = ef.get_section_by_name(section_name)
+            if section is None or section['sh_entsize'] != struct.calcsize(fmt):
+                continue
+            strtab = ef.get_section(section['sh_link']).data()
+            data = section.data()
+            data = data[:len(data) - len(data) % section['sh_entsize']]
+            for entry in struct.iter_unpack(fmt, data):
+                st_name, st_info, st_shndx, st_value, st_size = unpack(entry)
+                if st_info & 0xf not in SYMBOL_TYPES or st_value == 0 or \
+                   st_shndx == SHN_UNDEF or st_shndx >= SHN_LORESERVE:
+                    continue
+                # .dynsym mostly repeats .symtab
+                if (st_value, st_size) in seen:
+                    continue
+                seen.add((st_value, st_size))
+                name = strtab[st_name:strtab.find(b'\x00', st_name)].decode('utf-8', 'replace')
+                symbols.append(ElfSymbol(name, st_value, st_size, st_info))
+        return symbols
+
+    def get_load_bias(self, mapped_start):
+        '''
+        difference between run time and link time addresses when the
+        file's offset 0 is mapped at mapped_start
+        '''
+        loads = [s for s in self.segments if s.p_type == 'PT_LOAD']
+        if not loads:
+            return mapped_start
+        first = min(loads, key=lambda s: s.p_offset)
+        return mapped_start - (first.p_vaddr - first.p_offset)
+
+    def get_segments_by_offset(self):
+        return {s.p_offset: s for s in self.segments}
+
+    def to_tuple(self):
+        return (self.e_type, self.elfclass, self.little_endian,
+                [tuple(s) for s in self.segments],
+                [tuple(s) for s in self.sections],
+                [tuple(s) for s in self.symbols])
+
+    @classmethod
+    def from_tuple(cls, values):
+        e_type, elfclass, little_endian, segments, sections, symbols = values
+        return cls(e_type, elfclass, little_endian,
+                   [Segment(*s) for s in segments],
+                   [Section(*s) for s in sections],
+                   [ElfSymbol(*s) for s in symbols])
+
+
+class ElfMetadataCache(object):
+    '''
+    on disk cache of ElfMetadata keyed by (real path, size, mtime).
+
+    entries are zlib compressed and written to a temporary file that is
+    renamed into place, so processes sharing the cache directory only
+    ever see complete entries.  a damaged or stale entry is a miss.
+    '''
+
+    MAGIC = b'MATKELFC'
+    VERSION = 1
+    HEADER = struct.Struct('<8sI')
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, path):
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return (path, st.st_size, st.st_mtime_ns)
+
+    def get_entry_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.elfmeta')
+
+    def get(self, path):
+        try:
+            key = self.get_key(path)
+            with open(self.get_entry_path(key), 'rb') as f:
+                data = f.read()
+            magic, version = self.HEADER.unpack_from(data, 0)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError("bad header")
+            stored_key, values = marshal.loads(zlib.decompress(data[self.HEADER.size:]))
+            if tuple(stored_key) != key:
+                raise ValueError("key collision")
+            md = ElfMetadata.from_tuple(values)
+        except (OSError, ValueError, EOFError, TypeError, struct.error, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return md
+
+    def put(self, path, md):
+        key = self.get_key(path)
+        entry_path = self.get_entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        payload = marshal.dumps((key, md.to_tuple()))
+        tmp_path = '{}.{}.{}.tmp'.format(entry_path, os.getpid(), id(md))
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION))
+                f.write(zlib.compress(payload))
+            os.replace(tmp_path, entry_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return entry_path
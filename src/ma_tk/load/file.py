@@ -1,9 +1,13 @@
 import zipfile
 import os
 import io
+from threading import Lock
+from contextlib import contextmanager
 
 from ..store.io import IOBacked
 from ..store.bfr import BufferBacked
+from .zipseek import SeekableZipMember, extract_member
+from .handles import PooledStream
 
 class _Buffer(io.BytesIO):
     pass
@@ -11,6 +15,40 @@ class _Buffer(io.BytesIO):
 class _File(io.FileIO):
     pass
 
+class _ZipMember(io.RawIOBase):
+    '''
+    zip member stream that owns its archive, closing it closes both
+    '''
+
+    def __init__(self, zf, member):
+        super().__init__()
+        self.zf = zf
+        self.member = member
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.member.seekable()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.member.seek(offset, whence)
+
+    def tell(self):
+        return self.member.tell()
+
+    def read(self, size=-1):
+        return self.member.read(size)
+
+    def readinto(self, buf):
+        return self.member.readinto(buf)
+
+    def close(self):
+        if not self.closed:
+            self.member.close()
+            self.zf.close()
+        super().close()
+
 class FileObj(object):
 
     def __init__(self, filename, file_descriptor, source="unknown",
@@ -26,6 +64,19 @@ class FileObj(object):
         self.inmemory = inmemory
         self.file_interp_klass = file_interp_klass
         self.opener_name = opener_name
+        # parsed ELF tables, see OpenELF.get_metadata
+        self.elf_metadata = None
+        # streams without a real descriptor (BytesIO, zip members)
+        # fall back to seek/read under this lock
+        self.io_lock = Lock()
+        self.fileno = self._get_fileno(file_descriptor)
+
+    @classmethod
+    def _get_fileno(cls, fd):
+        try:
+            return fd.fileno()
+        except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+            return None
 
     def set_interp_klass(self, file_interp_klass):
         self.file_interp_klass = file_interp_klass
@@ -37,6 +88,8 @@ class FileObj(object):
         return self.filename
 
     def get_file_descriptor(self):
+        if self.fd is None and self.source is not None:
+            self._reopen()
         return self.fd
 
     def get_fd(self):
@@ -58,25 +111,80 @@ class FileObj(object):
         return hasattr(self, name)
         
     def get_file_interpreter(self):
+        if self.file_interp is None and self.file_interp_klass is not None:
+            # dropped while pickling, rebuild it from the reopened file
+            self.file_interp = self.file_interp_klass(self.get_fd())
         return self.file_interp
 
     def set_file_interpreter(self, file_interp, file_type='unknown'):
         self.file_interp = file_interp
         self.file_type = file_type
+        if file_interp is not None and self.file_interp_klass is None:
+            self.file_interp_klass = type(file_interp)
+
+    def __getstate__(self):
+        # only a descriptor of the file is pickled, it is reopened from
+        # its source on first use.  in memory files carry their data.
+        odict = {k: v for k, v in self.__dict__.items()
+                 if k not in ('fd', 'fileno', 'io_lock', 'file_interp')}
+        if self.source == 'bytes::':
+            odict['data'] = self.read_preserve_location()
+        return odict
+
+    def __setstate__(self, _dict):
+        self.__dict__.update(_dict)
+        self.fd = None
+        self.fileno = None
+        self.file_interp = None
+        self.io_lock = Lock()
+
+    def _reopen(self):
+        if self.source == 'bytes::':
+            file_info = OpenFile.from_bytes(self.__dict__.pop('data'), self.filename)
+        else:
+            file_info = OpenFile.from_source(self.source, self.inmemory)
+        if file_info is None:
+            raise Exception("Unable to reopen {}".format(self.source))
+        self.fd = file_info.fd
+        self.fileno = file_info.fileno
+
+    def close(self):
+        '''
+        close the file, it is reopened from its source on next use
+        '''
+        if self.fd is not None:
+            self.fd.close()
+        self.fd = None
+        self.fileno = None
+
+    @contextmanager
+    def lease_fileno(self):
+        '''
+        OS descriptor of the file that stays open until the with block
+        exits, None for streams without one
+        '''
+        fd = self.get_fd()
+        if isinstance(fd, PooledStream):
+            with fd.lease() as handle:
+                yield handle.fileno
+        else:
+            yield self.fileno
 
     def update_file_segments(self, segments_by_offset):
         self.segments_by_offset = segments_by_offset
 
     def read_preserve_location(self, pos=0, size=None):
-        old_pos = self.fd.tell()
-        self.fd.seek(pos, os.SEEK_SET)
-        data = None
-
-        if size is None:
-            data = self.fd.read()
-        else:
-            data = self.fd.read(size)
-        self.fd.seek(old_pos, os.SEEK_SET)
+        fd = self.get_fd()
+        with self.io_lock:
+            old_pos = fd.tell()
+            fd.seek(pos, os.SEEK_SET)
+            data = None
+
+            if size is None:
+                data = fd.read()
+            else:
+                data = fd.read(size)
+            fd.seek(old_pos, os.SEEK_SET)
         return data
 
     def clone(self, create_new_file_interp=False):
@@ -87,17 +195,10 @@ class FileObj(object):
         if self.source is None:
             raise Exception("Attempting to clone from an unknown source")
 
-        if self.source.find("bytes://") > -1:
+        if self.source.find("bytes::") > -1:
             file_info = OpenFile.from_bytes(self.read_preserve_location())
-
-        elif self.source.find('zip://') > -1:
-            zip_filename, filename = self.source.split('::')
-
-            file_info = OpenFile.from_zip(zip_filename.strip('zip://'), 
-                                filename, 
-                                self.inmemory)
         else:
-            file_info = OpenFile.from_file(self.source.strip('file://'), self.inmemory)
+            file_info = OpenFile.from_source(self.source, self.inmemory)
 
         # FIXME do I really want to copy the file_interp
         # because it might be tied to an uncontrolled resource
@@ -116,23 +217,103 @@ class FileObj(object):
 
     def read(self, offset, size):
         fd = self.get_fd()
-        filename = self.get_filename()
         
         # ef = elf_info.get_file_interpreter()
         if fd is None:
-            self.info("Invalid file descriptor for {}".format(filename))
             return None
-        pos = fd.tell()
-        fd.seek(offset, os.SEEK_SET)
-        data = fd.read(size)
-        fd.seek(pos, os.SEEK_SET)
+        return self.pread(size, offset)
+
+    def pread(self, size, offset):
+        '''
+        positional read that never moves the shared file position
+        '''
+        fd = self.get_fd()
+        if self.fileno is not None:
+            return os.pread(self.fileno, size, offset)
+        if isinstance(fd, PooledStream):
+            return fd.pread(size, offset)
+        with self.io_lock:
+            pos = fd.tell()
+            fd.seek(offset, os.SEEK_SET)
+            data = fd.read(size)
+            fd.seek(pos, os.SEEK_SET)
         return data
 
+    def preadinto(self, buf, offset):
+        '''
+        positional read directly into a writable buffer
+        '''
+        fd = self.get_fd()
+        if self.fileno is not None:
+            if hasattr(os, 'preadv'):
+                return os.preadv(self.fileno, [buf], offset)
+            data = os.pread(self.fileno, len(buf), offset)
+            buf[:len(data)] = data
+            return len(data)
+        if isinstance(fd, PooledStream):
+            return fd.preadinto(buf, offset)
+        with self.io_lock:
+            pos = fd.tell()
+            fd.seek(offset, os.SEEK_SET)
+            n = fd.readinto(buf)
+            fd.seek(pos, os.SEEK_SET)
+        return 0 if n is None else n
+
 class OpenFile(object):
     @classmethod
-    def from_zip(cls, zipname, filename=None, inmemory=False):
+    def from_source(cls, source, inmemory=False):
+        '''
+        open a file from its source uri, file://<path> or zip://<zip>::<name>
+        '''
+        if source is None:
+            return None
+        elif source.startswith('zip://'):
+            zipname, filename = source[len('zip://'):].split('::', 1)
+            return cls.from_zip(zipname, filename, inmemory)
+        elif source.startswith('file://'):
+            return cls.from_file(source[len('file://'):], inmemory)
+        return None
+
+    @classmethod
+    def open_handle(cls, source):
+        '''
+        open the underlying file of a file:// or zip:// source for
+        the handle pool
+        '''
+        if source.startswith('file://'):
+            return _File(source[len('file://'):], 'rb')
+        zipname, filename = source[len('zip://'):].split('::', 1)
+        with zipfile.ZipFile(zipname) as zf:
+            info = zf.getinfo(filename)
+        try:
+            return SeekableZipMember(zipname, info)
+        except Exception:
+            # encrypted or unusual compression, seeks backwards restart
+            # decompression from the start of the member
+            zf = zipfile.ZipFile(zipname)
+            return _ZipMember(zf, zf.open(filename))
+
+    @classmethod
+    def open_pooled(cls, source):
+        '''
+        stream over source through the process wide handle pool, the
+        file is opened here so errors surface immediately
+        '''
+        fd = PooledStream(source, OpenFile.open_handle)
+        with fd.lease():
+            pass
+        return fd
+
+    @classmethod
+    def from_zip(cls, zipname, filename=None, inmemory=False, extract=False, cache_dir=None):
+        '''
+        open a zip member.  stored and deflated members are opened for
+        random access, with extract the member is copied once into
+        cache_dir (next to the archive by default) and that copy is
+        opened instead so it can be memory mapped.
+        '''
         if zipname is None or not os.path.exists(zipname):
-            return None, None
+            return None
 
         zf = zipfile.ZipFile(zipname)
         names = zf.namelist()
@@ -142,28 +323,32 @@ class OpenFile(object):
             filename = names[0]
         if filename not in names:
             return None
-        fd = zf.open(filename)
+        if extract and not inmemory:
+            zf.close()
+            return cls.from_file(extract_member(zipname, filename, cache_dir))
         if inmemory:
+            fd = zf.open(filename)
             new_filename = 'zip://{}::{}'.format(zipname, filename)
             result = cls.from_bytes(fd.read(), filename=new_filename)
             fd.close()
             zf.close()
             return result
+        zf.close()
+        fd = cls.open_pooled('zip://{}::{}'.format(zipname, filename))
         setattr(fd, 'name', filename)
-        setattr(fd, 'source', 'zip://{}::{}'.format(zipname, filename))
         return FileObj(filename, fd, source=fd.source, inmemory=inmemory)
 
     @classmethod
     def from_file(cls, filename=None, inmemory=False):
         if filename is None or not os.path.exists(filename):
             return None
-        fd = _File(filename, 'rb')
         if inmemory:
+            fd = _File(filename, 'rb')
             result = cls.from_bytes(fd.read(), filename=filename)
             fd.close()
             return result
+        fd = cls.open_pooled('file://{}'.format(filename))
         setattr(fd, 'name', filename)
-        setattr(fd, 'source', 'file://{}'.format(filename))
 
         return FileObj(filename, fd, source=fd.source, inmemory=inmemory)
 
@@ -194,8 +379,9 @@ class FileLoader(object):
 
     @classmethod
     def zip_names(cls, filename):
-        if is_zip(filename):
-            return zipfile.ZipFile(zipname).namelist()
+        if cls.is_zip(filename):
+            with zipfile.ZipFile(filename) as zf:
+                return zf.namelist()
         return None
 
     def set_file_opener(self, file_opener_klass):
@@ -232,31 +418,80 @@ class FileLoader(object):
                required_files_bytes: dict=None,
                required_files_dir: str=None,
                required_files_zip: str=None):
-
+        '''
+        add required file sources to the full path and basename indexes.
+        when several sources provide the same name the winner is fixed:
+        explicit locations, then in memory bytes, then the directory,
+        then the zip, and within a source the shallowest path, ties
+        broken by path order.
+        '''
         rfiles_location = {} if required_files_location is None \
                                   else required_files_location.copy()
-
         if required_files_location_list is not None:
             for f in required_files_location_list:
-                if f not in self.rfiles_location:
-                    self.rfiles_location[f] = f
+                rfiles_location.setdefault(f, f)
+        self.rfiles_location.update(rfiles_location)
+        for name, location in sorted(rfiles_location.items()):
+            self._index_file(name, location, 0)
 
         rfiles_bytes = {} if required_files_bytes is None \
                                else required_files_bytes
         # tell the memory loader that we have the file
         # but its already in memory
-        self.rfiles_location.update(rfiles_bytes)
-        self.rfiles_location.update({k: None for k in rfiles_bytes})
-        
+        self.rfiles_bytes.update(rfiles_bytes)
+        for name in sorted(rfiles_bytes):
+            self._index_file(name, 'bytes::' + name, 1)
+
+        if required_files_dir is not None:
+            for path, rel_path in self._walk_dir(required_files_dir):
+                self._index_file('/' + rel_path, path, 2, alias=path)
+
         if required_files_zip is not None and self.is_zip(required_files_zip):
             self.rfiles_zip = required_files_zip
-            self.rfiles_zip_names = self.zip_names()
+            self.rfiles_zip_names = self.zip_names(required_files_zip)
+            for name in sorted(self.rfiles_zip_names):
+                if name.endswith('/'):
+                    continue
+                location = 'zip://{}::{}'.format(required_files_zip, name)
+                self._index_file('/' + name.lstrip('/'), location, 3, alias=name)
 
-        if required_files_dir is not None:
-            # FIXME non-path recursion here :(
-            files = [os.path.join(required_files_dir, i) for i in os.listdir('.')]
-            self.rfiles_location.update({k:k for k in files})
+        # earlier resolutions, including misses, may have changed
+        self.required_files_to_location = {}
 
+    @classmethod
+    def _walk_dir(cls, top):
+        '''
+        (path, path relative to top) of every file below top, symlinks
+        are followed but never back into a directory being walked
+        '''
+        for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+            real_dirpath = os.path.realpath(dirpath)
+            keep = []
+            for d in sorted(dirnames):
+                real = os.path.realpath(os.path.join(dirpath, d))
+                if real_dirpath == real or \
+                   real_dirpath.startswith(real.rstrip(os.sep) + os.sep):
+                    continue
+                keep.append(d)
+            dirnames[:] = keep
+            for f in sorted(filenames):
+                path = os.path.join(dirpath, f)
+                # skips dangling links and special files
+                if os.path.isfile(path):
+                    yield path, os.path.relpath(path, top).replace(os.sep, '/')
+
+    def _index_file(self, name, location, source_rank, alias=None):
+        norm_name = os.path.normpath(name)
+        rank = (source_rank, norm_name.count('/'), norm_name)
+        keys = [name, norm_name] if alias is None else [name, norm_name, alias]
+        for key in keys:
+            current = self.path_index.get(key, None)
+            if current is None or rank < current[0]:
+                self.path_index[key] = (rank, location)
+        basename = os.path.basename(norm_name)
+        current = self.basename_index.get(basename, None)
+        if current is None or rank < current[0]:
+            self.basename_index[basename] = (rank, location)
 
     def __init__(self,
                  required_files_location_list: list=None,
@@ -280,6 +515,9 @@ class FileLoader(object):
         self.rfiles_location = {}
         self.loaded_rfiles = {}
         self.rfiles_zip_names = []
+        # name -> (rank, location), see update
+        self.path_index = {}
+        self.basename_index = {}
 
         self.rfiles_zip = None
         self.update(required_files_location_list=required_files_location_list,
@@ -288,8 +526,10 @@ class FileLoader(object):
                  required_files_dir=required_files_dir,
                  required_files_zip=required_files_zip)
 
-    def load_file_from_zip(self, zipname, filename=None, inmemory=False, add_all=False):
-        file_obj = self.FILE_OPENER.from_zip(zipname, filename, inmemory)
+    def load_file_from_zip(self, zipname, filename=None, inmemory=False, add_all=False,
+                           extract=False, cache_dir=None):
+        file_obj = self.FILE_OPENER.from_zip(zipname, filename, inmemory,
+                                             extract=extract, cache_dir=cache_dir)
         if file_obj is not None:
             self.add_file_to_namespace(file_obj, add_all=add_all)
         return file_obj
@@ -346,6 +586,7 @@ class FileLoader(object):
         '''
         # FIXME when reloading the file, do we reload it for all namespaces or
         # only the namespace specified in the arguments
+        _namespace = None
         if not reload:
             _namespace = self.is_file_loaded(filename, namespace, 
                                              namespaces, search_all=add_all)
@@ -387,42 +628,21 @@ class FileLoader(object):
 
     def load_location(self, location, inmemory=False):
         '''
-        load the file using the Elf loader class
-        returns an IO file descriptor and pyelf file
+        open a location returned by where_is_file with the file opener
         '''
         if location is None:
             return None
-        elif isinstance(location, bytes):
-            self.load_location_bytes(location, inmemory=inmemory)
-        if location.find('bytes::') > -1:
-            data = self.rfiles_bytes[location]
-            file_info = self.FILE_OPENER.from_bytes(data, fname)
-            file_info.location = location
-        elif location.find('zip::') > -1:
-            name = location.strip('zip::')
-            file_info = self.FILE_OPENER.from_zip(self.rfiles_zip, name, inmemory)
-            file_info.location = location
-        elif location is not None:
+        if isinstance(location, bytes):
+            location = location.decode('utf-8')
+        if location.startswith('bytes::'):
+            name = location[len('bytes::'):]
+            file_info = self.FILE_OPENER.from_bytes(self.rfiles_bytes[name], name)
+        elif location.startswith('zip://'):
+            zipname, name = location[len('zip://'):].split('::', 1)
+            file_info = self.FILE_OPENER.from_zip(zipname, name, inmemory)
+        else:
             file_info = self.FILE_OPENER.from_file(location, inmemory)
-            file_info.location = location
-        return file_info
-
-    def load_location_bytes(self, location, inmemory=False):
-        '''
-        load the file using the Elf loader class
-        returns an IO file descriptor and pyelf file
-        '''
-
-        if location.find(b'bytes::') > -1:
-            data = self.rfiles_bytes[location]
-            file_info = self.FILE_OPENER.from_bytes(data, fname)
-            file_info.location = location
-        elif location.find(b'zip::') > -1:
-            name = location.strip(b'zip::')
-            file_info = self.FILE_OPENER.from_zip(self.rfiles_zip, name, inmemory)
-            file_info.location = location
-        elif location is not None:
-            file_info = self.FILE_OPENER.from_file(self.rfiles_zip, location, inmemory)
+        if file_info is not None:
             file_info.location = location
         return file_info
 
@@ -431,47 +651,34 @@ class FileLoader(object):
         The ELF file we want to load can be in several places:
             1a) provided directory (a directory)
             1b) list of files passed in during initialization
-            2) in memory as a byte array ('bytes::')
-            3) in a zip file ('zip::')
+            2) in memory as a byte array ('bytes::<name>')
+            3) in a zip file ('zip://<zip>::<name>')
             4) on the local system
 
-            at initialization, this dictionary maps known
-            elfs for resolution in all cases except local system
+            the sources are indexed by full path and basename when they
+            are added, so a lookup is a couple of dictionary probes.
+            the full path is preferred, the basename is the fallback.
         '''
-        location = None
         if filename in self.required_files_to_location:
             return self.required_files_to_location[filename]
 
-        # tell where the file is.
-        # checks in memory bytes, mapping of filename to a location.
-        if filename in self.rfiles_location:
-            location = self.rfiles_location.get(filename)
-            location = b'bytes::' if location is None else location
-
-        # try just the filename if its in a path
-        if location is None and len(os.path.split(filename)) > 1:
-            just_fn = os.path.split(filename)[-1]
-            if filename != just_fn:
-                location = self.where_is_file(just_fn)
-
-        # check the zip names list
-        if location is None and self.rfiles_zip_names is not None:
-            for n in self.rfiles_zip_names:
-                if n.find(filename) > -1:
-                    location = b'zip::' + n
-                    break
+        entry = self.path_index.get(filename, None)
+        if entry is None:
+            entry = self.path_index.get(os.path.normpath(filename), None)
+        if entry is None:
+            entry = self.basename_index.get(os.path.basename(filename), None)
+        location = None if entry is None else entry[1]
 
         # check local file system
-        if location is None:
-            if os.path.exists(filename):
-                location = filename
+        if location is None and os.path.exists(filename):
+            location = filename
         self.required_files_to_location[filename] = location
         return location
 
     def load_file_to_memory(self, filename, size, offset, 
                             va_start, page_size=4096, flags=0, 
                             inmemory=True):
-        file_info = self.load_file(file_name, inmemory=inmemory)
+        file_info = self.load_file(filename, inmemory=inmemory)
         ibm = None
         if file_info is not None and inmemory:
             bytes_obj = file_info.read(offset, size)
@@ -481,10 +688,10 @@ class FileLoader(object):
                                phy_start=phy_start, page_size=page_size, 
                                filename=file_info.get_filename(), flags=flags)
         elif file_info is not None:
-            # should create a new ma_tk.load.FileObj to alleviate unsafe reads/writes
-            io_obj = file_info.clone()
+            # reads are positional, so the FileObj can be shared safely
             phy_start = offset
-            ibm = IOBacked(io_obj, va_start, size, 
+            ibm = IOBacked(file_info, va_start, size, 
                        phy_start=phy_start, page_size=page_size, 
-                       filename=file_info.get_filename(), flags=flags)
+                       filename=file_info.get_filename(), flags=flags,
+                       file_offset=offset)
         return ibm
@@ -0,0 +1,321 @@
+import os
+import io
+import weakref
+import itertools
+from threading import Lock
+from contextlib import contextmanager
+
+from ..consts import HANDLE_POOL_MAX_OPEN
+
+
+# use counter ordering handles for eviction, next() on it is atomic
+_CLOCK = itertools.count()
+
+# every pool, so their locks can be re-created in forked children
+_POOLS = weakref.WeakSet()
+
+
+class Handle(object):
+    '''
+    an open file in the pool, reads are positional so one handle
+    serves every stream of its source.
+
+    readers pin the handle for the duration of a read.  pinning only
+    takes the handle's own lock, so reads of different sources never
+    contend and the pool lock is only needed to open or evict handles.
+    a retired handle refuses new pins and is closed once the last
+    pinned read finishes.
+    '''
+
+    def __init__(self, raw, source=None):
+        self.raw = raw
+        self.source = source
+        try:
+            self.fileno = raw.fileno()
+        except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+            self.fileno = None
+        # streams without a descriptor are read with seek/read
+        self.lock = Lock()
+        self.pin_lock = Lock()
+        self.busy = 0
+        self.retired = False
+        self.last_use = next(_CLOCK)
+
+    def pin(self):
+        with self.pin_lock:
+            if self.retired:
+                return False
+            self.busy += 1
+            self.last_use = next(_CLOCK)
+            return True
+
+    def unpin(self):
+        with self.pin_lock:
+            self.busy -= 1
+            close = self.retired and self.busy == 0
+        if close:
+            self.close()
+
+    def retire(self, wait: bool = True):
+        '''
+        stop handing out the handle and close it, right away when idle
+        or after the last pinned read.  without wait a pinned handle is
+        left alone and False is returned.
+        '''
+        with self.pin_lock:
+            if self.retired or (self.busy and not wait):
+                return False
+            self.retired = True
+            close = self.busy == 0
+        if close:
+            self.close()
+        return True
+
+    def reset_locks(self):
+        # forked children only have the forking thread, nothing is pinned
+        self.lock = Lock()
+        self.pin_lock = Lock()
+        self.busy = 0
+
+    def pread(self, size, offset):
+        if self.fileno is not None:
+            return os.pread(self.fileno, size, offset)
+        with self.lock:
+            self.raw.seek(offset, os.SEEK_SET)
+            return self.raw.read(size)
+
+    def preadinto(self, buf, offset):
+        if self.fileno is not None:
+            if hasattr(os, 'preadv'):
+                return os.preadv(self.fileno, [buf], offset)
+            data = os.pread(self.fileno, len(buf), offset)
+            buf[:len(data)] = data
+            return len(data)
+        with self.lock:
+            self.raw.seek(offset, os.SEEK_SET)
+            n = self.raw.readinto(buf)
+        return 0 if n is None else n
+
+    def get_size(self):
+        if self.fileno is not None:
+            return os.fstat(self.fileno).st_size
+        with self.lock:
+            return self.raw.seek(0, os.SEEK_END)
+
+    def close(self):
+        self.raw.close()
+
+
+class HandlePool(object):
+    '''
+    process wide pool of open files keyed by source uri.
+
+    streams reference count their source, every stream of a source
+    shares one open handle and at most max_open handles stay open.
+    the least recently used idle handle is closed when the cap is
+    exceeded and reopened transparently on its next use.  handles in
+    use by a read are never closed, so the cap can be exceeded while
+    more than max_open sources are being read at once.
+
+    streams keep their handle between reads, the pool lock is only
+    taken to open, evict or release handles.
+    '''
+
+    def __init__(self, max_open: int = HANDLE_POOL_MAX_OPEN):
+        self.max_open = max_open
+        self.lock = Lock()
+        self.handles = {}
+        self.refs = {}
+        self.opens = 0
+        self.evictions = 0
+        # bumped in forked children, streams drop handles cached before
+        self.generation = 0
+        _POOLS.add(self)
+
+    def set_max_open(self, max_open):
+        with self.lock:
+            self.max_open = max_open
+            self._evict()
+
+    def acquire(self, source):
+        with self.lock:
+            self.refs[source] = self.refs.get(source, 0) + 1
+
+    def release(self, source):
+        with self.lock:
+            count = self.refs.get(source, 0) - 1
+            if count > 0:
+                self.refs[source] = count
+                return
+            self.refs.pop(source, None)
+            handle = self.handles.pop(source, None)
+        if handle is not None:
+            handle.retire()
+
+    @contextmanager
+    def lease(self, source, opener):
+        '''
+        open Handle for source, opened with opener(source) if needed,
+        that is not closed before the with block exits
+        '''
+        handle = self.checkout(source, opener)
+        try:
+            yield handle
+        finally:
+            handle.unpin()
+
+    def checkout(self, source, opener):
+        '''
+        pinned Handle for source, the caller unpins it when done
+        '''
+        with self.lock:
+            handle = self.handles.get(source, None)
+            if handle is not None and handle.pin():
+                return handle
+
+        # opening can be slow, do not hold up other sources
+        raw = opener(source)
+        with self.lock:
+            handle = self.handles.get(source, None)
+            if handle is not None and handle.pin():
+                # another thread opened it first
+                raw.close()
+                return handle
+            handle = Handle(raw, source)
+            handle.pin()
+            self.handles[source] = handle
+            self.opens += 1
+            self._evict()
+            return handle
+
+    def _evict(self):
+        # called with the lock held
+        excess = len(self.handles) - self.max_open
+        if excess <= 0:
+            return
+        for handle in sorted(self.handles.values(), key=lambda h: h.last_use):
+            if excess <= 0:
+                break
+            if not handle.retire(wait=False):
+                continue
+            del self.handles[handle.source]
+            self.evictions += 1
+            excess -= 1
+
+    def _after_fork(self):
+        self.lock = Lock()
+        for handle in self.handles.values():
+            handle.reset_locks()
+        self.generation += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {'open': len(self.handles),
+                    'sources': len(self.refs),
+                    'opens': self.opens,
+                    'evictions': self.evictions}
+
+    def clear(self):
+        '''
+        close every idle handle, they are reopened on their next use
+        '''
+        with self.lock:
+            for source in list(self.handles):
+                if self.handles[source].retire(wait=False):
+                    del self.handles[source]
+
+
+def _reset_pools_after_fork():
+    # a lock held by another thread at fork time would never be released
+    for pool in list(_POOLS):
+        pool._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+HANDLE_POOL = HandlePool()
+
+
+class PooledStream(io.RawIOBase):
+    '''
+    file like view of a source in the handle pool with its own
+    position, the underlying file may be closed and reopened between
+    any two calls
+    '''
+
+    def __init__(self, source, opener, pool: HandlePool = None):
+        super().__init__()
+        self.source = source
+        self.opener = opener
+        self.pool = HANDLE_POOL if pool is None else pool
+        self.pos = 0
+        self.pool.acquire(source)
+        self._released = False
+        # handle of the last read, reused while the pool keeps it open
+        self._handle = None
+        self._generation = self.pool.generation
+
+    def _pin(self):
+        handle = self._handle
+        if handle is None or self._generation != self.pool.generation or \
+           not handle.pin():
+            self._generation = self.pool.generation
+            handle = self.pool.checkout(self.source, self.opener)
+            self._handle = handle
+        return handle
+
+    @contextmanager
+    def lease(self):
+        handle = self._pin()
+        try:
+            yield handle
+        finally:
+            handle.unpin()
+
+    def pread(self, size, offset):
+        handle = self._pin()
+        try:
+            return handle.pread(size, offset)
+        finally:
+            handle.unpin()
+
+    def preadinto(self, buf, offset):
+        handle = self._pin()
+        try:
+            return handle.preadinto(buf, offset)
+        finally:
+            handle.unpin()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buf):
+        n = self.preadinto(buf, self.pos)
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            with self.lease() as handle:
+                offset += handle.get_size()
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._handle = None
+            self.pool.release(self.source)
+        super().close()
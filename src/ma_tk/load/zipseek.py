@@ -0,0 +1,175 @@
+import os
+import io
+import zlib
+import struct
+import shutil
+import zipfile
+from bisect import bisect_right
+
+from ..consts import ZIP_CHECKPOINT_INTERVAL, ZIP_READ_SIZE
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_MAGIC = b'PK\x03\x04'
+
+
+class SeekableZipMember(io.RawIOBase):
+    '''
+    random access reader for a stored or deflated zip member.
+
+    stored members are read in place.  deflated members are inflated
+    with a raw inflate stream and a copy of the decompressor is kept
+    every checkpoint_interval bytes of output, so a seek only inflates
+    from the closest checkpoint before it instead of from the start of
+    the member.  checkpoints are built the first time the member is
+    read through.
+    '''
+
+    def __init__(self, zipname, info, checkpoint_interval: int = ZIP_CHECKPOINT_INTERVAL):
+        super().__init__()
+        if info.flag_bits & 0x1:
+            raise Exception("Encrypted zip member {}".format(info.filename))
+        if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise Exception("Unsupported compression for zip member {}".format(info.filename))
+
+        self.zipname = zipname
+        self.info = info
+        self.name = info.filename
+        self.size = info.file_size
+        self.stored = info.compress_type == zipfile.ZIP_STORED
+        self.checkpoint_interval = checkpoint_interval
+        self.archive = open(zipname, 'rb')
+        self.archive_fd = self.archive.fileno()
+        self.data_offset = self._get_data_offset()
+        self.data_end = self.data_offset + info.compress_size
+        self.pos = 0
+
+        # (output offset, input offset, decompressor) per checkpoint
+        self.checkpoints = [(0, self.data_offset, zlib.decompressobj(-zlib.MAX_WBITS))]
+        self.checkpoint_offsets = [0]
+        self._restore(0)
+
+    def _get_data_offset(self):
+        header = os.pread(self.archive_fd, LOCAL_HEADER.size, self.info.header_offset)
+        if len(header) != LOCAL_HEADER.size:
+            raise Exception("Truncated zip member {}".format(self.name))
+        fields = LOCAL_HEADER.unpack(header)
+        if fields[0] != LOCAL_HEADER_MAGIC:
+            raise Exception("Bad local header for zip member {}".format(self.name))
+        return self.info.header_offset + LOCAL_HEADER.size + fields[-2] + fields[-1]
+
+    def _restore(self, index):
+        upos, cpos, dobj = self.checkpoints[index]
+        self._dobj = dobj.copy()
+        self._upos = upos
+        self._cpos = cpos
+        self._tail = b''
+
+    def _checkpoint(self):
+        if self._upos % self.checkpoint_interval == 0 and \
+           self.checkpoint_offsets[-1] < self._upos < self.size:
+            # the decompressor has consumed everything before the tail
+            self.checkpoints.append((self._upos, self._cpos - len(self._tail),
+                                     self._dobj.copy()))
+            self.checkpoint_offsets.append(self._upos)
+
+    def _inflate(self, max_length):
+        # never cross a checkpoint boundary in one call so checkpoints
+        # land on exact multiples of the interval
+        next_checkpoint = (self._upos // self.checkpoint_interval + 1) * self.checkpoint_interval
+        max_length = min(max_length, next_checkpoint - self._upos)
+        while not self._dobj.eof:
+            if not self._tail:
+                n = min(ZIP_READ_SIZE, self.data_end - self._cpos)
+                if n <= 0:
+                    break
+                self._tail = os.pread(self.archive_fd, n, self._cpos)
+                if not self._tail:
+                    break
+                self._cpos += len(self._tail)
+            data = self._dobj.decompress(self._tail, max_length)
+            self._tail = self._dobj.unconsumed_tail
+            if data:
+                self._upos += len(data)
+                self._checkpoint()
+                return data
+        return b''
+
+    def _seek_stream(self, offset):
+        index = bisect_right(self.checkpoint_offsets, offset) - 1
+        if self._upos > offset or self._upos < self.checkpoint_offsets[index]:
+            self._restore(index)
+        while self._upos < offset:
+            if not self._inflate(min(offset - self._upos, ZIP_READ_SIZE)):
+                break
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # lazy, the stream is positioned by the next read
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast('B')
+        n = min(len(view), max(0, self.size - self.pos))
+        if n == 0:
+            return 0
+        if self.stored:
+            data = os.pread(self.archive_fd, n, self.data_offset + self.pos)
+            got = len(data)
+            view[:got] = data
+        else:
+            self._seek_stream(self.pos)
+            got = 0
+            while got < n:
+                data = self._inflate(n - got)
+                if not data:
+                    break
+                view[got:got + len(data)] = data
+                got += len(data)
+        self.pos += got
+        return got
+
+    def close(self):
+        if not self.closed:
+            self.archive.close()
+            self.checkpoints = []
+        super().close()
+
+
+def extract_member(zipname, member, cache_dir=None):
+    '''
+    extract member of zipname into cache_dir (next to the archive by
+    default) once and return the path of the extracted copy, the copy
+    is replaced when the archive is newer than it
+    '''
+    cache_dir = zipname + '.cache' if cache_dir is None else cache_dir
+    with zipfile.ZipFile(zipname) as zf:
+        info = zf.getinfo(member)
+        key = '{}.{:08x}.{}'.format(member.replace('/', '_'), info.CRC, info.file_size)
+        path = os.path.join(cache_dir, key)
+        if os.path.exists(path) and \
+           os.path.getsize(path) == info.file_size and \
+           os.path.getmtime(path) >= os.path.getmtime(zipname):
+            return path
+
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with zf.open(info) as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, ZIP_READ_SIZE)
+        # readers never see a partially extracted copy
+        os.replace(tmp_path, path)
+    return path
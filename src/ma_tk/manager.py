@@ -1,6 +1,21 @@
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
 from .store.io import IOBacked
 from .store.bfr import BufferBacked
+from .store.mapped import MmapBacked
+from .store.compressed import CompressedBacked
+from .store.sparse import ZeroBacked, SparseBacked
+from .store.cache import BlockCache
+from .store.snapshot import Snapshot
+from .processor.pointers import PointerScanner
+from .processor.search import search_regions
+from .processor.pool import Processor
+from .processor.symbols import SymbolIndex
+from .consts import BLOCK_CACHE_SIZE, BLOCK_CACHE_BLOCK_SIZE, SCAN_CHUNK_SIZE, \
+                    SEARCH_MAX_MATCH, DUMP_BLOCK_SIZE, COMPRESSED_BLOCK_SIZE
 from .load.file import FileLoader
+from .load.elfcache import ElfMetadataCache
 from . import util
 from .store.base_manager import BaseManager
 
@@ -22,17 +37,357 @@ class Manager(BaseManager):
             required_files_dir=self.required_files_dir,
             required_files_zip=self.required_files_zip,
             namespace=self.namespace)
+        # one shared mapping per file:// source
+        self.mmaps = {}
+        # block cache shared by every IOBacked map, 0 disables it
+        self.block_cache_size = kargs.get('block_cache_size', BLOCK_CACHE_SIZE)
+        self.block_cache_block_size = kargs.get('block_cache_block_size', BLOCK_CACHE_BLOCK_SIZE)
+        self.block_cache = self.create_block_cache()
+        # FileObj of the core file loaded by load_elf_core, its NT_FILE
+        # mappings and the files opened for them
+        self.core_file = None
+        self.file_mappings = []
+        self.required_files = {}
+        self.symbol_index = None
+        # parsed ELF metadata shared between runs, off unless a
+        # directory is given
+        self.elf_cache_dir = kargs.get('elf_cache_dir', None)
+        self.elf_cache = ElfMetadataCache(self.elf_cache_dir) if self.elf_cache_dir else None
+
+    def create_block_cache(self):
+        if not self.block_cache_size:
+            return None
+        return BlockCache(self.block_cache_size, self.block_cache_block_size)
+
+    def __getstate__(self):
+        odict = super().__getstate__()
+        for k in ('file_loader', 'block_cache', 'mmaps'):
+            odict.pop(k, None)
+        return odict
+
+    def __setstate__(self, _dict):
+        super().__setstate__(_dict)
+        self.mmaps = {}
+        self.block_cache = self.create_block_cache()
+        for bm in self.region_index:
+            if hasattr(bm, 'set_block_cache'):
+                bm.set_block_cache(self.block_cache)
+            self.share_mmaps(bm)
+        self.file_loader = FileLoader.create_fileloader(
+            required_files_location_list=self.required_files_location_list,
+            required_files_location=self.required_files_location,
+            required_files_bytes=self.required_files_bytes,
+            required_files_dir=self.required_files_dir,
+            required_files_zip=self.required_files_zip,
+            namespace=self.namespace)
+
 
-        
     def calc_page(self, vaddr):
         return self.page_mask & vaddr
 
     def does_map_exist(self, bm):
-        if len(bm.get_page_cache() & self.page_cache) > 0:
-            return True
-        return False
+        return self.region_index.overlaps(bm.get_start(), bm.get_end())
+
+    def get_cache_stats(self):
+        return None if self.block_cache is None else self.block_cache.get_stats()
+
+    def scan_pointers(self, width=8, littleendian=True, alignment=None, regions=None, chunk_size=SCAN_CHUNK_SIZE):
+        '''
+        table of (source, target, region) for every aligned word pointing
+        into a mapped region, region is the position of the target map in
+        the region index
+        '''
+        scanner = PointerScanner(self, width=width, littleendian=littleendian,
+                                 alignment=alignment, chunk_size=chunk_size)
+        return scanner.scan(regions)
+
+    def search(self, pattern, regex=False, regions=None, chunk_size=SCAN_CHUNK_SIZE,
+               max_match=SEARCH_MAX_MATCH, workers=None):
+        '''
+        lazily yield the vaddr of every match of a byte pattern (or a
+        regex when regex is True) in the given memory maps, all of them by
+        default.  regions are streamed in chunks, never loaded whole.
+        with workers the chunks are searched by that many processes.
+        '''
+        regions = list(self.region_index) if regions is None else regions
+        processor = None
+        if workers:
+            processor = Processor(self, workers=workers, chunk_size=chunk_size)
+        return search_regions(regions, pattern, regex=regex, chunk_size=chunk_size,
+                              max_match=max_match, processor=processor)
+
+    def save_snapshot(self, path, compress=False, block_size=DUMP_BLOCK_SIZE, regions=None):
+        '''
+        write the memory maps to a single indexed snapshot file
+        '''
+        return Snapshot.save(self, path, compress=compress,
+                             block_size=block_size, regions=regions)
+
+    @classmethod
+    def open_snapshot(cls, path, **kargs):
+        '''
+        create a Manager over a snapshot file.  the file is mapped and
+        its regions registered without reading any region data.
+        '''
+        mgr = cls(**kargs)
+        Snapshot.load(mgr, path)
+        return mgr
+
+    @classmethod
+    def from_elf_core(cls, path, member=None, load_required_files=False, workers=None, **kargs):
+        '''
+        create a Manager over an ELF core file, or the core member of
+        a zip archive.  every PT_LOAD segment is registered in one bulk
+        operation over a single shared file handle or mapping, and no
+        segment data is read until it is accessed.  with
+        load_required_files the files in the core's NT_FILE note are
+        mapped in as well.
+        '''
+        mgr = cls(**kargs)
+        mgr.load_elf_core(path, member=member)
+        if load_required_files:
+            mgr.load_required_files(workers=workers)
+        return mgr
+
+    def load_elf_core(self, path, member=None):
+        '''
+        register the PT_LOAD segments of a core file, bytes past a
+        segment's p_filesz read as zeros up to its p_memsz.  returns the
+        number of segments added.
+        '''
+        from .load.elf import OpenELF
+        if zipfile.is_zipfile(path):
+            core = OpenELF.from_zip(path, member)
+        else:
+            core = OpenELF.from_file(path)
+        if core is None:
+            raise Exception("Unable to open core file {}".format(path))
+
+        ef = core.get_file_interpreter()
+        if ef.header['e_type'] != 'ET_CORE':
+            raise Exception("{} is not a core file".format(path))
+
+        bms = []
+        filename = core.get_filename()
+        for segment in ef.iter_segments():
+            hdr = segment.header
+            if hdr.p_type != 'PT_LOAD' or hdr.p_memsz == 0:
+                continue
+            bms.append(self.create_file_backed(core, hdr.p_vaddr, hdr.p_memsz,
+                                               filename=filename, offset=hdr.p_offset,
+                                               phy_start=hdr.p_paddr, flags=hdr.p_flags,
+                                               page_size=self.page_size,
+                                               file_size=hdr.p_filesz))
+        rejected = self.add_maps_to_kb(bms)
+        for bm in rejected:
+            self.logger.debug("load_elf_core skipped overlapping segment {}".format(bm.get_name()))
+        self.core_file = core
+        return len(bms) - len(rejected)
+
+    def load_required_files(self, workers=None):
+        '''
+        map the files named in the core's NT_FILE note over the parts of
+        their mappings the core did not dump.  the files are located and
+        opened by the file loader on this thread, the file loader is not
+        thread safe, and only parsed concurrently in a thread pool.
+        returns the number of mappings filled in.
+        '''
+        from .load.elf import OpenELF
+        if self.core_file is None:
+            raise Exception("No core file loaded")
+
+        mappings = OpenELF.get_file_mappings(self.core_file)
+        filenames = sorted(set(m[3] for m in mappings))
+        opened = {filename: self.open_required_file(filename) for filename in filenames}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.parse_required_file,
+                              [v for v in opened.values() if v is not None]))
+        self.file_mappings = mappings
+        self.required_files = {k: v for k, v in opened.items() if v is not None}
+        self.symbol_index = None
+
+        # registering maps is cheap, it stays on this thread
+        filled = 0
+        for vm_start, vm_end, offset, filename in mappings:
+            io_obj = opened.get(filename, None)
+            if io_obj is not None and \
+               self.map_required_file(io_obj, vm_start, vm_end, offset):
+                filled += 1
+        return filled
+
+    def build_symbol_index(self):
+        '''
+        index the symbols of every ELF file loaded for the core,
+        relocated to where each file is mapped
+        '''
+        from .load.elf import OpenELF
+        bases = {}
+        for vm_start, vm_end, offset, filename in self.file_mappings:
+            if offset == 0 and vm_start < bases.get(filename, vm_start + 1):
+                bases[filename] = vm_start
+
+        index = SymbolIndex()
+        for filename, vm_start in bases.items():
+            io_obj = self.required_files.get(filename, None)
+            if io_obj is not None and io_obj.get_file_type() == 'elf':
+                md = OpenELF.get_metadata(io_obj, self.elf_cache)
+                index.add_metadata(md, vm_start, filename)
+        self.symbol_index = index
+        return index
+
+    def symbolize(self, vaddr):
+        '''
+        Symbol containing vaddr or None, the symbol index is built on
+        first use
+        '''
+        if self.symbol_index is None:
+            self.build_symbol_index()
+        return self.symbol_index.lookup(vaddr)
+
+    def symbolize_many(self, addrs):
+        if self.symbol_index is None:
+            self.build_symbol_index()
+        return self.symbol_index.lookup_many(addrs)
+
+    def open_required_file(self, filename):
+        '''
+        locate and open a file referenced by the core, None if it can
+        not be found
+        '''
+        try:
+            return self.file_loader.get_required_file(filename)
+        except Exception as e:
+            self.logger.debug("open_required_file unable to load {}: {}".format(filename, e))
+            return None
+
+    def parse_required_file(self, io_obj):
+        '''
+        parse an opened required file as ELF where possible, safe to
+        run for different files concurrently
+        '''
+        from .load.elf import OpenELF
+        if io_obj.get_file_type() != 'elf':
+            try:
+                OpenELF.interpret(io_obj, self.elf_cache)
+                if self.elf_cache is not None:
+                    # parse the tables here, in the pool, so the next run
+                    # finds them in the cache
+                    OpenELF.get_metadata(io_obj, self.elf_cache)
+            except Exception:
+                # not an ELF (locale archives, fonts, ...), its pages can
+                # still be mapped
+                pass
+        return io_obj
 
-    def add_ioobj(self, io_obj, va_start, size, filename=None, offset=0, phy_start=0, flags=0, page_size=4096):
+    def map_required_file(self, io_obj, vm_start, vm_end, offset):
+        '''
+        back [vm_start, vm_end) with io_obj from offset wherever the
+        core has no data for it.  zero filled segments become sparse
+        regions over the file, unmapped gaps become file backed maps.
+        '''
+        filled = False
+        pos = vm_start
+        for bm in list(self.region_index.iter_overlapping(vm_start, vm_end)):
+            if bm.get_start() > pos:
+                filled |= self._add_file_pages(io_obj, pos, bm.get_start(), offset + pos - vm_start)
+            pos = max(pos, bm.get_end())
+            if isinstance(bm, (ZeroBacked, SparseBacked)):
+                filled |= self._fill_from_file(bm, io_obj, vm_start, vm_end, offset)
+        if pos < vm_end:
+            filled |= self._add_file_pages(io_obj, pos, vm_end, offset + pos - vm_start)
+        return filled
+
+    def _add_file_pages(self, io_obj, start, end, offset):
+        # io_obj is shared by the file's other mappings, it stays open
+        fbm = self.create_file_backed(io_obj, start, end - start,
+                                      filename=io_obj.get_filename(), offset=offset,
+                                      flags=4, page_size=self.page_size)
+        return self.add_map_to_kb(fbm)
+
+    def _fill_from_file(self, bm, io_obj, vm_start, vm_end, offset):
+        extents = list(bm.extents) if isinstance(bm, SparseBacked) else []
+        # data dumped into the core wins over the file's
+        data_end = max([o + e.get_size() for o, e in extents] + [0])
+        start = max(bm.get_start() + data_end, vm_start)
+        end = min(bm.get_end(), vm_end)
+        if start >= end:
+            return False
+        fbm = self.create_file_backed(io_obj, start, end - start,
+                                      filename=io_obj.get_filename(),
+                                      offset=offset + start - vm_start,
+                                      flags=bm.flags, page_size=bm.page_size)
+        extents.append((start - bm.get_start(), fbm))
+        sbm = SparseBacked(extents, bm.get_start(), bm.get_size(), phy_start=bm.phy_start,
+                           page_size=bm.page_size, filename=bm.filename, flags=bm.flags)
+        if not self.remove_map_from_kb(bm):
+            return False
+        if not self.add_map_to_kb(sbm):
+            self.add_map_to_kb(bm)
+            return False
+        return True
+
+    def share_mmaps(self, bm):
+        '''
+        point bm (and any maps placed inside it) at the manager's one
+        mapping of its source, rather than each mapping the file itself
+        '''
+        if isinstance(bm, MmapBacked) and 'mm' not in bm.__dict__:
+            mm = self.get_mmap(bm.io_obj)
+            if mm is not None:
+                bm.set_mmap(mm)
+        for _, ebm in getattr(bm, 'extents', []):
+            self.share_mmaps(ebm)
+
+    def get_mmap(self, io_obj):
+        '''
+        map file:// sources once and share the mapping, returns None
+        for anything that can not be memory mapped
+        '''
+        source = io_obj.get_source()
+        if io_obj.inmemory or source is None or \
+           not source.startswith('file://'):
+            return None
+        mm = self.mmaps.get(source, None)
+        if mm is None:
+            try:
+                mm = MmapBacked.map_file(io_obj)
+            except (ValueError, OSError):
+                # empty files and special files can not be mapped
+                return None
+            self.mmaps[source] = mm
+        return mm
+
+    def create_file_backed(self, io_obj, va_start, size, filename=None, offset=None, phy_start=0, flags=0, page_size=4096,
+                           file_size=None):
+        '''
+        memory map of size bytes backed by io_obj at offset.  when
+        file_size is smaller than size only the first file_size bytes
+        come from the file and the rest reads as zeros.
+        '''
+        if file_size is not None and file_size < size:
+            if file_size <= 0:
+                return ZeroBacked(va_start, size, phy_start=phy_start,
+                                  page_size=page_size, filename=filename, flags=flags)
+            fbm = self.create_file_backed(io_obj, va_start, file_size,
+                                          filename=filename, offset=offset,
+                                          phy_start=phy_start, flags=flags,
+                                          page_size=page_size)
+            return SparseBacked([(0, fbm)], va_start, size, phy_start=phy_start,
+                                page_size=page_size, filename=filename, flags=flags)
+
+        mm = self.get_mmap(io_obj)
+        if mm is not None:
+            return MmapBacked(io_obj, va_start, size,
+                              phy_start=phy_start, page_size=page_size,
+                              filename=filename, flags=flags,
+                              mm=mm, file_offset=offset)
+        return IOBacked(io_obj, va_start, size, 
+                        phy_start=phy_start, page_size=page_size, 
+                        filename=filename, flags=flags, file_offset=offset,
+                        block_cache=self.block_cache)
+
+    def add_ioobj(self, io_obj, va_start, size, filename=None, offset=0, phy_start=0, flags=0, page_size=4096,
+                  file_size=None):
         '''
         opens the file and seeks to the relevant offset.
         the offset is then used as the physical start of this data segment 
@@ -44,9 +399,10 @@ class Manager(BaseManager):
         # in a file size that is less than the VA space 
         # 3) if the position in file falls out of sync with the physical address
         # reading the space will happen incorrectly
-        ibm = IOBacked(io_obj, va_start, size, 
-                       phy_start=phy_start, page_size=page_size, 
-                       filename=filename, flags=flags)
+        ibm = self.create_file_backed(io_obj, va_start, size, 
+                                      filename=filename, offset=offset,
+                                      phy_start=phy_start, page_size=page_size, 
+                                      flags=flags, file_size=file_size)
         
         if not self.add_map_to_kb(ibm):
             del ibm
@@ -54,7 +410,8 @@ class Manager(BaseManager):
             return None
         return ibm
 
-    def add_iomap(self, filename, va_start, size, offset=0, phy_start=0, flags=0, page_size=4096):
+    def add_iomap(self, filename, va_start, size, offset=0, phy_start=0, flags=0, page_size=4096,
+                  file_size=None):
         '''
         opens the file and seeks to the relevant offset.
         the offset is then used as the physical start of this data segment 
@@ -68,9 +425,10 @@ class Manager(BaseManager):
         # reading the space will happen incorrectly
         io_obj = self.file_loader.load_file(filename, namespace=self.namespace)
         io_obj.seek(offset)
-        ibm = IOBacked(io_obj, va_start, size, 
-                       phy_start=phy_start, page_size=page_size, 
-                       filename=filename, flags=flags)
+        ibm = self.create_file_backed(io_obj, va_start, size, 
+                                      filename=filename, offset=offset,
+                                      phy_start=phy_start, page_size=page_size, 
+                                      flags=flags, file_size=file_size)
         
         if not self.add_map_to_kb(ibm):
             del ibm
@@ -89,17 +447,51 @@ class Manager(BaseManager):
             return None
         return bbm
 
+    def add_compressed_buffermap(self, bytes_obj, va_start, size=None, filename=None, offset=0, flags=0, page_size=4096,
+                                 block_size=COMPRESSED_BLOCK_SIZE, codec='zlib', level=6):
+        cbm = CompressedBacked(bytes_obj, va_start, size, phy_start=offset,
+                               page_size=page_size, filename=filename, flags=flags,
+                               block_size=block_size, codec=codec, level=level,
+                               block_cache=self.block_cache)
+        if not self.add_map_to_kb(cbm):
+            del cbm
+            return None
+        return cbm
+
+    def compress_map(self, bm, block_size=COMPRESSED_BLOCK_SIZE, codec='zlib', level=6):
+        '''
+        replace a registered memory map with a compressed copy of its data
+        '''
+        cbm = CompressedBacked.from_memory_object(bm, block_size=block_size, codec=codec,
+                                                  level=level, block_cache=self.block_cache)
+        if not self.remove_map_from_kb(bm):
+            return None
+        if not self.add_map_to_kb(cbm):
+            self.add_map_to_kb(bm)
+            return None
+        return cbm
+
     def add_null_buffermap(self, va_start, size, filename=None, offset=0, flags=0, page_size=4096):
-        bytes_obj = b'\x00' * size
-        phy_start = offset
-        bbm = BufferBacked(bytes_obj, va_start, len(size), phy_start=offset, 
-                            page_size=flags, filename=filename, flags=flags)
-        
-        if not self.add_map_to_kb(bbm):
-            del bbm
-            io_obj.close()
+        zbm = ZeroBacked(va_start, size, phy_start=offset,
+                         page_size=page_size, filename=filename, flags=flags)
+
+        if not self.add_map_to_kb(zbm):
+            del zbm
             return None
-        return bbm
+        return zbm
+
+    def add_sparse_map(self, extents, va_start, size, filename=None, offset=0, flags=0, page_size=4096):
+        '''
+        register a memory map made of (offset, memory map) extents
+        with zeros everywhere else
+        '''
+        sbm = SparseBacked(extents, va_start, size, phy_start=offset,
+                           page_size=page_size, filename=filename, flags=flags)
+
+        if not self.add_map_to_kb(sbm):
+            del sbm
+            return None
+        return sbm
 
 
 
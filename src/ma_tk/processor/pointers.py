@@ -0,0 +1,119 @@
+from .. import util
+from ..consts import SCAN_CHUNK_SIZE
+
+
+class PointerScanner(object):
+    '''
+    find every aligned word in the mapped memory that points into a
+    mapped region.
+
+    each memory map is viewed in chunks as a numpy integer array and
+    all candidates of a chunk are checked against the sorted region
+    bounds with a single searchsorted, so memory use is bounded by the
+    chunk size rather than by the size of the dump.
+    '''
+
+    DTYPE = [('source', 'u8'), ('target', 'u8'), ('region', 'u4')]
+
+    def __init__(self, manager, width: int = 8, littleendian: bool = True,
+                 alignment: int = None, chunk_size: int = SCAN_CHUNK_SIZE):
+        if util.np is None:
+            raise ImportError("numpy is required for pointer scanning")
+        np = util.np
+        self.manager = manager
+        self.width = width
+        self.alignment = width if alignment is None else alignment
+        self.dtype = np.dtype('{}u{}'.format('<' if littleendian else '>', width))
+        # keep chunks a multiple of the word size and alignment
+        step = max(width, self.alignment)
+        self.chunk_size = max(step, chunk_size - chunk_size % step)
+        # snapshot of the region index, table entries refer to these
+        self.regions = list(manager.region_index)
+        self.starts = np.array(manager.region_index.starts, dtype=np.uint64)
+        self.ends = np.array(manager.region_index.ends, dtype=np.uint64)
+        # zero words only count as pointers when address 0 is mapped,
+        # otherwise runs known to be zero are skipped
+        zero = np.zeros(1, dtype=np.uint64)
+        self.zero_is_pointer = len(self.lookup(zero, zero)) > 0
+
+    def get_region(self, idx):
+        return self.regions[idx]
+
+    def empty_table(self):
+        return util.np.empty(0, dtype=self.DTYPE)
+
+    def scan(self, regions=None):
+        '''
+        scan the given memory maps (all of them by default) and return
+        a single table with source, target and region index fields
+        '''
+        tables = list(self.iter_scan(regions))
+        if len(tables) == 0:
+            return self.empty_table()
+        return util.np.concatenate(tables)
+
+    def iter_scan(self, regions=None):
+        '''
+        yield one table per chunk that contained pointers
+        '''
+        regions = self.regions if regions is None else regions
+        for bm in regions:
+            for table in self.scan_region(bm):
+                yield table
+
+    def scan_region(self, bm):
+        start = bm.get_start()
+        size = bm.get_size()
+        # first offset whose vaddr honors the alignment
+        first = (-start) % self.alignment
+        overlap = self.width - 1
+        if self.zero_is_pointer:
+            ranges = [(0, size)]
+        else:
+            ranges = util.get_scan_ranges(bm, overlap)
+        for lo, hi in ranges:
+            offset = lo + (first - lo) % self.alignment
+            while offset < hi and offset + self.width <= size:
+                limit = min(self.chunk_size, hi - offset)
+                length = min(limit + overlap, size - offset)
+                buf = bm.read_buffer(offset, length)
+                if len(buf) < self.width:
+                    break
+                table = self.scan_buffer(buf, start + offset, limit)
+                if len(table) > 0:
+                    yield table
+                offset += self.chunk_size
+
+    def scan_buffer(self, buf, vaddr, limit=None):
+        '''
+        check the candidates of a chunk that starts at the aligned vaddr,
+        candidates starting limit (chunk_size by default) bytes or more
+        into the chunk belong to the next chunk
+        '''
+        np = util.np
+        limit = self.chunk_size if limit is None else limit
+        count = (len(buf) - self.width) // self.alignment + 1
+        count = min(count, -(-limit // self.alignment))
+        if count <= 0:
+            return self.empty_table()
+        if self.alignment == self.width:
+            values = np.frombuffer(buf, dtype=self.dtype, count=count)
+        else:
+            raw = np.frombuffer(buf, dtype=np.uint8)
+            values = np.lib.stride_tricks.as_strided(
+                raw, shape=(count, self.width), strides=(self.alignment, 1))
+            values = np.ascontiguousarray(values).view(self.dtype).reshape(count)
+        sources = np.arange(count, dtype=np.uint64) * np.uint64(self.alignment) + \
+                  np.uint64(vaddr)
+        return self.lookup(sources, values.astype(np.uint64))
+
+    def lookup(self, sources, values):
+        np = util.np
+        idx = np.searchsorted(self.starts, values, side='right').astype(np.int64) - 1
+        valid = idx >= 0
+        valid[valid] = values[valid] < self.ends[idx[valid]]
+        table = np.empty(int(valid.sum()), dtype=self.DTYPE)
+        table['source'] = sources[valid]
+        table['target'] = values[valid]
+        table['region'] = idx[valid]
+        return table
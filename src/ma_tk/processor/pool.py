@@ -0,0 +1,145 @@
+import os
+import functools
+import multiprocessing
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait, as_completed
+
+from ..consts import SCAN_CHUNK_SIZE
+
+
+# a bounded slice [vaddr, vaddr+size) of the memory map starting at region
+Chunk = namedtuple('Chunk', ['vaddr', 'size', 'region'])
+
+# manager each worker process operates on, set by _init_worker
+_WORKER_MANAGER = None
+
+
+def _init_worker(manager):
+    global _WORKER_MANAGER
+    _WORKER_MANAGER = manager
+
+
+def _run_chunk(func, chunk):
+    return chunk, func(_WORKER_MANAGER, chunk)
+
+
+def split_regions(manager, chunk_size: int = SCAN_CHUNK_SIZE, regions=None,
+                  largest_first: bool = True):
+    '''
+    split memory maps into chunks of at most chunk_size bytes,
+    largest chunks first so stragglers are small, or in address order
+    '''
+    regions = list(manager.region_index) if regions is None else regions
+    chunks = []
+    for bm in regions:
+        start = bm.get_start()
+        end = bm.get_end()
+        for vaddr in range(start, end, chunk_size):
+            chunks.append(Chunk(vaddr, min(chunk_size, end - vaddr), start))
+    if largest_first:
+        chunks.sort(key=lambda c: c.size, reverse=True)
+    return chunks
+
+
+class Processor(object):
+    '''
+    run a per chunk function over a Manager's memory maps in a pool of
+    worker processes and reduce the results.
+
+    func(manager, chunk) is called once per Chunk and must be picklable
+    (a module level function).  large regions are split into bounded
+    chunks and workers pull the next chunk from a shared queue whenever
+    they finish one, so a single huge region is spread across all of the
+    workers instead of pinning one of them.
+
+    on platforms with fork the workers inherit the manager (and any
+    mapped dump) copy-on-write, otherwise the manager is pickled once
+    per worker.
+    '''
+
+    def __init__(self, manager, workers: int = None,
+                 chunk_size: int = SCAN_CHUNK_SIZE, use_fork: bool = True):
+        self.manager = manager
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.use_fork = use_fork
+
+    def get_context(self):
+        methods = multiprocessing.get_all_start_methods()
+        if self.use_fork and 'fork' in methods:
+            return multiprocessing.get_context('fork')
+        return multiprocessing.get_context()
+
+    def map(self, func, regions=None):
+        '''
+        yield (chunk, result) pairs as chunks complete
+        '''
+        chunks = split_regions(self.manager, self.chunk_size, regions)
+        if self.workers == 0:
+            # run inline, handy for debugging
+            for chunk in chunks:
+                yield chunk, func(self.manager, chunk)
+            return
+
+        # keep a bounded number of chunks queued so results are streamed
+        # back without submitting every chunk up front
+        max_pending = self.workers * 4
+        pending = set()
+        chunks = iter(chunks)
+        with self.create_executor() as executor:
+            for chunk in chunks:
+                pending.add(executor.submit(_run_chunk, func, chunk))
+                if len(pending) < max_pending:
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+            for future in as_completed(pending):
+                yield future.result()
+
+    def create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=self.get_context(),
+                                   initializer=_init_worker,
+                                   initargs=(self.manager,))
+
+    def map_ordered(self, func, regions=None, max_pending: int = None):
+        '''
+        yield (chunk, result) pairs in address order.  at most
+        max_pending chunks (4 per worker by default) are in flight, so
+        a slow consumer holds back the workers instead of the results
+        piling up.
+        '''
+        chunks = split_regions(self.manager, self.chunk_size, regions, largest_first=False)
+        if self.workers == 0:
+            for chunk in chunks:
+                yield chunk, func(self.manager, chunk)
+            return
+
+        max_pending = self.workers * 4 if max_pending is None else max_pending
+        pending = deque()
+        with self.create_executor() as executor:
+            for chunk in chunks:
+                pending.append(executor.submit(_run_chunk, func, chunk))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def run(self, func, reduce_func=None, initial=None, regions=None):
+        '''
+        map func over every chunk and fold the results with reduce_func,
+        which should not depend on the order results arrive in.  without
+        reduce_func a list of the results in chunk address order is
+        returned.  with no chunks to run the result is initial.
+        '''
+        results = self.map(func, regions)
+        if reduce_func is None:
+            return [r for _, r in sorted(results, key=lambda cr: cr[0].vaddr)]
+        values = (r for _, r in results)
+        if initial is None:
+            for first in values:
+                return functools.reduce(reduce_func, values, first)
+            return None
+        return functools.reduce(reduce_func, values, initial)
@@ -0,0 +1,153 @@
+import re
+import functools
+
+from .. import util
+from ..consts import SCAN_CHUNK_SIZE, SEARCH_MAX_MATCH
+
+
+def compile_pattern(pattern, regex=False):
+    if regex:
+        return pattern if hasattr(pattern, 'finditer') else re.compile(pattern, re.DOTALL)
+    return re.compile(re.escape(pattern))
+
+
+def find_all(buf, pattern, end):
+    # every start of pattern in buf before end, overlapping ones included
+    data = buf if hasattr(buf, 'find') else bytes(buf)
+    pos = data.find(pattern, 0)
+    while pos != -1 and pos < end:
+        yield pos
+        pos = data.find(pattern, pos + 1)
+
+
+def prepare_pattern(pattern, regex=False, max_match: int = SEARCH_MAX_MATCH):
+    '''
+    (pattern, compiled regex or None, max_match, matches_zeros) for a
+    byte pattern or regex
+    '''
+    if isinstance(pattern, str):
+        pattern = pattern.encode('utf-8')
+    if not regex:
+        if len(pattern) == 0:
+            # would match every address of every map
+            raise ValueError("empty search pattern")
+        return pattern, None, len(pattern), pattern.strip(b'\x00') == b''
+    compiled = compile_pattern(pattern, regex)
+    return pattern, compiled, max_match, compiled.search(bytes(max_match)) is not None
+
+
+def search_region(bm, pattern, regex=False, chunk_size: int = SCAN_CHUNK_SIZE,
+                  max_match: int = SEARCH_MAX_MATCH, begin: int = 0, end: int = None):
+    '''
+    lazily yield the vaddr of every match in a memory map.
+
+    the map is read in chunks of chunk_size bytes that overlap the next
+    chunk, so matches crossing a chunk boundary are still found (for
+    regexes, as long as they are at most max_match bytes long).  a match
+    is reported by the chunk its first byte falls in, so nothing is
+    reported twice.  byte patterns report overlapping matches, regex
+    matches do not overlap (as with re.finditer).  runs the map knows
+    to be zero are skipped unless the pattern can match zeros.  with
+    begin and end only matches starting in [begin, end) of the map are
+    reported.
+    '''
+    pattern, compiled, max_match, matches_zeros = prepare_pattern(pattern, regex, max_match)
+    overlap = max(0, max_match - 1)
+    start = bm.get_start()
+    size = bm.get_size()
+    end = size if end is None else min(end, size)
+    ranges = [(0, size)] if matches_zeros else util.get_scan_ranges(bm, overlap)
+    for lo, hi in ranges:
+        lo = max(lo, begin)
+        hi = min(hi, end)
+        offset = lo
+        while offset < hi:
+            length = min(chunk_size, hi - offset)
+            buf = bm.read_buffer(offset, min(length + overlap, size - offset))
+            if len(buf) == 0:
+                break
+            if regex:
+                matches = (m.start() for m in compiled.finditer(buf))
+            else:
+                matches = find_all(buf, pattern, length)
+            for pos in matches:
+                if pos >= length:
+                    break
+                yield start + offset + pos
+            offset += length
+
+
+def search_seam(prev, bm, pattern, regex=False, max_match: int = SEARCH_MAX_MATCH):
+    '''
+    yield the vaddr of every match that starts in prev and runs into bm,
+    which starts where prev ends.  neither map sees these on its own.
+    '''
+    pattern, compiled, max_match, _ = prepare_pattern(pattern, regex, max_match)
+    overlap = max(0, max_match - 1)
+    if overlap == 0:
+        return
+    tail = bytes(prev.read_buffer(max(0, prev.get_size() - overlap), overlap))
+    buf = tail + bytes(bm.read_buffer(0, min(overlap, bm.get_size())))
+    seam = len(tail)
+    base = prev.get_end() - seam
+    if regex:
+        for m in compiled.finditer(buf):
+            if m.start() >= seam:
+                break
+            if m.end() > seam:
+                yield base + m.start()
+        return
+    # a byte pattern starting before the seam always crosses it
+    for pos in find_all(buf, pattern, seam):
+        yield base + pos
+
+
+def search_chunk(manager, chunk, pattern, regex=False, chunk_size: int = SCAN_CHUNK_SIZE,
+                 max_match: int = SEARCH_MAX_MATCH):
+    '''
+    Processor function, list of the matches starting in chunk
+    '''
+    bm = manager.get_map(chunk.region)
+    begin = chunk.vaddr - bm.get_start()
+    return list(search_region(bm, pattern, regex, chunk_size, max_match,
+                              begin, begin + chunk.size))
+
+
+def search_regions(regions, pattern, regex=False, chunk_size: int = SCAN_CHUNK_SIZE,
+                   max_match: int = SEARCH_MAX_MATCH, processor=None):
+    '''
+    search several memory maps one after the other, yielding matches in
+    region order.  matches crossing from one map into the next one,
+    starting right where it ends, are found as well.  only the chunk
+    being searched is held in memory.  an empty byte pattern raises
+    ValueError right away.
+
+    with a Processor the chunks of the maps are searched by its worker
+    processes, a bounded number at a time, and the matches are still
+    yielded lazily in region order.
+    '''
+    # checked here, the generators below only run once iterated
+    prepare_pattern(pattern, regex, max_match)
+    return _search_regions(regions, pattern, regex, chunk_size, max_match, processor)
+
+
+def _search_regions(regions, pattern, regex, chunk_size, max_match, processor):
+    if processor is None:
+        results = ((bm, search_region(bm, pattern, regex, chunk_size, max_match))
+                   for bm in regions)
+    else:
+        regions = list(regions)
+        by_start = {bm.get_start(): bm for bm in regions}
+        func = functools.partial(search_chunk, pattern=pattern, regex=regex,
+                                 chunk_size=chunk_size, max_match=max_match)
+        results = ((by_start[chunk.region], matches)
+                   for chunk, matches in processor.map_ordered(func, regions))
+
+    prev = None
+    for bm, matches in results:
+        if prev is not None and bm is not prev and prev.get_end() == bm.get_start():
+            for vaddr in search_seam(prev, bm, pattern, regex, max_match):
+                yield vaddr
+        for vaddr in matches:
+            yield vaddr
+        prev = bm
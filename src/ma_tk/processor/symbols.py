@@ -0,0 +1,106 @@
+from bisect import bisect_right
+from collections import namedtuple
+
+from .. import util
+from ..load.elfcache import ElfMetadata
+
+
+Symbol = namedtuple('Symbol', ['name', 'vaddr', 'size', 'filename'])
+
+
+class SymbolIndex(object):
+    '''
+    address sorted symbols of the ELF files mapped into a process.
+
+    .symtab and .dynsym are read once per file, see ElfMetadata, and
+    relocated to the file's mapped base, lookups are a bisect over the
+    sorted start addresses.  a symbol with a size
+    matches addresses inside it, one without only its own address.
+    when the closest preceding symbol does not contain an address the
+    symbols enclosing it (a function around a local label) are tried,
+    innermost first.
+    '''
+
+    def __init__(self):
+        self.pending = []
+        self.starts = []
+        self.ends = []
+        # index of the innermost earlier symbol still open at each
+        # symbol's start, -1 for none
+        self.parents = []
+        self.symbols = []
+        self._np_starts = None
+
+    def __len__(self):
+        self._sort()
+        return len(self.symbols)
+
+    def add_symbol(self, sym):
+        '''
+        add a Symbol that is already relocated
+        '''
+        self.pending.append(sym)
+
+    def add_elf(self, ef, mapped_start, filename):
+        '''
+        add the symbols of the ELFFile ef whose offset 0 is mapped at
+        mapped_start, returns the number of symbols added
+        '''
+        return self.add_metadata(ElfMetadata.from_elffile(ef), mapped_start, filename)
+
+    def add_metadata(self, md, mapped_start, filename):
+        '''
+        add the symbols of an ElfMetadata, see add_elf
+        '''
+        bias = md.get_load_bias(mapped_start)
+        for sym in md.symbols:
+            self.pending.append(Symbol(sym.name, sym.value + bias, sym.size, filename))
+        return len(md.symbols)
+
+    def _sort(self):
+        if not self.pending:
+            return
+        # enclosing symbols sort before the ones they contain
+        self.symbols = sorted(self.symbols + self.pending, key=lambda s: (s.vaddr, -s.size))
+        self.pending = []
+        self.starts = [s.vaddr for s in self.symbols]
+        self.ends = [s.vaddr + max(s.size, 1) for s in self.symbols]
+        self.parents = []
+        stack = []
+        for idx, start in enumerate(self.starts):
+            while stack and self.ends[stack[-1]] <= start:
+                stack.pop()
+            self.parents.append(stack[-1] if stack else -1)
+            stack.append(idx)
+        self._np_starts = None
+
+    def _match(self, idx, vaddr):
+        # every earlier symbol that can contain vaddr is on the parent
+        # chain of the closest preceding one
+        while idx >= 0:
+            if vaddr < self.ends[idx]:
+                return self.symbols[idx]
+            idx = self.parents[idx]
+        return None
+
+    def lookup(self, vaddr):
+        '''
+        Symbol containing vaddr or None
+        '''
+        self._sort()
+        return self._match(bisect_right(self.starts, vaddr) - 1, vaddr)
+
+    def lookup_many(self, addrs):
+        '''
+        Symbol or None for each address, one vectorized search when
+        numpy is available
+        '''
+        self._sort()
+        np = util.np
+        if np is None or not self.symbols:
+            return [self.lookup(vaddr) for vaddr in addrs]
+        if self._np_starts is None:
+            self._np_starts = np.array(self.starts, dtype=np.uint64)
+        addrs = np.asarray(addrs, dtype=np.uint64)
+        idxs = np.searchsorted(self._np_starts, addrs, side='right') - 1
+        return [self._match(int(idx), int(vaddr)) for idx, vaddr in zip(idxs, addrs)]
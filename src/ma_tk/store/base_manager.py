@@ -1,53 +1,113 @@
 from st_log.st_log import Logger
+import os
+import json
+import uuid
+import ctypes
+import asyncio
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from .. import util
+from ..consts import GAP_RAISE, GAP_ZERO, GAP_TRUNCATE, \
+                     READ_MANY_MAX_GAP, READ_MANY_MAX_READ, DUMP_BLOCK_SIZE, \
+                     ASYNC_READ_WORKERS
+from .index import RegionIndex, RegionPages
 import logging
 
+
+class UnmappedReadError(Exception):
+
+    def __init__(self, vaddr, size):
+        super().__init__("unmapped memory at {:08x} ({} bytes)".format(vaddr, size))
+        self.vaddr = vaddr
+        self.size = size
+
+
 class BaseManager(object):
 
     def __init__(self, **kargs):
         self.maps = []
         self.maps_by_name = {}
-        self.maps_by_page = {}
+        self.region_index = RegionIndex()
 
         self.vaddr_pos = 0
-        self.page_cache = set()
         self.page_size = kargs.get('page_size', 4096)
         self.page_mask = util.get_page_mask(self.page_size)
-        self.logger = Logger("matk.store.base_manager.BaseManager", level=kargs.get('loglevel', logging.INFO))
+        self.loglevel = kargs.get('loglevel', logging.INFO)
+        self.logger = Logger("matk.store.base_manager.BaseManager", level=self.loglevel)
+        # threads serving the asyncio reads, created on first use
+        self.async_workers = kargs.get('async_workers', ASYNC_READ_WORKERS)
+        self._executor = None
+        self._executor_lock = Lock()
+        # (loop, request) -> future of the read in flight
+        self._inflight = {}
+
+    def __getstate__(self):
+        # memory maps pickle as descriptors of their sources
+        return {k: v for k, v in self.__dict__.items()
+                if k not in ('logger', '_executor', '_executor_lock', '_inflight')}
+
+    def __setstate__(self, _dict):
+        self.__dict__.update(_dict)
+        self.logger = Logger("matk.store.base_manager.BaseManager", level=self.loglevel)
+        self._executor = None
+        self._executor_lock = Lock()
+        self._inflight = {}
 
 
     def get_map(self, vaddr):
         self.logger.debug("get_map retrieving vaddr: {:08x}".format(vaddr))
-        if not self.check_presence(vaddr=vaddr):
-            return None
-        return self.maps_by_page[self.calc_page(vaddr)]
+        return self.region_index.find(vaddr)
 
     def add_map_to_kb(self, bm):
         name = bm.get_name()
-        pc = bm.get_page_cache()
         self.logger.debug("add_map_to_kb adding memory map {} {:08x}-{:08x}".format(name, bm.get_start(), bm.get_end()))
         if self.check_presence(bm):
             return False
+        if not self.region_index.add(bm):
+            return False
         self.vaddr_pos = bm.get_va_start()
-        self.page_cache = self.page_cache | pc
-        for p in pc:
-            self.maps_by_page[p] = bm
+        self.maps.append(bm)
         self.maps_by_name[name] = bm
         return True
 
+    def add_maps_to_kb(self, bms):
+        '''
+        register many memory maps at once, returns the maps that were
+        not added because of a name or address conflict
+        '''
+        self.logger.debug("add_maps_to_kb adding {} memory maps".format(len(bms)))
+        names = set()
+        candidates = []
+        rejected = []
+        for bm in bms:
+            name = bm.get_name()
+            if name in self.maps_by_name or name in names:
+                rejected.append(bm)
+                continue
+            names.add(name)
+            candidates.append(bm)
+
+        overlapping = self.region_index.add_many(candidates)
+        skip = set(id(bm) for bm in overlapping)
+        for bm in candidates:
+            if id(bm) in skip:
+                continue
+            self.maps.append(bm)
+            self.maps_by_name[bm.get_name()] = bm
+            self.vaddr_pos = bm.get_va_start()
+        return rejected + overlapping
+
     def remove_map_from_kb(self, bm):
         name = bm.get_name()
         self.logger.debug("remove_map_from_kb adding memory map {} {:08x}-{:08x}".format(name, bm.get_start(), bm.get_end()))
-        pc = bm.get_page_cache()
-        
+
         if not self.check_presence(bm):
             return True
 
-        self.page_cache = {i for i in self.page_cache if i not in pc}        
-
-        for p in pc:
-            del self.maps_by_page[pc]
+        if not self.region_index.remove(bm):
+            return False
 
+        self.maps.remove(bm)
         del self.maps_by_name[name]
         return True
 
@@ -55,13 +115,12 @@ class BaseManager(object):
         return self.vaddr_pos
 
     def check_presence(self, bm=None, name=None, vaddr=None):
-        page = self.calc_page(vaddr) if vaddr else None
         result = False
         how = 'Failed'
-        if page and \
-           (page in self.page_cache or page in self.maps_by_page):
+        if vaddr is not None and \
+           self.region_index.find(vaddr) is not None:
            result = True
-           how = "page: {:08x}".format(page)
+           how = "vaddr: {:08x}".format(vaddr)
 
         if name and \
            (name in self.maps_by_name):
@@ -70,8 +129,7 @@ class BaseManager(object):
 
         if bm is not None:
             name = bm.get_name()
-            pc = bm.get_page_cache()
-            result = len(pc & self.page_cache) > 0 or \
+            result = self.region_index.overlaps(bm.get_start(), bm.get_end()) or \
                      name in self.maps_by_name
             how = "memory map: {:08x} {}".format(bm.get_start(), name)
         
@@ -82,7 +140,11 @@ class BaseManager(object):
         return self.calc_page(vaddr)
 
     def get_page_cache(self):
-        return self.page_cache
+        '''
+        pages of every mapped region in address order, as a view that
+        can be iterated any number of times
+        '''
+        return RegionPages(self.region_index, self.page_size)
     
     def translate_vaddr_to_offset(self, vaddr):
         bm = self.get_map(vaddr)
@@ -117,10 +179,9 @@ class BaseManager(object):
         return r
 
     def check_vaddr(self, vaddr):
-        return self.check_presence(vaddr)
+        return self.check_presence(vaddr=vaddr)
 
     def read(self, size, addr=None, offset=None):
-        # FIXME data does not read across memory boundaries
         addr = self.vaddr_pos if addr is None and offset is None else addr
         self.logger.debug("read {} bytes @ addr: {:08x}".format(size, addr))
         if not addr is None:
@@ -137,20 +198,134 @@ class BaseManager(object):
 
 
     def read_at_vaddr(self, vaddr: int, size: int = 1):
-        # TODO does this read cross a boundary?
-        # FIXME
         bm = self.get_map(vaddr)
         if bm is None:
             return None
+        if vaddr + size > bm.get_end():
+            # read spans into the following maps
+            data = bytes(self.read_span(vaddr, size, on_gap=GAP_TRUNCATE))
+            self.vaddr_pos = vaddr + len(data)
+            return data
         data = bm.read_at_vaddr(vaddr, size)
         self.vaddr_pos = bm.get_current_vaddr()
         return data
 
+    def read_span(self, vaddr: int, size: int, on_gap: str = GAP_RAISE):
+        '''
+        read [vaddr, vaddr+size) across every memory map covering it.
+
+        on_gap selects what happens at unmapped bytes:
+            GAP_RAISE raises UnmappedReadError
+            GAP_ZERO fills the gap with zeros
+            GAP_TRUNCATE stops at the first gap
+        returns a bytearray
+        '''
+        buf = bytearray(size)
+        n = self.read_span_into(vaddr, buf, on_gap=on_gap)
+        if n < size:
+            del buf[n:]
+        return buf
+
+    def read_span_into(self, vaddr: int, buf, on_gap: str = GAP_RAISE):
+        '''
+        fill a preallocated writable buffer from every memory map covering
+        [vaddr, vaddr+len(buf)) in a single pass over the region index.
+        returns the number of bytes filled, which is only short of
+        len(buf) when on_gap is GAP_TRUNCATE.
+        '''
+        if on_gap not in (GAP_RAISE, GAP_ZERO, GAP_TRUNCATE):
+            raise ValueError("unknown gap handling: {}".format(on_gap))
+
+        view = memoryview(buf).cast('B')
+        size = len(view)
+        end = vaddr + size
+        pos = vaddr
+        # gaps are the bytes before each map and any data a map could
+        # not provide, followed by whatever is left past the last map
+        for bm in self.region_index.iter_overlapping(vaddr, end):
+            start = bm.get_start()
+            if start > pos:
+                if on_gap == GAP_TRUNCATE:
+                    return pos - vaddr
+                elif on_gap == GAP_RAISE:
+                    raise UnmappedReadError(pos, start - pos)
+                view[pos - vaddr:start - vaddr] = bytes(start - pos)
+                pos = start
+
+            stop = min(end, bm.get_end())
+            pos += bm.read_into(view[pos - vaddr:stop - vaddr], pos - start)
+            if pos < stop:
+                if on_gap == GAP_TRUNCATE:
+                    return pos - vaddr
+                elif on_gap == GAP_RAISE:
+                    raise UnmappedReadError(pos, stop - pos)
+                view[pos - vaddr:stop - vaddr] = bytes(stop - pos)
+                pos = stop
+
+        if pos < end:
+            if on_gap == GAP_TRUNCATE:
+                return pos - vaddr
+            elif on_gap == GAP_RAISE:
+                raise UnmappedReadError(pos, end - pos)
+            view[pos - vaddr:] = bytes(end - pos)
+        return size
+
+    def read_many(self, requests, max_gap: int = READ_MANY_MAX_GAP,
+                  max_read: int = READ_MANY_MAX_READ):
+        '''
+        read a batch of (vaddr, size) requests.
+
+        requests are grouped by memory map and sorted by offset, and
+        requests less than max_gap bytes apart are merged into a single
+        read of at most max_read bytes (one request is never split).
+        returns the data for each request in the order given, or None
+        for requests that are not fully mapped.
+        '''
+        results = [None] * len(requests)
+        by_map = {}
+        for idx, (vaddr, size) in enumerate(requests):
+            bm = self.region_index.find(vaddr)
+            if bm is None:
+                continue
+            if vaddr + size > bm.get_end():
+                # rare enough to not bother batching
+                data = self.read_span(vaddr, size, on_gap=GAP_TRUNCATE)
+                results[idx] = bytes(data) if len(data) == size else None
+                continue
+            by_map.setdefault(id(bm), (bm, []))[1].append((vaddr - bm.get_start(), size, idx))
+
+        for bm, pending in by_map.values():
+            pending.sort()
+            group = []
+            group_start = group_end = None
+            for offset, size, idx in pending:
+                if group and (offset > group_end + max_gap or \
+                              max(group_end, offset + size) - group_start > max_read):
+                    self._read_group(bm, group, group_start, group_end, results)
+                    group = []
+                if not group:
+                    group_start = offset
+                    group_end = offset
+                group.append((offset, size, idx))
+                group_end = max(group_end, offset + size)
+            if group:
+                self._read_group(bm, group, group_start, group_end, results)
+        return results
+
+    def _read_group(self, bm, group, start, end, results):
+        buf = bytearray(end - start)
+        n = bm.read_into(buf, start)
+        view = memoryview(buf)
+        for offset, size, idx in group:
+            if offset + size - start <= n:
+                results[idx] = bytes(view[offset - start:offset - start + size])
+
     def vaddr_in_range(self, vaddr):
-        return self.check_presence(vaddr)
+        return self.check_presence(vaddr=vaddr)
 
     def can_read(self, vaddr, len_):
-        if not self.check_presence(vaddr) or not self.check_presence(offset+len_):
+        if not self.check_presence(vaddr=vaddr) or \
+           not self.check_presence(vaddr=vaddr+len_-1):
             return False 
         return True
 
@@ -192,37 +367,189 @@ class BaseManager(object):
         self.vaddr_pos = bm.get_current_vaddr()
         return data
 
+    ######################## Bulk typed read operations
+    def read_words(self, addr, count, signed=False, littleendian=True):
+        return self.read_array(addr, count, 2, signed, littleendian)
+
+    def read_dwords(self, addr, count, signed=False, littleendian=True):
+        return self.read_array(addr, count, 4, signed, littleendian)
+
+    def read_qwords(self, addr, count, signed=False, littleendian=True):
+        return self.read_array(addr, count, 8, signed, littleendian)
+
+    def read_array(self, addr, count, width, signed=False, littleendian=True):
+        '''
+        decode count integers of width bytes from a single span read,
+        None if [addr, addr+count*width) is not fully mapped
+        '''
+        addr = self.vaddr_pos if addr is None else addr
+        buf = bytearray(count * width)
+        if self.read_span_into(addr, buf, on_gap=GAP_TRUNCATE) != len(buf):
+            return None
+        self.vaddr_pos = addr + len(buf)
+        return util.unpack_array(buf, width, signed, littleendian)
+
     ######################## Read ctype structure operations
     def read_cstruct(self, cstruct_klass, addr=None):
         addr = self.vaddr_pos if addr is None else addr
         bm = self.get_map(addr)
         if bm is None:
             return None
+        size = ctypes.sizeof(cstruct_klass)
+        if addr + size > bm.get_end():
+            # the structure straddles the next memory map
+            buf = self.read_span(addr, size, on_gap=GAP_TRUNCATE)
+            if len(buf) != size:
+                return None
+            self.vaddr_pos = addr + size
+            return bm.struct_from_buffer(memoryview(buf), cstruct_klass)
         data = bm.read_cstruct(cstruct_klass, addr)
         self.vaddr_pos = bm.get_current_vaddr()
         return data
 
-
-    def dump(self, filename=None, dump_path=None, block_size=512):
-        # TODO dump all the files
-        pass
-        # if filename is None:
-        #     filename = os.path.join(self.name, '.bin')
-
-        # if dump_path is None:
-        #     dump_path = 'memory-dump-' + str(uuid.uuid4())
-
-        # if not os.path.exists(dump_path):
-        #     os.makedirs(path, exist_ok=True)
-
-        # f = open(os.path.join(dump_path, filename), 'wb')
-        # offset = 0
-        # while offset < self.size:
-        #     data = self.read(size, offset)
-        #     if data is None or len(data) == b'':
-        #         break
-        #     f.write(data)
-        #     offset += len(data)
-        # f.flush()
-        # f.close()
-        # return offset
\ No newline at end of file
+    def read_cstruct_array(self, cstruct_klass, addr, count):
+        '''
+        decode count contiguous structures from a single read
+        '''
+        return self.read_cstruct(cstruct_klass * count, addr)
+
+
+    def dump(self, filename=None, dump_path=None, block_size=DUMP_BLOCK_SIZE, regions=None):
+        '''
+        export every memory map (or the given ones) to dump_path and
+        write a json manifest of their metadata to dump_path/filename.
+        returns the manifest.
+        '''
+        if filename is None:
+            filename = 'manifest.json'
+
+        if dump_path is None:
+            dump_path = 'memory-dump-' + str(uuid.uuid4())
+
+        if not os.path.exists(dump_path):
+            os.makedirs(dump_path, exist_ok=True)
+
+        regions = list(self.region_index) if regions is None else regions
+        manifest = {'page_size': self.page_size, 'regions': []}
+        for bm in regions:
+            desc = bm.get_descriptor()
+            desc['filename'] = bm.get_dump_filename()
+            desc['bytes_written'] = bm.dump(desc['filename'], dump_path, block_size)
+            manifest['regions'].append(desc)
+            self.logger.debug("dump wrote memory map {} to {}".format(desc['name'], desc['filename']))
+
+        with open(os.path.join(dump_path, filename), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    ######################## asyncio read operations
+    def get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.async_workers,
+                                                    thread_name_prefix='ma_tk-read')
+            return self._executor
+
+    def close_executor(self, wait=True):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _pread(self, vaddr, size):
+        # read_at_vaddr without touching any read position, so it is
+        # safe to run from several threads at once
+        if self.get_map(vaddr) is None:
+            return None
+        return bytes(self.read_span(vaddr, size, on_gap=GAP_TRUNCATE))
+
+    def _pread_many(self, requests):
+        results = self.read_many(requests)
+        for idx, (vaddr, size) in enumerate(requests):
+            if results[idx] is None:
+                # partially mapped, read what there is like _pread
+                results[idx] = self._pread(vaddr, size)
+        return results
+
+    def _get_inflight(self, loop, vaddr, size):
+        return self._inflight.get((loop, vaddr, size), None)
+
+    def _track_inflight(self, loop, vaddr, size, fut):
+        key = (loop, vaddr, size)
+        self._inflight[key] = fut
+
+        def done(fut):
+            if self._inflight.get(key, None) is fut:
+                del self._inflight[key]
+        fut.add_done_callback(done)
+
+    async def aread(self, vaddr: int, size: int = 1):
+        '''
+        awaitable read_at_vaddr.  the read runs on the manager's bounded
+        executor and concurrent reads of the same (vaddr, size) share a
+        single read.
+        '''
+        loop = asyncio.get_running_loop()
+        fut = self._get_inflight(loop, vaddr, size)
+        if fut is None:
+            fut = loop.run_in_executor(self.get_executor(), self._pread, vaddr, size)
+            self._track_inflight(loop, vaddr, size, fut)
+        # one caller giving up does not cancel the read for the others
+        return await asyncio.shield(fut)
+
+    async def aread_many(self, requests):
+        '''
+        awaitable read_many, requests that are not already in flight
+        are read together in one coalesced batch.  returns the data for
+        each request, None for requests that are not fully mapped.
+        '''
+        loop = asyncio.get_running_loop()
+        futures = {}
+        missing = []
+        for vaddr, size in requests:
+            if (vaddr, size) in futures:
+                continue
+            fut = self._get_inflight(loop, vaddr, size)
+            if fut is None:
+                fut = loop.create_future()
+                self._track_inflight(loop, vaddr, size, fut)
+                missing.append((vaddr, size))
+            futures[(vaddr, size)] = fut
+
+        if missing:
+            batch = loop.run_in_executor(self.get_executor(), self._pread_many, missing)
+
+            def resolve(batch):
+                exc = None if batch.cancelled() else batch.exception()
+                for idx, request in enumerate(missing):
+                    fut = futures[request]
+                    if fut.done():
+                        continue
+                    if batch.cancelled():
+                        fut.cancel()
+                    elif exc is not None:
+                        fut.set_exception(exc)
+                    else:
+                        fut.set_result(batch.result()[idx])
+            batch.add_done_callback(resolve)
+
+        results = await asyncio.gather(*[asyncio.shield(futures[(vaddr, size)])
+                                         for vaddr, size in requests])
+        return [data if data is not None and len(data) == size else None
+                for data, (vaddr, size) in zip(results, requests)]
+
+    async def aread_qword(self, addr: int, littleendian: bool = True):
+        data = await self.aread(addr, 8)
+        if data is None or len(data) != 8:
+            return None
+        return int.from_bytes(data, 'little' if littleendian else 'big')
+
+    async def aread_cstruct(self, cstruct_klass, addr: int):
+        '''
+        awaitable read_cstruct, every caller gets its own structure
+        '''
+        size = ctypes.sizeof(cstruct_klass)
+        data = await self.aread(addr, size)
+        if data is None or len(data) != size:
+            return None
+        return cstruct_klass.from_buffer_copy(data)
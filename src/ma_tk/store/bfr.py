@@ -12,15 +12,18 @@ class BufferBacked(MemoryObject):
         self.bytes_data = bytes_data
         self.pos = 0
 
+    def get_source(self):
+        return 'bytes::'
+
     def _read (self, size=1, paddr=None):
         data = b''
         if paddr is None:
             paddr=self.pos
         
-        if self.size-self.pos < size:
-            size = self.size-self.pos
+        if self.size-paddr < size:
+            size = self.size-paddr
         data = self.bytes_data[paddr:paddr+size]
-        self.pos = self.pos+len(data)
+        self.pos = paddr+len(data)
         if self.pos > self.size:
             self.pos = self.size
         return data
@@ -29,7 +32,7 @@ class BufferBacked(MemoryObject):
         r = False
         if addr is not None and self.va_start <= addr and \
            addr < self.va_start + self.size:
-            self.pos = vaddr - self.va_start
+            self.pos = addr - self.va_start
             r = True
         elif offset is not None and self.pos + offset >= 0 and self.pos + offset < self.size:
             self.pos = offset + self.pos
@@ -38,4 +41,20 @@ class BufferBacked(MemoryObject):
            phy_addr < self.phy_start + self.size:
             self.pos = phy_addr - self.phy_start
             r = True
-        return r
\ No newline at end of file
+        return r
+
+    def read_buffer(self, offset, size):
+        end = min(offset + size, self.size, len(self.bytes_data))
+        if offset < 0 or end <= offset:
+            return memoryview(b'')
+        return memoryview(self.bytes_data)[offset:end]
+
+    def read_into(self, buf, offset):
+        if offset < 0:
+            return 0
+        end = min(offset + len(buf), self.size, len(self.bytes_data))
+        if end <= offset:
+            return 0
+        n = end - offset
+        buf[:n] = memoryview(self.bytes_data)[offset:end]
+        return n
\ No newline at end of file
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from threading import Lock
+
+from ..consts import BLOCK_CACHE_SIZE, BLOCK_CACHE_BLOCK_SIZE
+
+
+class BlockCache(object):
+    '''
+    LRU cache of fixed size blocks keyed by (source, block index).
+
+    blocks are loaded through a pread style loader(size, offset) callable, so the
+    same cache can sit in front of plain files, zip members or anything
+    else that does positional reads.  the cache holds at most
+    byte_budget bytes and is meant to be shared across every memory map
+    a Manager owns.
+    '''
+
+    def __init__(self, byte_budget: int = BLOCK_CACHE_SIZE,
+                 block_size: int = BLOCK_CACHE_BLOCK_SIZE):
+        self.byte_budget = byte_budget
+        self.block_size = block_size
+        self.blocks = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get_stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'blocks': len(self.blocks),
+                'bytes_used': self.bytes_used,
+                'byte_budget': self.byte_budget,
+                'block_size': self.block_size}
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.bytes_used = 0
+
+    def invalidate(self, source):
+        with self.lock:
+            for key in [k for k in self.blocks if k[0] == source]:
+                self.bytes_used -= len(self.blocks.pop(key))
+
+    def get_block(self, source, index, loader):
+        return self.get_item((source, index),
+                             lambda: loader(self.block_size, index * self.block_size))
+
+    def get_item(self, key, load):
+        '''
+        cached value for key, calling load() to produce it on a miss
+        '''
+        with self.lock:
+            block = self.blocks.get(key, None)
+            if block is not None:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+
+        # load outside of the lock so slow sources do not serialize readers
+        block = load()
+        with self.lock:
+            if key not in self.blocks:
+                self.blocks[key] = block
+                self.bytes_used += len(block)
+                self._evict()
+        return block
+
+    def _evict(self):
+        while self.bytes_used > self.byte_budget and len(self.blocks) > 0:
+            _, block = self.blocks.popitem(last=False)
+            self.bytes_used -= len(block)
+            self.evictions += 1
+
+    def read_into(self, source, buf, offset, loader):
+        '''
+        fill buf from the cached blocks starting at the absolute offset,
+        returns the number of bytes copied (short at the end of the source)
+        '''
+        view = memoryview(buf).cast('B')
+        size = len(view)
+        copied = 0
+        while copied < size:
+            index, start = divmod(offset + copied, self.block_size)
+            block = self.get_block(source, index, loader)
+            n = min(len(block) - start, size - copied)
+            if n <= 0:
+                break
+            view[copied:copied + n] = memoryview(block)[start:start + n]
+            copied += n
+        return copied
@@ -0,0 +1,167 @@
+import zlib
+import lzma
+import itertools
+
+from .memory import MemoryObject
+from .cache import BlockCache
+from ..consts import COMPRESSED_BLOCK_SIZE, COMPRESSED_HOT_BLOCKS
+
+
+# one canonical zero block per block size, shared by every map
+ZERO_BLOCKS = {}
+
+# distinguishes maps sharing a block cache
+_CACHE_IDS = itertools.count()
+
+def get_zero_block(block_size):
+    block = ZERO_BLOCKS.get(block_size, None)
+    if block is None:
+        block = ZERO_BLOCKS.setdefault(block_size, bytes(block_size))
+    return block
+
+
+def read_blocks_into(get_block, block_size, size, buf, offset):
+    '''
+    copy [offset, offset+len(buf)) of a block store of size bytes into
+    buf, get_block(index) returns the decoded block
+    '''
+    if offset < 0 or offset >= size:
+        return 0
+    view = memoryview(buf).cast('B')
+    want = min(len(view), size - offset)
+    copied = 0
+    while copied < want:
+        index, start = divmod(offset + copied, block_size)
+        block = get_block(index)
+        n = min(len(block) - start, want - copied)
+        if n <= 0:
+            break
+        view[copied:copied + n] = memoryview(block)[start:start + n]
+        copied += n
+    return copied
+
+
+class CompressedBacked(MemoryObject):
+
+    TRANSIENT_ATTRS = ('block_cache',)
+    CODECS = {
+        'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+        'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    }
+
+    def __init__(self, bytes_data, va_start: int, size: int = None,
+                 phy_start: int = 0, page_size: int = 4096,
+                 filename: str = None, flags: int = 0,
+                 block_size: int = COMPRESSED_BLOCK_SIZE, codec: str = 'zlib',
+                 level: int = 6, block_cache=None):
+
+        # the data is kept as independently compressed fixed size blocks,
+        # all-zero blocks are not stored and read back as one shared zero
+        # block.  decoded blocks are kept in a small hot block cache, the
+        # manager's shared cache when given.
+
+        size = len(bytes_data) if size is None else size
+        super().__init__(va_start, phy_start, size, page_size=page_size, flags=flags)
+        if codec not in self.CODECS:
+            raise Exception("Unknown codec: {}".format(codec))
+        self.va_end = self.va_start + size
+        self.filename = filename if filename else 'anonymous'
+        self.name = "{:016x}-{:016x}:compressed:{}".format(va_start, va_start + size, self.filename)
+        self.codec = codec
+        self.block_size = block_size
+        self.blocks = []
+        self.compressed_size = 0
+        self.pos = 0
+        self.set_block_cache(block_cache)
+        self._compress(bytes_data, level)
+
+    @classmethod
+    def from_memory_object(cls, bm, block_size: int = COMPRESSED_BLOCK_SIZE,
+                           codec: str = 'zlib', level: int = 6, block_cache=None):
+        '''
+        compressed copy of an existing memory map, read a block at a time
+        '''
+        reader = _MapReader(bm)
+        cbm = cls(reader, bm.va_start, bm.get_size(), phy_start=bm.phy_start,
+                  page_size=bm.page_size, filename=getattr(bm, 'filename', None),
+                  flags=bm.flags, block_size=block_size, codec=codec,
+                  level=level, block_cache=block_cache)
+        return cbm
+
+    def __setstate__(self, _dict):
+        super().__setstate__(_dict)
+        self.set_block_cache(None)
+
+    def set_block_cache(self, block_cache):
+        if block_cache is None:
+            block_cache = BlockCache(COMPRESSED_HOT_BLOCKS * self.block_size,
+                                     self.block_size)
+        self.block_cache = block_cache
+        self.cache_id = next(_CACHE_IDS)
+
+    def get_source(self):
+        return 'bytes::'
+
+    def _compress(self, data, level):
+        compress = self.CODECS[self.codec][0]
+        zero_block = get_zero_block(self.block_size)
+        view = memoryview(data) if not isinstance(data, _MapReader) else data
+        for offset in range(0, self.size, self.block_size):
+            block = view[offset:offset + min(self.block_size, self.size - offset)]
+            if block == zero_block[:len(block)]:
+                self.blocks.append(len(block))
+                continue
+            cdata = compress(block, level)
+            self.compressed_size += len(cdata)
+            self.blocks.append(cdata)
+
+    def get_compression_ratio(self):
+        return self.compressed_size / self.size if self.size else 0.0
+
+    def get_block(self, index):
+        cdata = self.blocks[index]
+        if isinstance(cdata, int):
+            # zero block, cdata is its length
+            zero_block = get_zero_block(self.block_size)
+            return zero_block if cdata == self.block_size else zero_block[:cdata]
+        return self.block_cache.get_item(('compressed', self.cache_id, index),
+                                         lambda: self.CODECS[self.codec][1](cdata))
+
+    def read_into(self, buf, offset):
+        return read_blocks_into(self.get_block, self.block_size, self.size, buf, offset)
+
+    def _read(self, size=1, paddr=None):
+        if paddr is None:
+            paddr = self.pos
+        buf = bytearray(max(0, min(size, self.size - paddr)))
+        n = self.read_into(buf, paddr)
+        self.pos = paddr + n
+        return bytes(memoryview(buf)[:n])
+
+    def _seek(self, addr=None, offset=None, phy_addr=None):
+        r = False
+        if addr is not None and self.va_start <= addr and \
+           addr < self.va_start + self.size:
+            self.pos = addr - self.va_start
+            r = True
+        elif offset is not None and self.pos + offset >= 0 and self.pos + offset < self.size:
+            self.pos = offset + self.pos
+            r = True
+        elif phy_addr is not None and self.phy_start <= phy_addr and \
+           phy_addr < self.phy_start + self.size:
+            self.pos = phy_addr - self.phy_start
+            r = True
+        return r
+
+
+class _MapReader(object):
+    # slicing adapter so a memory map can be compressed block by block
+
+    def __init__(self, bm):
+        self.bm = bm
+
+    def __getitem__(self, key):
+        # data the map could not provide is left as zeros
+        buf = bytearray(key.stop - key.start)
+        self.bm.read_into(buf, key.start)
+        return memoryview(buf)
@@ -0,0 +1,192 @@
+from bisect import bisect_right
+
+
+class RegionIndex(object):
+    '''
+    sorted interval index over non-overlapping memory maps.
+
+    regions are kept ordered by start address in parallel
+    start/end/map lists, so lookups are a single bisect and the
+    bookkeeping scales with the number of regions rather than
+    the number of pages they cover.  regions do not need to be
+    page aligned.
+    '''
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.maps = []
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __iter__(self):
+        return iter(self.maps)
+
+    def _slot(self, vaddr):
+        # index of the last region starting at or before vaddr
+        return bisect_right(self.starts, vaddr) - 1
+
+    def find_index(self, vaddr):
+        idx = self._slot(vaddr)
+        if idx >= 0 and vaddr < self.ends[idx]:
+            return idx
+        return None
+
+    def find(self, vaddr):
+        idx = self.find_index(vaddr)
+        return None if idx is None else self.maps[idx]
+
+    def overlaps(self, start, end):
+        '''
+        True if any indexed region intersects [start, end)
+        '''
+        if end <= start:
+            return False
+        idx = self._slot(end - 1)
+        return idx >= 0 and self.ends[idx] > start
+
+    def iter_overlapping(self, start, end):
+        '''
+        yield the regions intersecting [start, end) in address order
+        '''
+        if end <= start:
+            return
+        idx = max(self._slot(start), 0)
+        while idx < len(self.maps) and self.starts[idx] < end:
+            if self.ends[idx] > start:
+                yield self.maps[idx]
+            idx += 1
+
+    def add(self, bm):
+        start = bm.get_start()
+        end = bm.get_end()
+        if self.overlaps(start, end):
+            return False
+        idx = self._slot(start) + 1
+        self.starts.insert(idx, start)
+        self.ends.insert(idx, end)
+        self.maps.insert(idx, bm)
+        return True
+
+    def add_many(self, bms):
+        '''
+        add several maps with a single rebuild of the index, maps that
+        overlap an indexed region or an earlier map are returned
+        '''
+        added = []
+        rejected = []
+        for bm in sorted(bms, key=lambda b: b.get_start()):
+            start = bm.get_start()
+            if self.overlaps(start, bm.get_end()) or \
+               (added and added[-1].get_end() > start):
+                rejected.append(bm)
+                continue
+            added.append(bm)
+        if added:
+            # both lists are already sorted, so this is a merge
+            self.maps = sorted(self.maps + added, key=lambda b: b.get_start())
+            self.starts = [b.get_start() for b in self.maps]
+            self.ends = [b.get_end() for b in self.maps]
+        return rejected
+
+    def remove(self, bm):
+        idx = self.find_index(bm.get_start())
+        if idx is None or self.maps[idx] is not bm:
+            return False
+        del self.starts[idx]
+        del self.ends[idx]
+        del self.maps[idx]
+        return True
+
+
+class PageRange(object):
+    '''
+    compact stand in for a set of page addresses.
+
+    only the page aligned bounds of a region are stored.  membership
+    and intersection are O(1), and the pages themselves are only
+    produced when the range is iterated.
+    '''
+
+    def __init__(self, start, end, page_size=4096):
+        self.page_size = page_size
+        page_mask = ~(page_size - 1)
+        self.start = start & page_mask
+        # end is exclusive, round it up to the next page boundary
+        self.end = (end + page_size - 1) & page_mask if end > start else self.start
+
+    def __contains__(self, page):
+        return self.start <= page < self.end and \
+               (page - self.start) % self.page_size == 0
+
+    def __len__(self):
+        return (self.end - self.start) // self.page_size
+
+    def __bool__(self):
+        return self.end > self.start
+
+    def __iter__(self):
+        return iter(range(self.start, self.end, self.page_size))
+
+    def __and__(self, other):
+        start = max(self.start, other.start)
+        end = min(self.end, other.end)
+        return PageRange(start, max(start, end), self.page_size)
+
+    def __eq__(self, other):
+        if not isinstance(other, PageRange):
+            return NotImplemented
+        return (self.start, self.end, self.page_size) == \
+               (other.start, other.end, other.page_size)
+
+    def __repr__(self):
+        return "PageRange(0x{:x}, 0x{:x}, {})".format(self.start, self.end, self.page_size)
+
+    def intersects(self, other):
+        return self.start < other.end and other.start < self.end
+
+
+class RegionPages(object):
+    '''
+    re-iterable view of the pages of every region in a RegionIndex,
+    in address order and without duplicates where adjacent unaligned
+    regions share a page.  nothing is materialized, the view follows
+    later changes to the index.
+    '''
+
+    def __init__(self, region_index, page_size=4096):
+        self.region_index = region_index
+        self.page_size = page_size
+
+    def _ranges(self):
+        return (bm.get_page_cache() for bm in self.region_index)
+
+    def __iter__(self):
+        last = None
+        for pages in self._ranges():
+            for page in pages:
+                if last is not None and page <= last:
+                    continue
+                last = page
+                yield page
+
+    def __len__(self):
+        count = 0
+        last_end = None
+        for pages in self._ranges():
+            start = pages.start if last_end is None else max(pages.start, last_end)
+            if pages.end > start:
+                count += (pages.end - start) // pages.page_size
+                last_end = pages.end
+        return count
+
+    def __bool__(self):
+        return any(self._ranges())
+
+    def __contains__(self, page):
+        return any(page in bm.get_page_cache()
+                   for bm in self.region_index.iter_overlapping(page, page + self.page_size))
+
+    def __repr__(self):
+        return "RegionPages({} regions)".format(len(self.region_index))
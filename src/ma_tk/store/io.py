@@ -1,26 +1,28 @@
 from .memory import MemoryObject
-from threading import RLock
 import os
 
 
 class IOBacked(MemoryObject):
 
+    TRANSIENT_ATTRS = ('block_cache',)
+
     def __init__(self, io_obj, va_start: int, size: int, 
                  phy_start: int = 0, page_size: int = 4096, 
-                 filename: str = None, flags: int = 0):
+                 filename: str = None, flags: int = 0,
+                 file_offset: int = None, block_cache=None):
 
-        # NOTES file seeking
-        # os.SEEK_CUR seek from current location
-        # os.SEEK_SET seek from the beginning of file abs(pos)
-        # os.SEEK_END seek from the end of the file
+        # reads are positional (os.pread on the underlying descriptor)
+        # relative to the file offset the memory map starts at, so the
+        # shared file position is never touched and one FileObj can
+        # serve many concurrent readers.  self.pos is only the logical
+        # position of this memory map.  when a BlockCache is given, reads
+        # of on disk sources go through it.
 
         # FIXME couple of ambiguities here
         # 1) Mapping File to a Virtual Addr space that is larger than the file
         # size
         # 2) Starting the physical address at an offset in the file can result
         # in a file size that is less than the VA space 
-        # 3) if the position in file falls out of sync with the physical address
-        # reading the space will happen incorrectly
 
         # note io_obj is a ma_tk.file.FileObj
 
@@ -29,45 +31,75 @@ class IOBacked(MemoryObject):
         self.filename = filename if filename else 'anonymous'
         self.name = "{:016x}-{:016x}:file:{}".format(va_start, va_start + size, self.filename)   
         self.io_obj = io_obj
-        self._abs_start = self.io_obj.get_fd().tell() 
-        self.pos = self.io_obj.get_fd().tell()
-        self.io_lock = RLock()
-    
+        self._abs_start = self.io_obj.get_fd().tell() if file_offset is None else file_offset
+        self.pos = 0
+        self.block_cache = None
+        self.set_block_cache(block_cache)
+
+    def __setstate__(self, _dict):
+        super().__setstate__(_dict)
+        self.block_cache = None
+
+    def set_block_cache(self, block_cache):
+        source = self.io_obj.get_source()
+        if block_cache is not None and not self.io_obj.inmemory and \
+           source is not None and not source.startswith('bytes::'):
+            self.block_cache = block_cache
+            self.cache_key = source
+
+    def get_source(self):
+        return self.io_obj.get_source()
+
+    def get_file_extent(self):
+        with self.io_obj.lease_fileno() as fileno:
+            if fileno is None:
+                return None
+            length = max(0, min(self.size, os.fstat(fileno).st_size - self._abs_start))
+        return self.io_obj, self._abs_start, length
+
     def _read(self, size, pos=None):
-        # TODO try except finally needed here
-        data = b''
-        # self.io_lock.acquire()
         pos = self.pos if pos is None else pos
-        if pos != self.pos:
-            self._seek(phy_addr=pos)
-        try:
-            data = self.io_obj.get_fd().read(size)
-            self.pos = pos+len(data)
-        except:
-            raise
-        # finally:
-        #     self.io_lock.release()
+        if pos < 0 or pos >= self.size:
+            return b''
+        size = min(size, self.size - pos)
+        if self.use_cache(size):
+            buf = bytearray(size)
+            n = self.block_cache.read_into(self.cache_key, buf,
+                                           self._abs_start + pos,
+                                           self.io_obj.pread)
+            data = bytes(memoryview(buf)[:n])
+        else:
+            data = self.io_obj.pread(size, self._abs_start + pos)
+        self.pos = pos + len(data)
         return data
 
+    def read_into(self, buf, offset):
+        if offset < 0 or offset >= self.size:
+            return 0
+        size = min(len(buf), self.size - offset)
+        view = memoryview(buf)[:size]
+        if self.use_cache(size):
+            return self.block_cache.read_into(self.cache_key, view,
+                                              self._abs_start + offset,
+                                              self.io_obj.pread)
+        return self.io_obj.preadinto(view, self._abs_start + offset)
+
+    def use_cache(self, size):
+        # large streaming reads bypass the cache rather than flush it
+        return self.block_cache is not None and \
+               size <= self.block_cache.byte_budget // 4
+
     def _seek(self, addr=None, offset=None, phy_addr=None):
         r = False
-        diff = None
-        if offset is not None:
-            if self._abs_start + offset < self._abs_start + self.size:
-                self.io_obj.get_fd().seek(offset, os.SEEK_CUR)
-                self.pos = self.io_obj.tell()
-                r = True
-        elif vaddr is not None and \
-           self.va_start <= vaddr and \
-           vaddr < self.va_start + self.size:
-            diff = vaddr - self.va_start
-            self.io_obj.get_fd().seek(diff)
-            self.pos = self.io_obj.get_fd().tell()
+        if addr is not None and self.va_start <= addr and \
+           addr < self.va_start + self.size:
+            self.pos = addr - self.va_start
+            r = True
+        elif offset is not None and self.pos + offset >= 0 and self.pos + offset < self.size:
+            self.pos = offset + self.pos
             r = True
         elif phy_addr is not None and self.phy_start <= phy_addr and \
            phy_addr < self.phy_start + self.size:
-            diff = phy_addr - self.phy_start
-            self.io_obj.get_fd().seek(diff)
-            self.pos = self.io_obj.get_fd().tell()
+            self.pos = phy_addr - self.phy_start
             r = True
-        return r    
\ No newline at end of file
+        return r
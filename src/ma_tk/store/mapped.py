@@ -0,0 +1,105 @@
+from .memory import MemoryObject
+import mmap
+
+
+class MmapBacked(MemoryObject):
+
+    TRANSIENT_ATTRS = ('mm', 'view')
+
+    def __init__(self, io_obj, va_start: int, size: int,
+                 phy_start: int = 0, page_size: int = 4096,
+                 filename: str = None, flags: int = 0,
+                 mm=None, file_offset: int = None):
+
+        # the file is mapped once and reads are served as slices of the
+        # mapping, so the OS page cache does the work and no read
+        # syscalls are made.  a mapping can be shared between several
+        # memory maps backed by the same file by passing it in as mm.
+
+        # note io_obj is a ma_tk.file.FileObj
+
+        super().__init__(va_start, phy_start, size, page_size, flags)
+        self.va_end = va_start + size
+        self.filename = filename if filename else 'anonymous'
+        self.name = "{:016x}-{:016x}:mmap:{}".format(va_start, va_start + size, self.filename)
+        self.io_obj = io_obj
+        if mm is None:
+            mm = self.map_file(io_obj)
+        self.mm = mm
+        self.view = memoryview(mm)
+        self._abs_start = io_obj.get_fd().tell() if file_offset is None else file_offset
+        # bytes of the file actually available to this memory map
+        self._data_end = max(0, min(self.size, len(self.mm) - self._abs_start))
+        self.pos = 0
+
+    def __getattr__(self, name):
+        # the mapping is not pickled, map the file again on first use
+        if name in self.TRANSIENT_ATTRS and 'io_obj' in self.__dict__:
+            self.set_mmap(self.map_file(self.io_obj))
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def set_mmap(self, mm):
+        # share a mapping of the same source made elsewhere
+        self.mm = mm
+        self.view = memoryview(mm)
+
+    def get_source(self):
+        return self.io_obj.get_source()
+
+    def get_file_extent(self):
+        return self.io_obj, self._abs_start, self._data_end
+
+    @classmethod
+    def map_file(cls, io_obj):
+        # read only, the mapping is shared by every memory map of the
+        # source so structures read from it are always copies
+        # the mapping keeps its own reference to the file, the
+        # descriptor only has to stay open while mapping
+        with io_obj.lease_fileno() as fileno:
+            if fileno is None:
+                raise ValueError("{} has no descriptor to map".format(io_obj.get_source()))
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    def _read(self, size=1, paddr=None):
+        if paddr is None:
+            paddr = self.pos
+        if paddr < 0 or paddr >= self._data_end:
+            return b''
+        end = min(paddr + size, self._data_end)
+        data = self.mm[self._abs_start + paddr:self._abs_start + end]
+        self.pos = end
+        return data
+
+    def read_view(self, offset, size):
+        '''
+        zero-copy memoryview over the mapping
+        '''
+        if offset < 0 or offset >= self._data_end:
+            return self.view[0:0]
+        end = min(offset + size, self._data_end)
+        return self.view[self._abs_start + offset:self._abs_start + end]
+
+    def read_buffer(self, offset, size):
+        return self.read_view(offset, size)
+
+    def read_into(self, buf, offset):
+        data = self.read_view(offset, len(buf))
+        n = len(data)
+        buf[:n] = data
+        return n
+
+    def _seek(self, addr=None, offset=None, phy_addr=None):
+        r = False
+        if addr is not None and self.va_start <= addr and \
+           addr < self.va_start + self.size:
+            self.pos = addr - self.va_start
+            r = True
+        elif offset is not None and self.pos + offset >= 0 and self.pos + offset < self.size:
+            self.pos = offset + self.pos
+            r = True
+        elif phy_addr is not None and self.phy_start <= phy_addr and \
+           phy_addr < self.phy_start + self.size:
+            self.pos = phy_addr - self.phy_start
+            r = True
+        return r
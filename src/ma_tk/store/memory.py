@@ -1,5 +1,6 @@
 import os
 import uuid
+import errno
 import ctypes
 import struct
 import copy
@@ -7,9 +8,13 @@ import copy
 from .. consts import *
 
 from .. import util as util
+from .index import PageRange
 
 class MemoryObject(object):
 
+    # attributes that are rebuilt on the receiving side instead of pickled
+    TRANSIENT_ATTRS = ()
+
     def __init__(self, va_start: int, phy_start: int, size: int, 
                  page_size: int=4096, flags: int = 0):
         self.size = size
@@ -18,10 +23,9 @@ class MemoryObject(object):
 
         self.page_size = page_size
         self.page_mask = util.get_page_mask(page_size)
-        self.page_cache = {i & self.page_mask for i in range(self.va_start, 
-                                            self.va_start + self.size, 
-                                            self.page_size)}
-        
+        self.page_cache = PageRange(self.va_start, self.va_start + self.size,
+                                    self.page_size)
+
         self.name = "{:016x}-{:016x}:anonymous".format(va_start,va_start+size)
         self.flags = flags
 
@@ -103,6 +107,13 @@ class MemoryObject(object):
     def get_size(self):
         return self.size
 
+    def get_data_ranges(self):
+        '''
+        (offset, size) ranges that may hold non-zero bytes, the rest
+        of the map reads as zeros
+        '''
+        return [(0, self.size)] if self.size > 0 else []
+
     def vaddr_in_range (self, vaddr):
         return self.has(vaddr)
 
@@ -115,8 +126,24 @@ class MemoryObject(object):
         return True
 
     def __getstate__(self):
-        odict = copy.deepcopy(self.__dict__)
-        return odict
+        # shallow, the backing data is described by its source and
+        # reopened lazily rather than copied
+        return {k: v for k, v in self.__dict__.items()
+                if k not in self.TRANSIENT_ATTRS}
+
+    def get_source(self):
+        return None
+
+    def get_descriptor(self):
+        return {'type': type(self).__name__,
+                'name': self.name,
+                'source': self.get_source(),
+                'file_offset': getattr(self, '_abs_start', None),
+                'va_start': self.va_start,
+                'phy_start': self.phy_start,
+                'size': self.size,
+                'page_size': self.page_size,
+                'flags': self.flags}
 
     def __str__ (self):
         #return "filename: %s start: 0x%08x end: 0x%08x"%(self.filename, self.start, self.end)
@@ -152,6 +179,23 @@ class MemoryObject(object):
             return None
         return self.read(size, offset)
 
+    def read_into(self, buf, offset):
+        '''
+        fill buf with data starting at offset without moving the
+        current position, returns the number of bytes copied
+        '''
+        if offset < 0 or offset >= self.size:
+            return 0
+        pos = self.pos
+        size = min(len(buf), self.size - offset)
+        data = self._read(size, offset)
+        self._seek(phy_addr=self.phy_start + pos)
+        self.pos = pos
+        if data is None:
+            return 0
+        buf[:len(data)] = data
+        return len(data)
+
     def seek(self, addr=None, offset=None, phy_addr=None):
         return self._seek(addr=addr, offset=offset, phy_addr=phy_addr)
 
@@ -255,6 +299,28 @@ class MemoryObject(object):
         else:
             return struct.unpack("{}{}".format(endian, fmt), result)[0]
 
+    ######################## Bulk typed read operations
+    def read_words(self, addr, count, signed=False, littleendian=True):
+        return self.read_array_at_vaddr(addr, count, 2, signed, littleendian)
+
+    def read_dwords(self, addr, count, signed=False, littleendian=True):
+        return self.read_array_at_vaddr(addr, count, 4, signed, littleendian)
+
+    def read_qwords(self, addr, count, signed=False, littleendian=True):
+        return self.read_array_at_vaddr(addr, count, 8, signed, littleendian)
+
+    def read_array_at_vaddr(self, addr, count, width, signed=False, littleendian=True):
+        offset = self.translate_vaddr_to_offset(addr)
+        if offset is None:
+            return None
+        return self.read_array_at_offset(offset, count, width, signed, littleendian)
+
+    def read_array_at_offset(self, offset, count, width, signed=False, littleendian=True):
+        buf = bytearray(count * width)
+        if self.read_into(buf, offset) != len(buf):
+            return None
+        return util.unpack_array(buf, width, signed, littleendian)
+
     ######################## Read ctype structure operations
     def read_cstruct(self, cstruct, addr=None, offset=None):
         if not addr is None:
@@ -264,61 +330,209 @@ class MemoryObject(object):
         else:
             return self.read_cstruct_at_offset(self.pos, cstruct)
 
-    def read_cstruct_klass_at_vaddr(self, addr, cstruct_klass):
+    def read_cstruct_at_vaddr(self, addr, cstruct_klass):
         offset = self.translate_vaddr_to_offset(addr)
         if offset is None:
             return None
         return self.read_cstruct_at_offset(offset, cstruct_klass)
 
-    def read_cstruct_at_offset(self, offset, cstruct, to_json=False):
+    read_cstruct_klass_at_vaddr = read_cstruct_at_vaddr
+
+    def read_cstruct_at_offset(self, offset, cstruct_klass):
         size = ctypes.sizeof(cstruct_klass)
-        if not self.check_offset(offset) and \
-           not self.check_offset(offset + size):
+        buf = self.read_buffer(offset, size)
+        if len(buf) != size:
             return None
-        result = self.read(size, offset)
-        return self.bytes_to_struct(result, cstruct_klass)
+        self.pos = offset + size
+        return self.struct_from_buffer(buf, cstruct_klass)
 
-    @classmethod
-    def bytes_to_struct(cls, data, cstruct_klass):
-        tmp = ctypes.cast(data, ctypes.POINTER(cstruct_klass)).contents
-        # there is an odd bug, but the data gets corrupted if we
-        # return directly after the cast, so we create a deep copy
-        # and return that value
-        # Note if there are any pointers in the struct it will fail
-        # https://stackoverflow.com/questions/1470343/python-ctypes-copying-structures-contents
-        dst = copy.deepcopy(tmp)
-        return dst
+    def read_cstruct_array(self, cstruct_klass, addr, count):
+        offset = self.translate_vaddr_to_offset(addr)
+        if offset is None:
+            return None
+        return self.read_cstruct_at_offset(offset, cstruct_klass * count)
+
+    def read_buffer(self, offset, size):
+        '''
+        buffer holding size bytes at offset.  stores that keep their
+        data addressable return a view without copying, otherwise
+        the data is read into a new bytearray.
+        '''
+        buf = bytearray(size)
+        n = self.read_into(buf, offset)
+        return memoryview(buf)[:n]
 
     @classmethod
-    def json_serialize_struct(strct):
-        r = {}
-        for f, ct in strct._fields_:
-            v = getattr(strct, f)
-            if isinstance(v, (ctypes.Structure, ctypes.Union)):
-                r[f] = json_serialize_struct(v)
-            else:
-                r[f] = v
-        return r
+    def struct_from_buffer(cls, buf, cstruct_klass):
+        # writable buffers are wrapped in place, read-only ones (like
+        # the shared file mappings) get exactly one copy.  the resulting
+        # struct keeps buf alive.
+        if isinstance(buf, memoryview) and not buf.readonly:
+            return cstruct_klass.from_buffer(buf)
+        return cstruct_klass.from_buffer_copy(buf)
 
-    def dump(self, filename=None, dump_path=None, block_size=512):
+    @classmethod
+    def bytes_to_struct(cls, data, cstruct_klass):
+        return util.bytes_to_struct(data, cstruct_klass)
 
+    @staticmethod
+    def json_serialize_struct(strct):
+        return util.json_serialize_struct(strct)
+
+    def get_file_extent(self):
+        '''
+        (FileObj, file offset, length) of the on disk bytes backing this
+        memory map, None when the data does not live in a plain file
+        '''
+        return None
+
+    def get_dump_filename(self):
+        return "{:016x}-{:016x}.bin".format(self.va_start, self.va_start + self.size)
+
+    def dump(self, filename=None, dump_path=None, block_size=DUMP_BLOCK_SIZE):
+        '''
+        write the memory map to dump_path/filename and return the number
+        of bytes actually written, holes and data the backing store is
+        short of are not counted.  file backed maps are copied by the
+        kernel, everything else is streamed in block_size reads with
+        all-zero pages left as holes.
+        '''
         if filename is None:
-            filename = os.path.join(self.name, '.bin')
+            filename = self.get_dump_filename()
 
         if dump_path is None:
             dump_path = 'memory-dump-' + str(uuid.uuid4())
 
         if not os.path.exists(dump_path):
-            os.makedirs(path, exist_ok=True)
-
-        f = open(os.path.join(dump_path, filename), 'wb')
+            os.makedirs(dump_path, exist_ok=True)
+
+        with open(os.path.join(dump_path, filename), 'wb') as f:
+            written = self.write_to(f, block_size)
+            # anything the backing data did not cover reads as zeros
+            f.truncate(self.size)
+        return written
+
+    def write_to(self, f, block_size=DUMP_BLOCK_SIZE):
+        '''
+        write the memory map at the current position of the binary file f,
+        zero pages may be left as holes.  the position is left just past
+        the last byte written.  returns the number of bytes written.
+        '''
+        extent = self.get_file_extent()
+        if extent is not None:
+            io_obj, offset, length = extent
+            with io_obj.lease_fileno() as fileno:
+                copied = None
+                if fileno is not None:
+                    copied = self._dump_file_extent(f, fileno, offset, length, block_size)
+                if copied is not None:
+                    return copied
+        return self._dump_blocks(f, block_size)
+
+    def _iter_file_runs(self, fileno, offset, length, block_size):
+        '''
+        yield (start, end) runs of [0, length) of the file at offset
+        that hold non-zero pages.  holes of a sparse file are skipped
+        with SEEK_DATA/SEEK_HOLE, the data between them is scanned a
+        block at a time for zero pages.
+        '''
+        page_size = self.page_size
+        block_size = max(page_size, block_size - block_size % page_size)
+        zero_page = bytes(page_size)
+        seek_data = hasattr(os, 'SEEK_DATA')
+        run_start = None
+        pos = 0
+        while pos < length:
+            end = length
+            if seek_data:
+                try:
+                    data = os.lseek(fileno, offset + pos, os.SEEK_DATA) - offset
+                    end = min(length, os.lseek(fileno, offset + data, os.SEEK_HOLE) - offset)
+                except OSError as e:
+                    if e.errno == errno.ENXIO:
+                        # nothing but a hole up to the end of the file
+                        break
+                    # not supported here, scan everything
+                    seek_data = False
+                    data = pos
+                # keep to the map's pages
+                data = max(pos, data - data % page_size)
+                if data > pos and run_start is not None:
+                    yield run_start, pos
+                    run_start = None
+                pos = data
+            while pos < end:
+                buf = os.pread(fileno, min(block_size, end - pos), offset + pos)
+                if len(buf) == 0:
+                    end = length = pos
+                    break
+                for p in range(0, len(buf), page_size):
+                    page = buf[p:p + page_size]
+                    if page != zero_page[:len(page)]:
+                        if run_start is None:
+                            run_start = pos + p
+                    elif run_start is not None:
+                        yield run_start, pos + p
+                        run_start = None
+                pos += len(buf)
+        if run_start is not None:
+            yield run_start, pos
+
+    def _dump_file_extent(self, f, fileno, offset, length, block_size=DUMP_BLOCK_SIZE):
+        # only the non-zero runs are copied by the kernel, zero pages
+        # and holes of the source are left as holes
+        f.flush()
+        out_fd = f.fileno()
+        start = f.tell()
+        copied = 0
+        last = 0
+        try:
+            for run_start, run_end in self._iter_file_runs(fileno, offset, length, block_size):
+                pos = run_start
+                while pos < run_end:
+                    if hasattr(os, 'copy_file_range'):
+                        n = os.copy_file_range(fileno, out_fd, run_end - pos,
+                                               offset + pos, start + pos)
+                    else:
+                        os.lseek(out_fd, start + pos, os.SEEK_SET)
+                        n = os.sendfile(out_fd, fileno, offset + pos, run_end - pos)
+                    if n == 0:
+                        break
+                    copied += n
+                    pos += n
+                last = pos
+        except OSError:
+            if copied > 0:
+                raise
+            # kernel copies are not supported between these files
+            return None
+        f.seek(start + last, os.SEEK_SET)
+        return copied
+
+    def _dump_blocks(self, f, block_size):
+        page_size = self.page_size
+        block_size = max(page_size, block_size - block_size % page_size)
+        zero_page = bytes(page_size)
+        buf = bytearray(block_size)
+        view = memoryview(buf)
         offset = 0
+        written = 0
         while offset < self.size:
-            data = self.read(size, offset)
-            if data is None or len(data) == b'':
+            n = self.read_into(view[:min(block_size, self.size - offset)], offset)
+            if n == 0:
                 break
-            f.write(data)
-            offset += len(data)
-        f.flush()
-        f.close()
-        return offset
+            # write runs of non-zero pages, seek over zero pages
+            run_start = None
+            for p in range(0, n, page_size):
+                page = view[p:min(p + page_size, n)]
+                if page == zero_page[:len(page)]:
+                    if run_start is not None:
+                        written += f.write(view[run_start:p])
+                        run_start = None
+                    f.seek(len(page), os.SEEK_CUR)
+                elif run_start is None:
+                    run_start = p
+            if run_start is not None:
+                written += f.write(view[run_start:n])
+            offset += n
+        return written
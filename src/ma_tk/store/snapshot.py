@@ -0,0 +1,201 @@
+import os
+import zlib
+import struct
+
+from .mapped import MmapBacked
+from .compressed import read_blocks_into
+from ..consts import DUMP_BLOCK_SIZE
+
+
+class SnapshotBacked(MmapBacked):
+
+    TRANSIENT_ATTRS = ('mm', 'view', 'block_cache')
+
+    def __init__(self, io_obj, va_start: int, size: int,
+                 phy_start: int = 0, page_size: int = 4096,
+                 filename: str = None, flags: int = 0,
+                 mm=None, index_offset: int = 0,
+                 block_size: int = DUMP_BLOCK_SIZE, block_cache=None):
+
+        # compressed snapshot region.  the data is a run of independently
+        # zlib compressed blocks located through a block index stored in
+        # the snapshot, blocks are inflated on demand and kept in the
+        # manager's block cache.
+
+        super().__init__(io_obj, va_start, size, phy_start=phy_start,
+                         page_size=page_size, filename=filename, flags=flags,
+                         mm=mm, file_offset=0)
+        self.index_offset = index_offset
+        self.block_size = block_size
+        self.block_cache = block_cache
+        self._data_end = size
+
+    def __setstate__(self, _dict):
+        super().__setstate__(_dict)
+        self.block_cache = None
+
+    def set_block_cache(self, block_cache):
+        self.block_cache = block_cache
+
+    def get_file_extent(self):
+        return None
+
+    def _load_block(self, index):
+        offset, clen, rlen = Snapshot.INDEX_ENTRY.unpack_from(
+            self.mm, self.index_offset + index * Snapshot.INDEX_ENTRY.size)
+        if clen == 0:
+            # zero blocks are not stored
+            return bytes(rlen)
+        return zlib.decompress(self.mm[offset:offset + clen])
+
+    def get_block(self, index):
+        if self.block_cache is None:
+            return self._load_block(index)
+        return self.block_cache.get_item((self.get_source(), self.index_offset, index),
+                                         lambda: self._load_block(index))
+
+    def read_into(self, buf, offset):
+        return read_blocks_into(self.get_block, self.block_size, self.size, buf, offset)
+
+    def read_view(self, offset, size):
+        buf = bytearray(max(0, min(size, self.size - offset)))
+        n = self.read_into(buf, offset)
+        return memoryview(buf)[:n]
+
+    def _read(self, size=1, paddr=None):
+        if paddr is None:
+            paddr = self.pos
+        data = bytes(self.read_view(paddr, size))
+        self.pos = paddr + len(data)
+        return data
+
+
+class Snapshot(object):
+    '''
+    single file snapshot of a manager's memory maps.
+
+    layout:
+        header      magic, version, flags, page size, block size,
+                    region count and the offset of the region table
+        data        every region's bytes starting on a page boundary,
+                    or for compressed snapshots, its zlib blocks
+        indexes     per region (offset, compressed length, length)
+                    entries, compressed snapshots only
+        table       one entry per region, (vaddr, paddr, size,
+                    data offset, index offset, flags, page size,
+                    name length) followed by the utf-8 name
+
+    opening a snapshot maps the file and registers each region over
+    the mapping, only the header and the region table are read.
+    '''
+
+    MAGIC = b'MATKSNAP'
+    VERSION = 1
+    FLAG_COMPRESSED = 1
+    HEADER = struct.Struct('<8sIIQQQQ')
+    ENTRY = struct.Struct('<QQQQQIIH')
+    INDEX_ENTRY = struct.Struct('<QII')
+
+    @classmethod
+    def save(cls, manager, path, compress=False, block_size=DUMP_BLOCK_SIZE,
+             regions=None, level=6):
+        regions = list(manager.region_index) if regions is None else regions
+        page_size = manager.page_size
+        align = lambda v: (v + page_size - 1) & ~(page_size - 1)
+        entries = []
+        with open(path, 'wb') as f:
+            f.write(bytes(cls.HEADER.size))
+            for bm in regions:
+                data_offset = align(f.tell())
+                f.seek(data_offset, os.SEEK_SET)
+                if compress:
+                    index = cls._write_blocks(f, bm, block_size, level)
+                else:
+                    index = None
+                    bm.write_to(f, block_size)
+                    # trailing zeros of the region are left as a hole
+                    f.seek(data_offset + bm.get_size(), os.SEEK_SET)
+                entries.append((bm, data_offset, index))
+
+            # block indexes for compressed regions
+            index_offsets = []
+            for bm, data_offset, index in entries:
+                index_offsets.append(f.tell() if index else 0)
+                for entry in index or []:
+                    f.write(cls.INDEX_ENTRY.pack(*entry))
+
+            table_offset = f.tell()
+            for (bm, data_offset, index), index_offset in zip(entries, index_offsets):
+                name = bm.get_name().encode('utf-8')
+                f.write(cls.ENTRY.pack(bm.get_start(), bm.phy_start, bm.get_size(),
+                                       data_offset, index_offset, bm.flags,
+                                       bm.page_size, len(name)))
+                f.write(name)
+            f.truncate(f.tell())
+
+            f.seek(0, os.SEEK_SET)
+            flags = cls.FLAG_COMPRESSED if compress else 0
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, flags, page_size,
+                                    block_size, len(entries), table_offset))
+        return len(entries)
+
+    @classmethod
+    def _write_blocks(cls, f, bm, block_size, level):
+        index = []
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        zero_block = bytes(block_size)
+        for offset in range(0, bm.get_size(), block_size):
+            rlen = min(block_size, bm.get_size() - offset)
+            n = bm.read_into(view[:rlen], offset)
+            # data the map could not provide reads as zeros
+            view[n:rlen] = zero_block[:rlen - n]
+            if view[:rlen] == zero_block[:rlen]:
+                index.append((0, 0, rlen))
+                continue
+            data = zlib.compress(view[:rlen], level)
+            index.append((f.tell(), len(data), rlen))
+            f.write(data)
+        return index
+
+    @classmethod
+    def load(cls, manager, path):
+        '''
+        register the regions of the snapshot at path with manager and
+        return the number of regions added
+        '''
+        from ..load.file import OpenFile
+        io_obj = OpenFile.from_file(path)
+        if io_obj is None:
+            raise Exception("Unable to open snapshot {}".format(path))
+        mm = manager.get_mmap(io_obj)
+        if mm is None:
+            raise Exception("Unable to map snapshot {}".format(path))
+
+        magic, version, flags, page_size, block_size, count, table_offset = \
+            cls.HEADER.unpack_from(mm, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise Exception("{} is not a snapshot".format(path))
+
+        added = 0
+        pos = table_offset
+        for _ in range(count):
+            vaddr, paddr, size, data_offset, index_offset, rflags, rpage_size, name_len = \
+                cls.ENTRY.unpack_from(mm, pos)
+            pos += cls.ENTRY.size
+            name = bytes(mm[pos:pos + name_len]).decode('utf-8')
+            pos += name_len
+            if flags & cls.FLAG_COMPRESSED:
+                bm = SnapshotBacked(io_obj, vaddr, size, phy_start=paddr,
+                                    page_size=rpage_size, filename=path,
+                                    flags=rflags, mm=mm, index_offset=index_offset,
+                                    block_size=block_size,
+                                    block_cache=manager.block_cache)
+            else:
+                bm = MmapBacked(io_obj, vaddr, size, phy_start=paddr,
+                                page_size=rpage_size, filename=path,
+                                flags=rflags, mm=mm, file_offset=data_offset)
+            bm.name = name
+            if manager.add_map_to_kb(bm):
+                added += 1
+        return added
@@ -0,0 +1,154 @@
+import os
+from bisect import bisect_right
+
+from .memory import MemoryObject
+from .compressed import get_zero_block
+from ..consts import DUMP_BLOCK_SIZE
+
+# largest zero block handed out or copied from at once
+ZERO_FILL_SIZE = 64 * 1024
+
+
+def fill_zeros(view):
+    zero_block = get_zero_block(ZERO_FILL_SIZE)
+    for pos in range(0, len(view), ZERO_FILL_SIZE):
+        n = min(ZERO_FILL_SIZE, len(view) - pos)
+        view[pos:pos + n] = zero_block[:n]
+
+
+class _PositionMixin(object):
+
+    def _read(self, size=1, paddr=None):
+        if paddr is None:
+            paddr = self.pos
+        buf = bytearray(max(0, min(size, self.size - paddr)))
+        n = self.read_into(buf, paddr)
+        self.pos = paddr + n
+        return bytes(memoryview(buf)[:n])
+
+    def _seek(self, addr=None, offset=None, phy_addr=None):
+        r = False
+        if addr is not None and self.va_start <= addr and \
+           addr < self.va_start + self.size:
+            self.pos = addr - self.va_start
+            r = True
+        elif offset is not None and self.pos + offset >= 0 and self.pos + offset < self.size:
+            self.pos = offset + self.pos
+            r = True
+        elif phy_addr is not None and self.phy_start <= phy_addr and \
+           phy_addr < self.phy_start + self.size:
+            self.pos = phy_addr - self.phy_start
+            r = True
+        return r
+
+
+class ZeroBacked(_PositionMixin, MemoryObject):
+
+    def __init__(self, va_start: int, size: int,
+                 phy_start: int = 0, page_size: int = 4096,
+                 filename: str = None, flags: int = 0):
+
+        # reads as zeros without any backing memory, so mapping it costs
+        # the same regardless of its size
+
+        super().__init__(va_start, phy_start, size, page_size=page_size, flags=flags)
+        self.va_end = self.va_start + size
+        self.filename = filename if filename else 'anonymous'
+        self.name = "{:016x}-{:016x}:zero:{}".format(va_start, va_start + size, self.filename)
+        self.pos = 0
+
+    def read_into(self, buf, offset):
+        if offset < 0 or offset >= self.size:
+            return 0
+        view = memoryview(buf).cast('B')
+        n = min(len(view), self.size - offset)
+        fill_zeros(view[:n])
+        return n
+
+    def read_buffer(self, offset, size):
+        n = max(0, min(size, self.size - offset))
+        if n <= ZERO_FILL_SIZE:
+            return memoryview(get_zero_block(ZERO_FILL_SIZE))[:n]
+        return super().read_buffer(offset, size)
+
+    def get_data_ranges(self):
+        return []
+
+    def write_to(self, f, block_size=DUMP_BLOCK_SIZE):
+        # nothing but a hole
+        f.seek(self.size, os.SEEK_CUR)
+        return 0
+
+
+class SparseBacked(_PositionMixin, MemoryObject):
+
+    def __init__(self, extents, va_start: int, size: int,
+                 phy_start: int = 0, page_size: int = 4096,
+                 filename: str = None, flags: int = 0):
+
+        # extents is a list of (offset, memory map) pairs placing other
+        # memory maps inside this one, every byte not covered by an
+        # extent reads as zero.  a core segment whose memory size exceeds
+        # its file size is [(0, file backed map)] with size p_memsz.
+
+        super().__init__(va_start, phy_start, size, page_size=page_size, flags=flags)
+        self.va_end = self.va_start + size
+        self.filename = filename if filename else 'anonymous'
+        self.name = "{:016x}-{:016x}:sparse:{}".format(va_start, va_start + size, self.filename)
+        self.extents = sorted(extents, key=lambda e: e[0])
+        self.extent_starts = [e[0] for e in self.extents]
+        self.pos = 0
+
+    def get_source(self):
+        sources = {bm.get_source() for _, bm in self.extents}
+        return sources.pop() if len(sources) == 1 else None
+
+    def set_block_cache(self, block_cache):
+        for _, bm in self.extents:
+            if hasattr(bm, 'set_block_cache'):
+                bm.set_block_cache(block_cache)
+
+    def get_data_ranges(self):
+        ranges = []
+        for start, bm in self.extents:
+            stop = min(start + bm.get_size(), self.size)
+            for offset, size in bm.get_data_ranges():
+                lo = start + offset
+                hi = min(lo + size, stop)
+                if lo < hi:
+                    ranges.append((lo, hi - lo))
+        return ranges
+
+    def read_into(self, buf, offset):
+        if offset < 0 or offset >= self.size:
+            return 0
+        view = memoryview(buf).cast('B')
+        end = offset + min(len(view), self.size - offset)
+        pos = offset
+        idx = max(bisect_right(self.extent_starts, offset) - 1, 0)
+        while pos < end and idx < len(self.extents):
+            start, bm = self.extents[idx]
+            stop = min(end, start + bm.get_size())
+            idx += 1
+            if stop <= pos:
+                continue
+            if start >= end:
+                break
+            if start > pos:
+                fill_zeros(view[pos - offset:start - offset])
+                pos = start
+            got = bm.read_into(view[pos - offset:stop - offset], pos - start)
+            # backing data shorter than the extent reads as zeros
+            fill_zeros(view[pos - offset + got:stop - offset])
+            pos = stop
+        fill_zeros(view[pos - offset:end - offset])
+        return end - offset
+
+    def write_to(self, f, block_size=DUMP_BLOCK_SIZE):
+        start = f.tell()
+        written = 0
+        for offset, bm in self.extents:
+            f.seek(start + offset, os.SEEK_SET)
+            written += bm.write_to(f, block_size)
+        f.seek(start + self.size, os.SEEK_SET)
+        return written
@@ -1,5 +1,21 @@
+import array
+import copy
+import ctypes
+import sys
+
 from .consts import *
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# array.array typecodes keyed by (item size, signed)
+ARRAY_TYPECODES = {}
+for _code in 'QLIHB':
+    ARRAY_TYPECODES.setdefault((array.array(_code).itemsize, False), _code)
+    ARRAY_TYPECODES.setdefault((array.array(_code.lower()).itemsize, True), _code.lower())
+
 def get_page_mask(page_size):
     page_mask = MASK_64BIT
     while (page_mask & page_size) != 0:
@@ -17,14 +33,9 @@ def get_perms_str(flags):
     return get_flag_str(flags)
 
 def bytes_to_struct(data, cstruct_klass):
-    tmp = ctypes.cast(data, ctypes.POINTER(cstruct_klass)).contents
-    # there is an odd bug, but the data gets corrupted if we
-    # return directly after the cast, so we create a deep copy
-    # and return that value
-    # Note if there are any pointers in the struct it will fail
-    # https://stackoverflow.com/questions/1470343/python-ctypes-copying-structures-contents
-    dst = copy.deepcopy(tmp)
-    return dst
+    # a single copy of the data, the struct does not alias data
+    # Note if there are any pointers in the struct they are not followed
+    return cstruct_klass.from_buffer_copy(data)
 
 def json_serialize_struct(strct):
     r = {}
@@ -35,3 +46,39 @@ def json_serialize_struct(strct):
         else:
             r[f] = v
     return r
+
+
+def unpack_array(data, width, signed=False, littleendian=True):
+    '''
+    decode data as an array of width byte integers in one call.
+    returns a numpy array (a view over data when possible) or an
+    array.array when numpy is not available
+    '''
+    count = len(data) // width
+    if np is not None:
+        dtype = np.dtype('{}{}{}'.format('<' if littleendian else '>',
+                                         'i' if signed else 'u', width))
+        return np.frombuffer(data, dtype=dtype, count=count)
+
+    arr = array.array(ARRAY_TYPECODES[(width, signed)])
+    arr.frombytes(memoryview(data)[:count * width])
+    if littleendian != (sys.byteorder == 'little'):
+        arr.byteswap()
+    return arr
+
+
+def get_scan_ranges(bm, lead=0):
+    '''
+    merged [start, end) offsets of a memory map where something up to
+    lead + 1 bytes long can start without lying entirely in bytes the
+    map knows to be zero
+    '''
+    merged = []
+    for offset, size in sorted(bm.get_data_ranges()):
+        lo = max(0, offset - lead)
+        hi = offset + size
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return [(lo, hi) for lo, hi in merged]
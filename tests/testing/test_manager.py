@@ -1,12 +1,103 @@
 import os
+import json
+import array
+import asyncio
+import pickle
+import ctypes
+import zipfile
+import threading
 import unittest
 from ma_tk.manager import Manager
+from ma_tk import util
+from ma_tk.store.base_manager import UnmappedReadError
+from ma_tk.consts import GAP_ZERO, GAP_TRUNCATE
+from ma_tk.store.mapped import MmapBacked
+from ma_tk.store.io import IOBacked
+from ma_tk.store.sparse import ZeroBacked, SparseBacked
+from ma_tk.load.file import OpenFile, FileLoader
+from ma_tk.load.zipseek import SeekableZipMember
+from ma_tk.load.handles import HandlePool, PooledStream
+from ma_tk.load.elf import OpenELF
+from ma_tk.load.elfcache import ElfMetadataCache
+from ma_tk.processor.symbols import Symbol, SymbolIndex
 
+import struct
 import tempfile
 
 BUFFER_VA = 0x14000
 FILE_VA = 0x24000
 
+class Pair(ctypes.Structure):
+    _fields_ = [('first', ctypes.c_uint16), ('second', ctypes.c_uint16)]
+
+def make_core(segments, notes=()):
+    '''
+    minimal ELF64 core, segments are (vaddr, data, memsz, flags) and
+    notes (name, type, desc) go into a single PT_NOTE
+    '''
+    note = b''
+    for name, ntype, desc in notes:
+        name = name + b'\x00'
+        note += struct.pack('<III', len(name), len(desc), ntype)
+        note += name + bytes(-len(name) % 4) + desc + bytes(-len(desc) % 4)
+    phnum = len(segments) + (1 if notes else 0)
+    offset = 64 + 56 * phnum
+    phdrs = b''
+    body = b''
+    if notes:
+        phdrs += struct.pack('<IIQQQQQQ', 4, 0, offset, 0, 0, len(note), 0, 4)
+        body += note
+    for vaddr, data, memsz, flags in segments:
+        pad = -(offset + len(body)) % 0x1000
+        body += bytes(pad)
+        phdrs += struct.pack('<IIQQQQQQ', 1, flags, offset + len(body), vaddr, 0,
+                             len(data), memsz, 0x1000)
+        body += data
+    ident = b'\x7fELF' + bytes([2, 1, 1, 0]) + bytes(8)
+    header = struct.pack('<16sHHIQQQIHHHHHH', ident, 4, 62, 1, 0, 64, 0, 0,
+                         64, 56, phnum, 64, 0, 0)
+    return header + phdrs + body
+
+def make_nt_file(entries, page_size=0x1000):
+    '''
+    NT_FILE note descriptor, entries are (vm_start, vm_end, offset, filename)
+    '''
+    desc = struct.pack('<QQ', len(entries), page_size)
+    for vm_start, vm_end, offset, _ in entries:
+        desc += struct.pack('<QQQ', vm_start, vm_end, offset // page_size)
+    for entry in entries:
+        desc += entry[3].encode('utf-8') + b'\x00'
+    return (b'CORE', 0x46494c45, desc)
+
+def make_elf(symbols, size=0x3000):
+    '''
+    minimal ELF64 shared object with a .symtab of (name, value, size,
+    type) symbols and one PT_LOAD covering the file
+    '''
+    strtab = b'\x00'
+    symtab = bytes(24)
+    for name, value, sym_size, sym_type in symbols:
+        symtab += struct.pack('<IBBHQQ', len(strtab), 0x10 | sym_type, 0, 1, value, sym_size)
+        strtab += name.encode('utf-8') + b'\x00'
+    shstrtab = b'\x00.symtab\x00.strtab\x00.shstrtab\x00'
+    body = symtab + strtab + shstrtab
+    shoff = 64 + 56 + len(body)
+    shoff += -shoff % 8
+    sections = bytes(64)
+    offset = 64 + 56
+    sections += struct.pack('<IIQQQQIIQQ', 1, 2, 0, 0, offset, len(symtab), 2, 1, 8, 24)
+    offset += len(symtab)
+    sections += struct.pack('<IIQQQQIIQQ', 9, 3, 0, 0, offset, len(strtab), 0, 0, 1, 0)
+    offset += len(strtab)
+    sections += struct.pack('<IIQQQQIIQQ', 17, 3, 0, 0, offset, len(shstrtab), 0, 0, 1, 0)
+    phdr = struct.pack('<IIQQQQQQ', 1, 5, 0, 0, 0, size, size, 0x1000)
+    ident = b'\x7fELF' + bytes([2, 1, 1, 0]) + bytes(8)
+    header = struct.pack('<16sHHIQQQIHHHHHH', ident, 3, 62, 1, 0, 64, shoff, 0,
+                         64, 56, 1, 64, 4, 3)
+    data = header + phdr + body
+    data += bytes(shoff - len(data)) + sections
+    return data + bytes(max(0, size - len(data)))
+
 class TestManager(unittest.TestCase):
     TMP_FILE = None
     TMP_FILE_NAME = None
@@ -31,6 +122,76 @@ class TestManager(unittest.TestCase):
         mgr = Manager()
         self.assertTrue(True)
 
+    def test_read_span(self):
+        mgr = Manager()
+        mgr.add_buffermap(b'\x01'*0x10, BUFFER_VA, 0x10)
+        mgr.add_buffermap(b'\x02'*0x10, BUFFER_VA + 0x10, 0x10)
+        mgr.add_iomap(self.TMP_FILE_NAME, BUFFER_VA + 0x30, self.TMP_FILE_SZ)
+
+        data = mgr.read_span(BUFFER_VA + 0x8, 0x10)
+        self.assertTrue(data == b'\x01'*8 + b'\x02'*8)
+        data = mgr.read_at_vaddr(BUFFER_VA + 0xc, 8)
+        self.assertTrue(data == b'\x01'*4 + b'\x02'*4)
+
+        with self.assertRaises(UnmappedReadError):
+            mgr.read_span(BUFFER_VA + 0x18, 0x20)
+        data = mgr.read_span(BUFFER_VA + 0x18, 0x20, on_gap=GAP_ZERO)
+        self.assertTrue(data == b'\x02'*8 + b'\x00'*0x10 + b'\xab\xab\xcd\xcd'*2)
+        data = mgr.read_span(BUFFER_VA + 0x18, 0x20, on_gap=GAP_TRUNCATE)
+        self.assertTrue(data == b'\x02'*8)
+
+    def test_read_qwords(self):
+        mgr = Manager()
+        mgr.add_buffermap(b''.join(i.to_bytes(8, 'little') for i in range(4)), BUFFER_VA, 0x20)
+        mgr.add_buffermap(b''.join(i.to_bytes(8, 'little') for i in range(4, 8)), BUFFER_VA + 0x20, 0x20)
+        values = mgr.read_qwords(BUFFER_VA + 8, 6)
+        self.assertTrue(list(values) == [1, 2, 3, 4, 5, 6])
+        self.assertTrue(list(mgr.read_dwords(BUFFER_VA + 0x20, 2)) == [4, 0])
+        self.assertTrue(list(mgr.read_words(BUFFER_VA, 2, littleendian=False)) == [0, 0])
+        self.assertTrue(list(mgr.read_qwords(BUFFER_VA + 0x18, 1, signed=True)) == [3])
+        self.assertTrue(mgr.read_qwords(BUFFER_VA + 0x38, 2) is None)
+        bm = mgr.get_map(BUFFER_VA)
+        self.assertTrue(list(bm.read_qwords(BUFFER_VA, 4)) == [0, 1, 2, 3])
+        self.assertTrue(bm.read_qwords(BUFFER_VA, 5) is None)
+
+        saved = util.np
+        util.np = None
+        try:
+            values = mgr.read_qwords(BUFFER_VA + 8, 6, littleendian=False)
+            self.assertTrue(isinstance(values, array.array))
+            self.assertTrue(list(values) == [i << 56 for i in range(1, 7)])
+        finally:
+            util.np = saved
+
+    def test_read_cstruct(self):
+        mgr = Manager()
+        data = bytearray(b'\x01\x00\x02\x00' * 4)
+        mgr.add_buffermap(data, BUFFER_VA, len(data))
+        mgr.add_buffermap(b'\x03\x00\x04\x00', BUFFER_VA + len(data), 4)
+        mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, self.TMP_FILE_SZ)
+
+        pair = mgr.read_cstruct(Pair, BUFFER_VA + 4)
+        self.assertTrue((pair.first, pair.second) == (1, 2))
+        # bytearray backed maps are wrapped without copying
+        data[4] = 9
+        self.assertTrue(pair.first == 9)
+
+        pair = mgr.read_cstruct(Pair, BUFFER_VA + 0xe)
+        self.assertTrue((pair.first, pair.second) == (2, 3))
+        self.assertTrue(mgr.read_cstruct(Pair, BUFFER_VA + 0x12) is None)
+
+        pairs = mgr.read_cstruct_array(Pair, BUFFER_VA + 8, 3)
+        self.assertTrue([(p.first, p.second) for p in pairs] == [(1, 2), (1, 2), (3, 4)])
+
+        pairs = mgr.read_cstruct_array(Pair, FILE_VA, 2)
+        self.assertTrue([(p.first, p.second) for p in pairs] == [(0xabab, 0xcdcd)] * 2)
+        pair = mgr.get_map(FILE_VA).read_cstruct(Pair, addr=FILE_VA + 2)
+        self.assertTrue((pair.first, pair.second) == (0xcdcd, 0xabab))
+        self.assertTrue(util.json_serialize_struct(pair) == {'first': 0xcdcd, 'second': 0xabab})
+        # structures read from a shared file mapping are copies
+        pair.first = 0
+        self.assertTrue(mgr.read_cstruct(Pair, FILE_VA + 2).first == 0xcdcd)
+
     def test_load_buffer(self):
         mgr = Manager()
         self.assertTrue(True)
@@ -54,8 +215,32 @@ class TestManager(unittest.TestCase):
         self.assertTrue(BUFFER_VA in bm.get_page_cache())
         self.assertTrue(bm.calc_page(BUFFER_VA+4098) in bm.get_page_cache())
         self.assertTrue(bm.translate_vaddr_to_offset(BUFFER_VA+8) == 8)
+        self.assertTrue(mgr.does_map_exist(bm))
+        self.assertTrue(list(mgr.get_page_cache()) == list(bm.get_page_cache()))
+        # the manager's pages can be iterated more than once
+        pages = mgr.get_page_cache()
+        self.assertTrue(list(pages) == list(pages) and len(pages) == len(bm.get_page_cache()))
+        self.assertTrue(BUFFER_VA + 0x1000 in pages and BUFFER_VA + len(data) not in pages)
 
 
+    def test_unaligned_maps(self):
+        mgr = Manager()
+        first = mgr.add_buffermap(b'\x01'*0x10, BUFFER_VA + 0x8, 0x10)
+        second = mgr.add_buffermap(b'\x02'*0x20, BUFFER_VA + 0x18, 0x20)
+        self.assertTrue(first is not None and second is not None)
+        self.assertTrue(mgr.get_map(BUFFER_VA) is None)
+        self.assertTrue(mgr.get_map(BUFFER_VA + 0x8) is first)
+        self.assertTrue(mgr.get_map(BUFFER_VA + 0x17) is first)
+        self.assertTrue(mgr.get_map(BUFFER_VA + 0x18) is second)
+        self.assertTrue(mgr.get_map(BUFFER_VA + 0x38) is None)
+        # overlapping maps are rejected
+        self.assertTrue(mgr.add_buffermap(b'\x03'*0x10, BUFFER_VA + 0x30, 0x10) is None)
+        # both maps share one page
+        self.assertTrue(list(mgr.get_page_cache()) == [BUFFER_VA] and len(mgr.get_page_cache()) == 1)
+        self.assertTrue(mgr.remove_map_from_kb(first))
+        self.assertTrue(mgr.get_map(BUFFER_VA + 0x8) is None)
+        self.assertTrue(mgr.check_presence(vaddr=BUFFER_VA + 0x20))
+
     def test_load_buffer(self):
         mgr = Manager()
         self.assertTrue(True)
@@ -82,6 +267,7 @@ class TestManager(unittest.TestCase):
 
         mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, self.TMP_FILE_SZ, offset=0, flags=0, page_size=4096)
         self.assertTrue(mgr.get_vaddr_pos() == FILE_VA)
+        self.assertTrue(isinstance(mgr.get_map(FILE_VA), MmapBacked))
         data = mgr.read_word()
         self.assertTrue(43947 == data)
         mgr.seek(offset=-2)
@@ -96,5 +282,562 @@ class TestManager(unittest.TestCase):
         self.assertTrue(0xababcdcdababcdcd == data)
         del mgr
 
+    def test_load_file_shared_mmap(self):
+        mgr = Manager()
+        first = mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, 0x1000, offset=0)
+        second = mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA + 0x2000, 0x1000, offset=0x1002)
+        self.assertTrue(first.mm is second.mm)
+        self.assertTrue(len(mgr.mmaps) == 1)
+        self.assertTrue(mgr.read_at_vaddr(FILE_VA + 0x2000, 4) == b'\xcd\xcd\xab\xab')
+        self.assertTrue(mgr.read_qword(FILE_VA + 0x2000) == 0xababcdcdababcdcd)
+
+    def test_load_ioobj_positional(self):
+        mgr = Manager()
+        data = b'\x00\x11\x22\x33' * 1024
+        io_obj = OpenFile.from_bytes(data)
+        io_obj.seek(0x10)
+        first = mgr.add_ioobj(io_obj, FILE_VA, 0x100, offset=0x10)
+        second = mgr.add_ioobj(io_obj, FILE_VA + 0x1000, 0x100, offset=0x201)
+        self.assertTrue(isinstance(first, IOBacked))
+        self.assertTrue(mgr.read_dword(FILE_VA) == 0x33221100)
+        self.assertTrue(mgr.read_at_vaddr(FILE_VA + 0x1000, 3) == b'\x11\x22\x33')
+        self.assertTrue(mgr.read_word(FILE_VA + 0x2) == 0x3322)
+        # the shared stream position is left alone
+        self.assertTrue(io_obj.tell() == 0x10)
+
+    def test_read_many(self):
+        mgr = Manager()
+        data = bytes(range(256)) * 64
+        io_obj = OpenFile.from_bytes(data)
+        mgr.add_ioobj(io_obj, FILE_VA, len(data))
+        mgr.add_buffermap(b'\x01'*0x10, FILE_VA + len(data), 0x10)
+
+        calls = []
+        preadinto = io_obj.preadinto
+        def counting_preadinto(buf, offset):
+            calls.append((offset, len(buf)))
+            return preadinto(buf, offset)
+        io_obj.preadinto = counting_preadinto
+
+        requests = [(FILE_VA + i*0x40, 8) for i in range(0x100)][::-1]
+        requests += [(0x10, 4), (FILE_VA + len(data) - 2, 4), (FILE_VA + len(data) + 0xe, 4)]
+        results = mgr.read_many(requests, max_gap=0x100, max_read=0x2000)
+        # two merged reads plus the request crossing into the buffer map
+        self.assertTrue(len(calls) == 3)
+        for (vaddr, size), r in zip(requests[:0x100], results):
+            self.assertTrue(r == data[vaddr - FILE_VA:vaddr - FILE_VA + size])
+        self.assertTrue(results[0x100] is None)
+        self.assertTrue(results[0x101] == b'\xfe\xff\x01\x01')
+        self.assertTrue(results[0x102] is None)
+
+    def test_pickle(self):
+        tmp_zip = tempfile.NamedTemporaryFile(suffix='.zip')
+        with zipfile.ZipFile(tmp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('dump.bin', b'\x11\x22\x33\x44'*4096)
+
+        mgr = Manager()
+        mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, self.TMP_FILE_SZ)
+        mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA + 0x10000, 0x1000, offset=0x1000, file_size=0x800)
+        mgr.add_ioobj(OpenFile.from_zip(tmp_zip.name, 'dump.bin'), BUFFER_VA, 0x4000)
+        mgr.add_ioobj(OpenFile.from_bytes(b'\x55'*0x10), 0x1000, 0x10)
+        mgr.read_qword(BUFFER_VA)
+
+        data = pickle.dumps(mgr)
+        self.assertTrue(len(data) < 0x2000)
+        clone = pickle.loads(data)
+        self.assertTrue(clone.read_qword(FILE_VA) == 0xcdcdababcdcdabab)
+        self.assertTrue(clone.read_at_vaddr(BUFFER_VA + 4, 4) == b'\x11\x22\x33\x44')
+        self.assertTrue(clone.read_at_vaddr(0x1000, 2) == b'\x55\x55')
+        self.assertTrue(clone.get_map(BUFFER_VA).block_cache is clone.block_cache)
+        self.assertTrue(clone.get_map(FILE_VA).get_descriptor()['source'] == 'file://' + self.TMP_FILE_NAME)
+        # regions of one source share a single mapping again
+        self.assertTrue(len(clone.mmaps) == 1)
+        self.assertTrue(clone.get_map(FILE_VA).mm is clone.get_map(FILE_VA + 0x10000).extents[0][1].mm)
+        self.assertTrue(clone.read_qword(FILE_VA + 0x107fc) == 0xcdcdabab)
+        tmp_zip.close()
+
+    def test_dump(self):
+        mgr = Manager()
+        data = b'\x00' * 0x2000 + b'\x01' * 0x10 + b'\x00' * 0x1ff0
+        mgr.add_buffermap(data, BUFFER_VA, len(data))
+        mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, self.TMP_FILE_SZ + 0x1000)
+        mgr.add_ioobj(OpenFile.from_bytes(b'\x02' * 0x100), 0x1000, 0x100)
+
+        with tempfile.TemporaryDirectory() as dump_path:
+            manifest = mgr.dump(dump_path=dump_path, block_size=0x1000)
+            with open(os.path.join(dump_path, 'manifest.json')) as f:
+                self.assertTrue(json.load(f) == manifest)
+            self.assertTrue([r['va_start'] for r in manifest['regions']] == [0x1000, BUFFER_VA, FILE_VA])
+
+            expected = [b'\x02' * 0x100, data,
+                        b'\xab\xab\xcd\xcd'*4096 + b'\x00' * 0x1000]
+            # zero pages and the part past the end of the file are holes
+            written = [0x100, 0x1000, self.TMP_FILE_SZ]
+            for region, content, n in zip(manifest['regions'], expected, written):
+                self.assertTrue(region['size'] == len(content))
+                self.assertTrue(region['bytes_written'] == n)
+                with open(os.path.join(dump_path, region['filename']), 'rb') as f:
+                    self.assertTrue(f.read() == content)
+
+            # zero pages of file backed maps become holes as well, both
+            # written out zeros and holes of a sparse source file
+            tmp = tempfile.NamedTemporaryFile()
+            tmp.write(b'\x01' * 0x1000 + bytes(0x800000))
+            tmp.truncate(0x1000000)
+            tmp.seek(0xfff000)
+            tmp.write(b'\x02' * 0x1000)
+            tmp.flush()
+            bm = mgr.add_iomap(tmp.name, 0x10000000, 0x1000000)
+            self.assertTrue(bm.dump('sparse.bin', dump_path) == 0x2000)
+            path = os.path.join(dump_path, 'sparse.bin')
+            st = os.stat(path)
+            self.assertTrue(st.st_size == 0x1000000 and st.st_blocks * 512 < 0x100000)
+            with open(path, 'rb') as f:
+                self.assertTrue(f.read() == b'\x01' * 0x1000 + bytes(0xffe000) + b'\x02' * 0x1000)
+            mgr.remove_map_from_kb(bm)
+            tmp.close()
+
+            mgr.dump(filename='subset.json', dump_path=dump_path,
+                     regions=[mgr.get_map(FILE_VA)])
+            with open(os.path.join(dump_path, 'subset.json')) as f:
+                self.assertTrue(len(json.load(f)['regions']) == 1)
+
+    def test_snapshot(self):
+        mgr = Manager()
+        data = b'\x00' * 0x2000 + b'\x01' * 0x10 + b'\x00' * 0x1ff0
+        mgr.add_buffermap(data, BUFFER_VA + 1, len(data), flags=6)
+        mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, self.TMP_FILE_SZ + 0x10)
+        mgr.add_ioobj(OpenFile.from_bytes(b'\x02' * 0x100), 0x1000, 0x100)
+
+        with tempfile.TemporaryDirectory() as dump_path:
+            for compress in (False, True):
+                path = os.path.join(dump_path, 'snapshot-{}.bin'.format(compress))
+                self.assertTrue(mgr.save_snapshot(path, compress=compress, block_size=0x1000) == 3)
+                snap = Manager.open_snapshot(path)
+                self.assertTrue([bm.get_name() for bm in snap.region_index] ==
+                                [bm.get_name() for bm in mgr.region_index])
+                self.assertTrue(snap.get_map(BUFFER_VA + 1).flags == 6)
+                self.assertTrue(snap.read_span(BUFFER_VA + 1, len(data)) == data)
+                self.assertTrue(snap.read_span(0x1000, 0x100) == b'\x02' * 0x100)
+                self.assertTrue(snap.read_qword(FILE_VA + 0x3ffc) == 0xcdcdabab)
+                self.assertTrue(snap.read_at_vaddr(FILE_VA + 2, 4) == b'\xcd\xcd\xab\xab')
+                clone = pickle.loads(pickle.dumps(snap))
+                self.assertTrue(clone.read_span(BUFFER_VA + 1, len(data)) == data)
+
+    def test_compressed_buffer(self):
+        data = b'\x00' * 0x3000 + b'\xab\xab\xcd\xcd' * 0x400 + b'\x00' * 0x10
+        for codec in ('zlib', 'lzma'):
+            mgr = Manager()
+            cbm = mgr.add_compressed_buffermap(data, BUFFER_VA, block_size=0x1000, codec=codec)
+            self.assertTrue(cbm.get_compression_ratio() < 0.1)
+            self.assertTrue(cbm.blocks[0] == 0x1000 and cbm.blocks[-1] == 0x10)
+            self.assertTrue(mgr.read_span(BUFFER_VA, len(data)) == data)
+            self.assertTrue(mgr.read_qword(BUFFER_VA + 0x2ffc) == 0xcdcdabab00000000)
+            self.assertTrue(mgr.read_at_vaddr(BUFFER_VA + 0x3ffe, 4) == b'\xcd\xcd\x00\x00')
+            clone = pickle.loads(pickle.dumps(mgr))
+            self.assertTrue(clone.read_span(BUFFER_VA, len(data)) == data)
+
+        bm = mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, self.TMP_FILE_SZ)
+        cbm = mgr.compress_map(bm, block_size=0x1000)
+        self.assertTrue(mgr.get_map(FILE_VA) is cbm)
+        self.assertTrue(mgr.read_span(FILE_VA, self.TMP_FILE_SZ) == b'\xab\xab\xcd\xcd'*4096)
+
+    def test_zip_block_cache(self):
+        tmp_zip = tempfile.NamedTemporaryFile(suffix='.zip')
+        with zipfile.ZipFile(tmp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('dump.bin', b'\xab\xab\xcd\xcd'*4096)
+
+        mgr = Manager(block_cache_size=0x2000, block_cache_block_size=0x1000)
+        io_obj = OpenFile.from_zip(tmp_zip.name, 'dump.bin')
+        bm = mgr.add_ioobj(io_obj, FILE_VA, 0x4000)
+        self.assertTrue(bm.block_cache is mgr.block_cache)
+        for i in range(4):
+            self.assertTrue(mgr.read_qword(FILE_VA + 8*i) == 0xcdcdababcdcdabab)
+        stats = mgr.get_cache_stats()
+        self.assertTrue(stats['misses'] == 1 and stats['hits'] == 3)
+
+        # reads spanning blocks, evicting the least recently used one
+        data = mgr.read_at_vaddr(FILE_VA + 0x1ffe, 4)
+        self.assertTrue(data == b'\xcd\xcd\xab\xab')
+        stats = mgr.get_cache_stats()
+        self.assertTrue(stats['misses'] == 3 and stats['evictions'] == 1)
+        self.assertTrue(stats['bytes_used'] <= 0x2000)
+        self.assertTrue(mgr.read_qword(FILE_VA) == 0xcdcdababcdcdabab)
+        self.assertTrue(mgr.get_cache_stats()['misses'] == 4)
+
+        # large reads go around the cache
+        data = mgr.read_span(FILE_VA, 0x4000)
+        self.assertTrue(data == b'\xab\xab\xcd\xcd'*4096)
+        self.assertTrue(mgr.get_cache_stats()['misses'] == 4)
+        tmp_zip.close()
+
+    def test_zip_random_access(self):
+        data = b''.join(i.to_bytes(4, 'little') for i in range(0x40000))
+        tmp_zip = tempfile.NamedTemporaryFile(suffix='.zip')
+        with zipfile.ZipFile(tmp_zip.name, 'w') as zf:
+            zf.writestr('dump.bin', data, compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr('stored.bin', data[:0x1000], compress_type=zipfile.ZIP_STORED)
+            info = zf.getinfo('dump.bin')
+
+        member = SeekableZipMember(tmp_zip.name, info, checkpoint_interval=0x10000)
+        member.seek(0, os.SEEK_END)
+        self.assertTrue(member.tell() == len(data) and member.read(4) == b'')
+        for offset in (0xfff00, 0x10, 0x7fffc, 0x3fff8, 0x20000, 0xfffff):
+            member.seek(offset)
+            self.assertTrue(member.read(0x100) == data[offset:offset + 0x100])
+        # reads after a backwards seek start at the closest checkpoint
+        self.assertTrue(len(member.checkpoints) == 16)
+        member.seek(0x30010)
+        member.read(8)
+        self.assertTrue(member._upos == 0x30018)
+        member.close()
+
+        io_obj = OpenFile.from_zip(tmp_zip.name, 'dump.bin')
+        with io_obj.get_fd().lease() as handle:
+            self.assertTrue(isinstance(handle.raw, SeekableZipMember))
+        self.assertTrue(io_obj.pread(8, 0x40000) == data[0x40000:0x40008])
+        io_obj = OpenFile.from_zip(tmp_zip.name, 'stored.bin')
+        self.assertTrue(io_obj.pread(8, 0xff8) == data[0xff8:0x1000])
+
+        # other compressions fall back to zipfile, closing closes the archive
+        with zipfile.ZipFile(tmp_zip.name, 'a') as zf:
+            zf.writestr('bz2.bin', data[:0x1000], compress_type=zipfile.ZIP_BZIP2)
+        io_obj = OpenFile.from_zip(tmp_zip.name, 'bz2.bin')
+        with io_obj.get_fd().lease() as handle:
+            raw = handle.raw
+        self.assertTrue(io_obj.pread(8, 0x800) == data[0x800:0x808])
+        io_obj.close()
+        self.assertTrue(raw.closed and raw.zf.fp is None)
+
+        # extracted once next to the archive and memory mapped
+        with tempfile.TemporaryDirectory() as cache_dir:
+            mgr = Manager()
+            io_obj = OpenFile.from_zip(tmp_zip.name, 'dump.bin', extract=True, cache_dir=cache_dir)
+            bm = mgr.add_ioobj(io_obj, FILE_VA, len(data))
+            self.assertTrue(isinstance(bm, MmapBacked))
+            self.assertTrue(mgr.read_dword(FILE_VA + 0x40) == 0x10)
+            path = io_obj.get_filename()
+            again = OpenFile.from_zip(tmp_zip.name, 'dump.bin', extract=True, cache_dir=cache_dir)
+            self.assertTrue(again.get_filename() == path and len(os.listdir(cache_dir)) == 1)
+        tmp_zip.close()
+
+    def test_elf_core(self):
+        segments = [(0x400000, b'\x7fELF' + b'\x11' * 0x1ffc, 0x2000, 5),
+                     (0x600000, b'\x22' * 0x800, 0x3000, 6),
+                     (0x7ff000, b'', 0x1000, 6)]
+        tmp_core = tempfile.NamedTemporaryFile(suffix='.core')
+        tmp_core.write(make_core(segments))
+        tmp_core.flush()
+
+        mgr = Manager.from_elf_core(tmp_core.name)
+        self.assertTrue(len(mgr.maps) == 3)
+        # one mapping shared by every segment
+        self.assertTrue(len(mgr.mmaps) == 1)
+        self.assertTrue(mgr.read_at_vaddr(0x400000, 4) == b'\x7fELF')
+        self.assertTrue(mgr.get_map(0x400000).flags == 5)
+        # p_filesz < p_memsz reads zeros past the file data
+        self.assertTrue(isinstance(mgr.get_map(0x600000), SparseBacked))
+        self.assertTrue(mgr.read_span(0x6007fc, 8) == b'\x22' * 4 + bytes(4))
+        self.assertTrue(mgr.get_map(0x602fff).get_end() == 0x603000)
+        self.assertTrue(isinstance(mgr.get_map(0x7ff000), ZeroBacked))
+
+        tmp_zip = tempfile.NamedTemporaryFile(suffix='.zip')
+        with zipfile.ZipFile(tmp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.write(tmp_core.name, 'core')
+        zmgr = Manager.from_elf_core(tmp_zip.name)
+        self.assertTrue(len(zmgr.maps) == 3)
+        self.assertTrue(zmgr.read_span(0x400000, 0x2000) == mgr.read_span(0x400000, 0x2000))
+
+        # bulk adds reject overlaps the same way add_map_to_kb does
+        bm = mgr.add_buffermap(b'\x00' * 0x10, 0x401000)
+        self.assertTrue(bm is None)
+        rejected = mgr.add_maps_to_kb([mgr.get_map(0x400000)])
+        self.assertTrue(len(rejected) == 1 and len(mgr.maps) == 3)
+        tmp_zip.close()
+        tmp_core.close()
+
+    def test_elf_core_required_files(self):
+        lib_data = make_core([(0, b'\x33' * 0x2000, 0x2000, 5)])
+        lib_data += b'\x44' * (0x4000 - len(lib_data))
+        tmp_dir = tempfile.TemporaryDirectory()
+        lib_name = os.path.join(tmp_dir.name, 'libfake.so')
+        with open(lib_name, 'wb') as f:
+            f.write(lib_data)
+
+        # text only has its first page in the core, data is not dumped,
+        # and the other library can not be found
+        notes = [make_nt_file([(0x7f0000000000, 0x7f0000002000, 0, '/usr/lib/libfake.so'),
+                               (0x7f0000002000, 0x7f0000003000, 0x3000, '/usr/lib/libfake.so'),
+                               (0x7f0000010000, 0x7f0000011000, 0, '/usr/lib/libmissing.so')])]
+        segments = [(0x7f0000000000, b'\x7fELF' + bytes(0xffc), 0x2000, 5),
+                    (0x7f0000002000, b'', 0x1000, 6),
+                    (0x7f0000010000, b'', 0x1000, 4)]
+        tmp_core = tempfile.NamedTemporaryFile(suffix='.core')
+        tmp_core.write(make_core(segments, notes))
+        tmp_core.flush()
+
+        mgr = Manager.from_elf_core(tmp_core.name,
+                                    namespace='test_elf_core_required_files',
+                                    required_files_location={'libfake.so': lib_name})
+        # the file loader is only used from the calling thread
+        threads = set()
+        get_required_file = mgr.file_loader.get_required_file
+        def recording_get_required_file(filename):
+            threads.add(threading.current_thread())
+            return get_required_file(filename)
+        mgr.file_loader.get_required_file = recording_get_required_file
+        self.assertTrue(mgr.load_required_files(workers=2) == 2)
+        self.assertTrue(threads == {threading.current_thread()})
+        del mgr.file_loader.get_required_file
+        self.assertTrue(len(mgr.maps) == 3)
+        # dumped pages win over the file
+        self.assertTrue(mgr.read_at_vaddr(0x7f0000000000, 8) == b'\x7fELF' + bytes(4))
+        self.assertTrue(mgr.read_at_vaddr(0x7f0000001000, 8) == lib_data[0x1000:0x1008])
+        self.assertTrue(mgr.read_at_vaddr(0x7f0000002000, 8) == b'\x44' * 8)
+        self.assertTrue(isinstance(mgr.get_map(0x7f0000010000), ZeroBacked))
+        io_obj = mgr.file_loader.get_required_file('/usr/lib/libfake.so')
+        self.assertTrue(io_obj.get_file_type() == 'elf')
+        tmp_core.close()
+        tmp_dir.cleanup()
+
+    def test_symbolize(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        lib_name = os.path.join(tmp_dir.name, 'libsym.so')
+        with open(lib_name, 'wb') as f:
+            f.write(make_elf([('func_a', 0x1000, 0x20, 2), ('obj_b', 0x2000, 8, 1),
+                              ('no_size', 0x2100, 0, 2)]))
+
+        base = 0x7f0000000000
+        notes = [make_nt_file([(base, base + 0x3000, 0, '/usr/lib/libsym.so')])]
+        tmp_core = tempfile.NamedTemporaryFile(suffix='.core')
+        tmp_core.write(make_core([(base, b'', 0x3000, 5)], notes))
+        tmp_core.flush()
+
+        mgr = Manager.from_elf_core(tmp_core.name, load_required_files=True,
+                                    namespace='test_symbolize',
+                                    required_files_location={'libsym.so': lib_name},
+                                    elf_cache_dir=os.path.join(tmp_dir.name, 'cache'))
+        self.assertTrue(len(os.listdir(os.path.join(tmp_dir.name, 'cache'))) == 1)
+        sym = mgr.symbolize(base + 0x1010)
+        self.assertTrue(sym.name == 'func_a' and sym.vaddr == base + 0x1000)
+        self.assertTrue(sym.filename == '/usr/lib/libsym.so')
+        self.assertTrue(mgr.symbolize(base + 0x1020) is None)
+        self.assertTrue(len(mgr.symbol_index) == 3)
+
+        addrs = [base + 0x2004, base + 0x2100, base + 0x2101, base - 1, base + 0x1000]
+        names = [s.name if s else None for s in mgr.symbolize_many(addrs)]
+        self.assertTrue(names == ['obj_b', 'no_size', None, None, 'func_a'])
+
+        # nested and zero sized symbols do not shadow the enclosing one
+        index = SymbolIndex()
+        for name, vaddr, size in [('outer', 0x1000, 0x100), ('label', 0x1010, 0),
+                                  ('inner', 0x1020, 0x10), ('next', 0x1100, 0x10)]:
+            index.add_symbol(Symbol(name, vaddr, size, 'libsym.so'))
+        lookups = [0x1010, 0x1011, 0x1028, 0x1030, 0x10ff, 0x1100, 0x1110, 0xfff]
+        names = [s.name if s else None for s in (index.lookup(a) for a in lookups)]
+        self.assertTrue(names == ['label', 'outer', 'inner', 'outer', 'outer', 'next', None, None])
+        self.assertTrue([s.name if s else None for s in index.lookup_many(lookups)] == names)
+        tmp_core.close()
+        tmp_dir.cleanup()
+
+    def test_elf_metadata_cache(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        cache = ElfMetadataCache(os.path.join(tmp_dir.name, 'cache'))
+        lib_name = os.path.join(tmp_dir.name, 'libsym.so')
+        with open(lib_name, 'wb') as f:
+            f.write(make_elf([('func_a', 0x1000, 0x20, 2), ('obj_b', 0x2000, 8, 1)]))
+
+        io_obj = OpenELF.interpret(OpenFile.from_file(lib_name), cache)
+        md = OpenELF.get_metadata(io_obj, cache)
+        self.assertTrue(cache.hits == 0 and cache.misses == 2)
+        missed = io_obj.segments_by_offset
+        self.assertTrue([s.name for s in md.symbols] == ['func_a', 'obj_b'])
+
+        # a hit skips parsing entirely
+        io_obj = OpenELF.interpret(OpenFile.from_file(lib_name), cache)
+        self.assertTrue(cache.hits == 1 and io_obj.file_interp is None)
+        self.assertTrue(io_obj.get_file_type() == 'elf')
+        self.assertTrue(io_obj.segments_by_offset[0].p_type == 'PT_LOAD')
+        cached = OpenELF.get_metadata(io_obj, cache)
+        self.assertTrue(cached.symbols == md.symbols and cached.sections == md.sections)
+        self.assertTrue(io_obj.get_file_interpreter().header['e_type'] == 'ET_DYN')
+        # the same segment tuples whether or not the cache was hit
+        self.assertTrue(io_obj.segments_by_offset == missed)
+
+        # changed files and damaged entries are misses
+        entry = cache.get_entry_path(cache.get_key(lib_name))
+        with open(entry, 'r+b') as f:
+            f.write(b'junk')
+        self.assertTrue(cache.get(lib_name) is None)
+        cache.put(lib_name, md)
+        os.utime(lib_name, ns=(0, 0))
+        self.assertTrue(cache.get(lib_name) is None)
+        tmp_dir.cleanup()
+
+    def test_where_is_file(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        root = os.path.join(tmp_dir.name, 'sysroot')
+        for path, data in (('usr/lib/libc.so.6', b'libc'), ('opt/x/libc.so.6', b'other libc'),
+                           ('usr/lib/libm.so.6', b'libm')):
+            os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+            with open(os.path.join(root, path), 'wb') as f:
+                f.write(data)
+        os.symlink('usr/lib', os.path.join(root, 'lib'))
+        os.symlink('..', os.path.join(root, 'usr/lib/loop'))
+        os.symlink('missing', os.path.join(root, 'usr/lib/dangling.so'))
+        zip_name = os.path.join(tmp_dir.name, 'libs.zip')
+        with zipfile.ZipFile(zip_name, 'w') as zf:
+            zf.writestr('usr/lib/libz.so.1', b'libz')
+            zf.writestr('libc.so.6', b'zipped libc')
+
+        loader = FileLoader(namespace='test_where_is_file', required_files_dir=root,
+                            required_files_zip=zip_name,
+                            required_files_bytes={'libmem.so': b'libmem'})
+        where = loader.where_is_file
+        self.assertTrue(where('/usr/lib/libc.so.6') == os.path.join(root, 'usr/lib/libc.so.6'))
+        self.assertTrue(where('/opt/x/libc.so.6') == os.path.join(root, 'opt/x/libc.so.6'))
+        self.assertTrue(where('/lib/libm.so.6') == os.path.join(root, 'lib/libm.so.6'))
+        # duplicate basenames resolve to the shallowest directory entry
+        self.assertTrue(where('/elsewhere/libc.so.6') == os.path.join(root, 'lib/libc.so.6'))
+        self.assertTrue(where('dangling.so') is None and where('/nope/libnope.so') is None)
+
+        self.assertTrue(loader.load_file('/usr/lib/libz.so.1').read(0, 4) == b'libz')
+        self.assertTrue(loader.load_file('libmem.so').read(0, 6) == b'libmem')
+        self.assertTrue(loader.load_file('/usr/lib/libc.so.6').read(0, 4) == b'libc')
+
+        # explicit locations win over every other source
+        loader.update(required_files_location={'libc.so.6': os.path.join(root, 'opt/x/libc.so.6')})
+        self.assertTrue(where('/usr/lib/libc.so.6') == os.path.join(root, 'usr/lib/libc.so.6'))
+        self.assertTrue(where('/elsewhere/libc.so.6') == os.path.join(root, 'opt/x/libc.so.6'))
+        tmp_dir.cleanup()
+
+    def test_handle_pool(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        sources = []
+        for i in range(5):
+            name = os.path.join(tmp_dir.name, 'file{}.bin'.format(i))
+            with open(name, 'wb') as f:
+                f.write(bytes([i]) * 0x100)
+            sources.append('file://' + name)
+
+        pool = HandlePool(max_open=2)
+        streams = [PooledStream(source, OpenFile.open_handle, pool=pool) for source in sources]
+        # a second stream over a source shares its handle
+        streams.append(PooledStream(sources[0], OpenFile.open_handle, pool=pool))
+        for _ in range(2):
+            for i, stream in enumerate(streams):
+                self.assertTrue(stream.pread(4, 0x10) == bytes([i % 5]) * 4)
+        stats = pool.get_stats()
+        self.assertTrue(stats['open'] == 2 and stats['sources'] == 5)
+        self.assertTrue(stats['opens'] == stats['evictions'] + 2)
+
+        # independent positions over one handle
+        streams[0].seek(0x80)
+        streams[5].seek(0, os.SEEK_END)
+        self.assertTrue(streams[0].read(2) == b'\x00\x00' and streams[5].read(2) == b'')
+
+        # handles held by a read are not evicted
+        with streams[1].lease() as handle:
+            for stream in streams[2:5]:
+                stream.pread(1, 0)
+            self.assertTrue(pool.handles.get(sources[1]) is handle)
+            self.assertTrue(handle.pread(1, 0) == b'\x01')
+
+        # a cached handle is read without the pool lock
+        with pool.lock:
+            self.assertTrue(streams[4].pread(1, 0) == b'\x04')
+            if hasattr(os, 'fork'):
+                # forked children get a usable pool even though the lock is held
+                pid = os.fork()
+                if pid == 0:
+                    os._exit(0 if streams[2].pread(1, 0) == b'\x02' else 1)
+                self.assertTrue(os.waitpid(pid, 0)[1] == 0)
+
+        # the last reference closes the handle
+        for stream in streams:
+            stream.close()
+        self.assertTrue(pool.get_stats()['open'] == 0 and pool.get_stats()['sources'] == 0)
+
+        # FileObjs reopen through the process wide pool
+        io_obj = OpenFile.from_file(sources[3][len('file://'):])
+        self.assertTrue(isinstance(io_obj.get_fd(), PooledStream))
+        io_obj.close()
+        self.assertTrue(io_obj.read(0, 2) == b'\x03\x03')
+        tmp_dir.cleanup()
+
+    def test_zero_and_sparse(self):
+        mgr = Manager()
+        # a terabyte of zeros costs nothing to map
+        zbm = mgr.add_null_buffermap(1 << 40, 1 << 40)
+        self.assertTrue(isinstance(zbm, ZeroBacked))
+        self.assertTrue(mgr.read_qword((1 << 41) - 8) == 0)
+        self.assertTrue(mgr.read_span((1 << 40) + 0x1234, 0x20000) == bytes(0x20000))
+
+        # file bytes up to file_size, zeros after
+        bm = mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, 0x8000, offset=0x10, file_size=0x1000)
+        self.assertTrue(isinstance(bm, SparseBacked))
+        self.assertTrue(bm.get_size() == 0x8000)
+        self.assertTrue(mgr.read_qword(FILE_VA) == 0xcdcdababcdcdabab)
+        data = mgr.read_at_vaddr(FILE_VA + 0xffc, 8)
+        self.assertTrue(data == b'\xab\xab\xcd\xcd' + bytes(4))
+        self.assertTrue(mgr.read_span(FILE_VA + 0x1000, 0x7000) == bytes(0x7000))
+
+        # extents anywhere in the region
+        ext = mgr.add_buffermap(b'\x11' * 0x10, 0x1000)
+        mgr.remove_map_from_kb(ext)
+        sbm = mgr.add_sparse_map([(0x100, ext)], 0x80000, 0x1000)
+        data = mgr.read_at_vaddr(0x800f8, 0x20)
+        self.assertTrue(data == bytes(8) + b'\x11' * 0x10 + bytes(8))
+
+        clone = pickle.loads(pickle.dumps(mgr))
+        self.assertTrue(clone.read_span(FILE_VA, 0x1008) == mgr.read_span(FILE_VA, 0x1008))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bm.dump(dump_path=tmp_dir)
+            with open(os.path.join(tmp_dir, bm.get_dump_filename()), 'rb') as f:
+                self.assertTrue(f.read() == mgr.read_span(FILE_VA, 0x8000))
+
+    def test_async_reads(self):
+        mgr = Manager(async_workers=2)
+        mgr.add_buffermap(b'\x01'*0x10, BUFFER_VA, 0x10)
+        mgr.add_buffermap(b'\x02'*0x10, BUFFER_VA + 0x10, 0x10)
+        mgr.add_iomap(self.TMP_FILE_NAME, FILE_VA, self.TMP_FILE_SZ)
+
+        calls = []
+        pread = mgr._pread
+        def counting_pread(vaddr, size):
+            calls.append((vaddr, size))
+            return pread(vaddr, size)
+        mgr._pread = counting_pread
+
+        async def reads():
+            # identical reads in flight share one executor call
+            same = await asyncio.gather(*[mgr.aread(FILE_VA, 8) for _ in range(16)])
+            self.assertTrue(same == [b'\xab\xab\xcd\xcd'*2] * 16)
+            self.assertTrue(calls == [(FILE_VA, 8)])
+
+            self.assertTrue(await mgr.aread(BUFFER_VA + 0xc, 8) == b'\x01'*4 + b'\x02'*4)
+            self.assertTrue(await mgr.aread(0x10, 4) is None)
+            self.assertTrue(await mgr.aread_qword(FILE_VA) == 0xcdcdababcdcdabab)
+            self.assertTrue(await mgr.aread_qword(BUFFER_VA + 0x1c) is None)
+            pair = await mgr.aread_cstruct(Pair, FILE_VA + 2)
+            self.assertTrue((pair.first, pair.second) == (0xcdcd, 0xabab))
+
+            requests = [(FILE_VA + i*4, 4) for i in range(8)] + [(FILE_VA, 4)]
+            requests += [(BUFFER_VA + 0x1e, 4), (BUFFER_VA + 0xe, 4), (0x10, 4)]
+            results, again = await asyncio.gather(mgr.aread_many(requests),
+                                                  mgr.aread_many(requests[:2]))
+            self.assertTrue(results[:9] == [b'\xab\xab\xcd\xcd'] * 9)
+            self.assertTrue(results[9:] == [None, b'\x01\x01\x02\x02', None])
+            self.assertTrue(again == results[:2])
+            self.assertTrue(mgr._inflight == {})
+
+        asyncio.run(reads())
+        del mgr._pread
+        clone = pickle.loads(pickle.dumps(mgr))
+        self.assertTrue(asyncio.run(clone.aread_qword(FILE_VA)) == 0xcdcdababcdcdabab)
+        mgr.close_executor()
+        clone.close_executor()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,173 @@
+import time
+import unittest
+from ma_tk.manager import Manager
+from ma_tk.processor.pointers import PointerScanner
+from ma_tk.load.file import OpenFile
+from ma_tk.processor.pool import Processor, split_regions
+
+
+BUFFER_VA = 0x14000
+HEAP_VA = 0x40000
+
+def qwords(*values):
+    return b''.join(v.to_bytes(8, 'little') for v in values)
+
+def count_nonzero(mgr, chunk):
+    data = mgr.read_span(chunk.vaddr, chunk.size)
+    return chunk.size - data.count(0)
+
+def slow_first(mgr, chunk):
+    if chunk.vaddr == BUFFER_VA:
+        time.sleep(0.5)
+    return chunk.size
+
+class TestPointerScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager()
+        self.mgr.add_buffermap(qwords(HEAP_VA + 0x10, 0x41414141, BUFFER_VA, HEAP_VA + 0x30), BUFFER_VA, 0x20)
+        self.mgr.add_buffermap(qwords(0, BUFFER_VA + 0x18, 0, 0, 0, 0, HEAP_VA) + b'\x04\x00', HEAP_VA, 0x3a)
+
+    def test_scan(self):
+        table = self.mgr.scan_pointers()
+        found = [(int(r['source']), int(r['target']), int(r['region'])) for r in table]
+        self.assertTrue(found == [(BUFFER_VA, HEAP_VA + 0x10, 1),
+                                  (BUFFER_VA + 0x10, BUFFER_VA, 0),
+                                  (BUFFER_VA + 0x18, HEAP_VA + 0x30, 1),
+                                  (HEAP_VA + 0x8, BUFFER_VA + 0x18, 0),
+                                  (HEAP_VA + 0x30, HEAP_VA, 1)])
+
+    def test_scan_chunks(self):
+        scanner = PointerScanner(self.mgr, chunk_size=8)
+        table = scanner.scan()
+        self.assertTrue(len(table) == 5)
+        self.assertTrue(scanner.get_region(int(table[0]['region'])) is self.mgr.get_map(HEAP_VA))
+
+    def test_scan_unaligned(self):
+        table = self.mgr.scan_pointers(width=4, alignment=2, chunk_size=6)
+        sources = [int(r['source']) for r in table]
+        # the dword at +0x36 points at HEAP_VA only when read unaligned
+        self.assertTrue(HEAP_VA + 0x36 in sources)
+        self.assertTrue(HEAP_VA + 0x30 in sources)
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager()
+        data = bytearray(0x100)
+        for offset in (0x0, 0x3e, 0x7f, 0xfc):
+            data[offset:offset+4] = b'MATK'
+        self.data = data
+        self.mgr.add_buffermap(bytes(data), BUFFER_VA, len(data))
+        io_obj = OpenFile.from_bytes(bytes(data))
+        self.mgr.add_ioobj(io_obj, HEAP_VA, len(data))
+
+    def test_search(self):
+        expected = [BUFFER_VA + o for o in (0x0, 0x3e, 0x7f, 0xfc)] + \
+                   [HEAP_VA + o for o in (0x0, 0x3e, 0x7f, 0xfc)]
+        self.assertTrue(list(self.mgr.search(b'MATK')) == expected)
+        # chunk boundaries fall inside the matches
+        self.assertTrue(list(self.mgr.search(b'MATK', chunk_size=0x40)) == expected)
+
+    def test_search_across_regions(self):
+        mgr = Manager()
+        mgr.add_buffermap(b'xxMA', 0x1000, 4)
+        mgr.add_buffermap(b'TKyy', 0x1004, 4)
+        mgr.add_buffermap(b'MATK', 0x1010, 4)
+        self.assertTrue(mgr.read_span(0x1000, 8) == b'xxMATKyy')
+        self.assertTrue(list(mgr.search(b'MATK')) == [0x1002, 0x1010])
+        self.assertTrue(list(mgr.search(b'A.K', regex=True, max_match=3)) == [0x1003, 0x1011])
+        # the gap before 0x1010 is not bridged
+        self.assertTrue(list(mgr.search(b'yyMA')) == [])
+
+    def test_search_workers(self):
+        mgr = Manager()
+        mgr.add_buffermap(b'xxMA', 0x1000, 4)
+        mgr.add_buffermap(b'TKyy' + bytes(0x3c) + b'MATK' * 0x10, 0x1004, 0x80)
+        mgr.add_buffermap(b'MATK', 0x2000, 4)
+        expected = list(mgr.search(b'MATK', chunk_size=0x10))
+        self.assertTrue(expected == [0x1002] + [0x1044 + 4 * i for i in range(0x10)] + [0x2000])
+        matches = mgr.search(b'MATK', chunk_size=0x10, workers=2)
+        self.assertTrue(next(matches) == 0x1002)
+        self.assertTrue([0x1002] + list(matches) == expected)
+
+    def test_search_empty_pattern(self):
+        with self.assertRaises(ValueError):
+            self.mgr.search(b'')
+        with self.assertRaises(ValueError):
+            list(self.mgr.search(''))
+
+    def test_search_overlapping(self):
+        mgr = Manager()
+        mgr.add_buffermap(b'xaaaax', BUFFER_VA, 6)
+        self.assertTrue(list(mgr.search(b'aa')) == [BUFFER_VA + 1, BUFFER_VA + 2, BUFFER_VA + 3])
+        # overlapping matches straddling a chunk boundary
+        self.assertTrue(list(mgr.search(b'aa', chunk_size=2)) == [BUFFER_VA + 1, BUFFER_VA + 2, BUFFER_VA + 3])
+
+    def test_search_regex(self):
+        matches = self.mgr.search(b'MA[A-Z]K', regex=True, chunk_size=0x40, max_match=4,
+                                  regions=[self.mgr.get_map(HEAP_VA)])
+        self.assertTrue(list(matches) == [HEAP_VA + o for o in (0x0, 0x3e, 0x7f, 0xfc)])
+        self.assertTrue(next(self.mgr.search('MATK')) == BUFFER_VA)
+
+
+    def test_skip_zero_runs(self):
+        mgr = Manager()
+        zbm = mgr.add_null_buffermap(1 << 40, 1 << 40)
+        ext = mgr.add_buffermap(b'\x00\x01\x00\x00MATK', 0x1000)
+        mgr.remove_map_from_kb(ext)
+        mgr.add_sparse_map([(0x10000, ext)], BUFFER_VA, 0x20000)
+
+        def no_reads(offset, size):
+            raise Exception("zero map read")
+        zbm.read_buffer = no_reads
+        # a pointer (to 1 << 40) straddling the start of the data is still found
+        table = mgr.scan_pointers(width=8, alignment=4)
+        self.assertTrue([int(r['source']) for r in table] == [BUFFER_VA + 0x10000 - 4])
+        self.assertTrue(list(mgr.search(b'MATK', chunk_size=0x100)) == [BUFFER_VA + 0x10004])
+        self.assertTrue(list(mgr.search(b'MA.K', regex=True, max_match=4)) == [BUFFER_VA + 0x10004])
+
+        # patterns that match zeros still find them in zero runs
+        mgr = Manager()
+        mgr.add_null_buffermap(BUFFER_VA, 0x10)
+        self.assertTrue(list(mgr.search(b'\x00' * 8)) == [BUFFER_VA + i for i in range(9)])
+
+
+class TestProcessor(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager()
+        self.mgr.add_buffermap(b'\x01\x00' * 0x800, BUFFER_VA, 0x1000)
+        self.mgr.add_buffermap(b'\x01' * 0x10, HEAP_VA, 0x10)
+
+    def test_split_regions(self):
+        chunks = split_regions(self.mgr, chunk_size=0x300)
+        self.assertTrue(len(chunks) == 7)
+        self.assertTrue(chunks[0].size == 0x300 and chunks[-1].size == 0x10)
+        self.assertTrue(sum(c.size for c in chunks) == 0x1010)
+
+    def test_run(self):
+        for workers in (0, 2):
+            processor = Processor(self.mgr, workers=workers, chunk_size=0x300)
+            self.assertTrue(processor.run(count_nonzero, lambda a, b: a + b) == 0x810)
+            results = processor.run(count_nonzero)
+            self.assertTrue(results == [0x180] * 5 + [0x80, 0x10])
+
+    def test_run_empty(self):
+        processor = Processor(Manager(), workers=0)
+        self.assertTrue(processor.run(count_nonzero, lambda a, b: a + b) is None)
+        self.assertTrue(processor.run(count_nonzero, lambda a, b: a + b, initial=0) == 0)
+
+    def test_map_completion_order(self):
+        # the slow chunk does not hold back the ones finished after it
+        mgr = Manager()
+        mgr.add_buffermap(b'\x01' * 0x100, BUFFER_VA, 0x100)
+        mgr.add_buffermap(b'\x00' * 0x10, HEAP_VA, 0x10)
+        processor = Processor(mgr, workers=2, chunk_size=0x100)
+        order = [chunk.vaddr for chunk, _ in processor.map(slow_first)]
+        self.assertTrue(order == [HEAP_VA, BUFFER_VA])
+
+
+if __name__ == '__main__':
+    unittest.main()